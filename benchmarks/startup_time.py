@@ -0,0 +1,118 @@
+"""Measure the start-up cost of every carto_extension.py action.
+
+For each action, a fresh interpreter imports the tool and parses the
+arguments of the action, which is the fixed cost paid before anything useful
+happens. The script also reports which heavy dependencies (provider SDKs,
+pandas, shapely, the test stack...) are already loaded at that point: none of
+them should be, as they are imported on demand by the code that uses them.
+
+Actions that don't need a data warehouse (`check` and `package`) are also run
+end to end, so their total time is reported too.
+
+Usage:
+    python benchmarks/startup_time.py [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = [
+    "google.cloud.bigquery",
+    "snowflake.connector",
+    "oracledb",
+    "pandas",
+    "numpy",
+    "shapely",
+    "pytest",
+    "tqdm",
+    "toml",
+    "dotenv",
+]
+
+ACTIONS = [
+    "check",
+    "package",
+    "deploy",
+    "test",
+    "capture",
+    "update",
+    "gc",
+    "benchmark",
+    "run-function",
+]
+OFFLINE_ACTIONS = ["check", "package"]
+# Arguments that some actions need to be parsed
+ACTION_ARGUMENTS = {"run-function": ["--function", "example_python"]}
+
+MEASURE_CODE = """
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import carto_extension
+
+carto_extension.parser.parse_args({arguments!r})
+ready = time.perf_counter()
+loaded = [m for m in {heavy_modules!r} if m in sys.modules]
+if {run_action!r}:
+    carto_extension.main({arguments!r})
+end = time.perf_counter()
+print(json.dumps({{"startup": ready - start, "total": end - start, "loaded": loaded}}))
+"""
+
+
+def measure(action, run_action):
+    code = MEASURE_CODE.format(
+        arguments=[action, *ACTION_ARGUMENTS.get(action, [])],
+        heavy_modules=HEAVY_MODULES,
+        run_action=run_action,
+    )
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT_FOLDER,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    wall = time.perf_counter() - start
+    measurement = json.loads(output.strip().splitlines()[-1])
+    measurement["wall"] = wall
+    return measurement
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of runs per action"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'action':<12} {'import (ms)':>12} {'process (ms)':>13} "
+        f"{'action (ms)':>12}  heavy modules loaded at start-up"
+    )
+    for action in ACTIONS:
+        run_action = action in OFFLINE_ACTIONS
+        runs = [measure(action, run_action) for _ in range(args.repeat)]
+        startup = statistics.median(r["startup"] for r in runs) * 1000
+        wall = statistics.median(r["wall"] for r in runs) * 1000
+        total = (
+            f"{statistics.median(r['total'] for r in runs) * 1000:12.1f}"
+            if run_action
+            else f"{'-':>12}"
+        )
+        loaded = ", ".join(runs[0]["loaded"]) or "none"
+        print(f"{action:<12} {startup:12.1f} {wall:13.1f} {total}  {loaded}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,154 @@
+from __future__ import annotations
+
 import argparse
 import base64
+import functools
 import hashlib
-import io
 import json
 import math
+import operator
 import os
-import pickle
 import re
 import tempfile
+import threading
 import urllib.request
 import zipfile
 from pathlib import Path
 from sys import argv
 from textwrap import dedent
-from typing import Any, Optional
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Optional
 from uuid import uuid4
 
-import numpy as np
-import pandas as pd
-import pytest
-import snowflake.connector
-import oracledb
-import toml
-from dotenv import dotenv_values, load_dotenv
-from google.cloud import bigquery
-from shapely import wkt
-from shapely.geometry import shape
-from shapely.wkt import dumps
-from tqdm import tqdm
+# Provider SDKs, pandas/numpy, shapely and the test stack are imported inside
+# the functions that need them, so that actions like `check` and `package`
+# don't pay for imports they never use.
+if TYPE_CHECKING:
+    import pandas as pd
+    from google.cloud import bigquery
 
 WORKFLOWS_TEMP_SCHEMA = "WORKFLOWS_TEMP"
 EXTENSIONS_TABLENAME = "WORKFLOWS_EXTENSIONS"
 WORKFLOWS_TEMP_PLACEHOLDER = "@@workflows_temp@@"
 FUNCTION_PREFIX = "__func_"
 STORED_PROCEDURE_PREFIX = "__stproc_"
+BUILD_CACHE_FOLDER = ".carto_build"
+
+# Maximum number of test cases that run concurrently on each provider
+MAX_TEST_JOBS = {"bigquery": 16, "snowflake": 8, "oracle": 4, "local": 8}
+
+# Schema of the local engine (see --engine), when the test schema of the data
+# warehouse isn't configured
+LOCAL_WORKFLOWS_TEMP = "workflows_temp"
+
+# Test input tables are named after (and setup tables are tagged with) a hash
+# of their content, so they are only uploaded when their data changes
+TEST_INPUT_TABLE_PREFIX = "_test_input_"
+TEST_TABLE_HASH_TAG = "carto_test_content_hash"
+
+# Output tables of the tests are named with this prefix and a random suffix.
+# They are dropped at the end of each run, in batches of DROP_BATCH_SIZE; on
+# BigQuery they also expire after EXPIRATION_HOURS, in case the run is
+# interrupted (see the gc action for the other providers)
+TEST_OUTPUT_TABLE_PREFIX = "_table_"
+TEST_OUTPUT_TABLE_EXPIRATION_HOURS = 24
+TEST_OUTPUT_TABLE_DROP_BATCH_SIZE = 500
+
+# Test tables are staged in memory up to this size (in bytes), then on disk
+TEST_TABLE_SPOOL_SIZE = 64 * 1024 * 1024
+
+# Rows generated to run a function without an input file (see run-function)
+FUNCTION_RUN_ROWS = 10000
+
+# Handler of vectorized Snowflake Python UDFs ("vectorized": true in their
+# metadata), which passes each batch of rows to main() (or main_vectorized())
+# as NumPy arrays, and the dtype kinds allowed in the results of each return
+# type (results of other types aren't checked)
+SF_VECTORIZED_HANDLER = "carto_vectorized_main"
+SF_VECTORIZED_RESULT_KINDS = {
+    "NUMBER": "iuf",
+    "DECIMAL": "iuf",
+    "NUMERIC": "iuf",
+    "INT": "iu",
+    "INTEGER": "iu",
+    "BIGINT": "iu",
+    "SMALLINT": "iu",
+    "TINYINT": "iu",
+    "FLOAT": "iuf",
+    "FLOAT4": "iuf",
+    "FLOAT8": "iuf",
+    "DOUBLE": "iuf",
+    "DOUBLE PRECISION": "iuf",
+    "REAL": "iuf",
+    "VARCHAR": "OU",
+    "CHAR": "OU",
+    "CHARACTER": "OU",
+    "STRING": "OU",
+    "TEXT": "OU",
+    "BOOLEAN": "b",
+}
+# dtype kinds of the values of object arrays (with NULL results), by their
+# pandas inferred type ("empty" arrays only have NULLs, and aren't checked)
+SF_VECTORIZED_INFERRED_KINDS = {
+    "empty": "",
+    "integer": "i",
+    "floating": "f",
+    "mixed-integer-float": "f",
+    "decimal": "f",
+    "boolean": "b",
+    "string": "U",
+}
+
+# Rows and runs of each function in the benchmark action (see --rows and
+# --repeats)
+FUNCTION_BENCHMARK_ROWS = 1_000_000
+FUNCTION_BENCHMARK_REPEATS = 3
+
+# Rows the input tables are scaled to and runs at each scale when
+# benchmarking a component (see --scales and --repeats), and the scaling
+# exponent of its duration or bytes processed above which it's flagged
+COMPONENT_BENCHMARK_SCALES = (1000, 100_000, 10_000_000)
+COMPONENT_BENCHMARK_REPEATS = 1
+SUPERLINEAR_SCALING_EXPONENT = 1.15
+
+# Credits per hour of each Snowflake warehouse size, to estimate the credits
+# used by benchmark queries from their execution time
+SF_WAREHOUSE_CREDITS_PER_HOUR = {
+    "XSMALL": 1,
+    "SMALL": 2,
+    "MEDIUM": 4,
+    "LARGE": 8,
+    "XLARGE": 16,
+    "2XLARGE": 32,
+    "3XLARGE": 64,
+    "4XLARGE": 128,
+    "5XLARGE": 256,
+    "6XLARGE": 512,
+}
+
+# Rows per executemany() call when uploading Oracle test tables (can be
+# overridden with the OR_UPLOAD_BATCH_SIZE env var)
+OR_UPLOAD_BATCH_SIZE = 5000
+
+# Rows used to infer the schema of test tables without a .schema file (can be
+# overridden with the TEST_SCHEMA_SAMPLE_ROWS env var; 0 scans the whole file)
+TEST_SCHEMA_SAMPLE_ROWS = 1000
 
 # Initialize verbose flag
 verbose = False
 
+# Reuse generated metadata and SQL code from the build cache (see --no-cache)
+use_build_cache = True
+_build_manifest = None
+_tool_source_hash = None
+
+# Save inferred test table schemas as .schema files (see --write-schema)
+write_test_schemas = False
+
+# Where tests run: "warehouse" (the data warehouse of the provider) or
+# "local" (an embedded DuckDB database, see --engine)
+test_engine = "warehouse"
+
 
 # CI environment detection
 def is_ci_environment():
@@ -51,15 +162,23 @@ class GeometryComparator:
 
     When reusing test suites from BigQuery to Snowflake, there was the need to
     have a single, unified interface capable of handling both WKT and GeoJSON.
+
+    Geometries are compared and hashed by their WKT rounded to 5 decimals,
+    which is computed only once.
     """
 
+    __slots__ = ("_shapely_geom", "_canonical_wkt")
+
     def __init__(self, shapely_geom):
         """Initialize with a shapely geometry object."""
         self._shapely_geom = shapely_geom
+        self._canonical_wkt = None
 
     @classmethod
     def from_wkt(cls, wkt_string: str) -> "GeometryComparator":
         """Create GeometryComparator from WKT string."""
+        from shapely import wkt
+
         try:
             geom = wkt.loads(wkt_string)
             return cls(geom)
@@ -71,6 +190,8 @@ class GeometryComparator:
     @classmethod
     def from_geojson(cls, geojson_dict: dict) -> "GeometryComparator":
         """Create GeometryComparator from GeoJSON dictionary."""
+        from shapely.geometry import shape
+
         try:
             geom = shape(geojson_dict)
             return cls(geom)
@@ -85,6 +206,9 @@ class GeometryComparator:
 
         Tries WKT first, then GeoJSON, raises error otherwise.
         """
+        from shapely import wkt
+        from shapely.geometry import shape
+
         try:
             geom = wkt.loads(value)
             return cls(geom)
@@ -101,9 +225,70 @@ class GeometryComparator:
         # Neither worked, raise error
         raise ValueError(f"Could not parse as WKT or GeoJSON: {value}")
 
+    @classmethod
+    def from_geography_strings(cls, values) -> list[Optional["GeometryComparator"]]:
+        """Create GeometryComparators from a sequence of WKT or GeoJSON strings.
+
+        The whole sequence is parsed at once with shapely's vectorized
+        functions, and the canonical WKT of every geometry is computed in the
+        same pass. Values that aren't geometries give None.
+        """
+        import numpy as np
+        import shapely
+
+        values = list(values)
+        strings = np.array(
+            [value if isinstance(value, str) else None for value in values],
+            dtype=object,
+        )
+        geoms = shapely.from_wkt(strings, on_invalid="ignore")
+
+        # Try the strings that aren't WKT as GeoJSON
+        pending = np.array(
+            [
+                geom is None and string is not None
+                for geom, string in zip(geoms, strings)
+            ],
+            dtype=bool,
+        )
+        if pending.any():
+            try:
+                geoms[pending] = shapely.from_geojson(
+                    strings[pending], on_invalid="ignore"
+                )
+            except Exception:
+                # GeoJSON reading needs GEOS >= 3.10, parse one by one otherwise
+                for i in np.flatnonzero(pending):
+                    try:
+                        geoms[i] = cls.from_geography_string(strings[i])._shapely_geom
+                    except ValueError:
+                        pass
+
+        canonical_wkts = shapely.to_wkt(geoms, rounding_precision=5, trim=False)
+        comparators = []
+        for geom, canonical_wkt in zip(geoms, canonical_wkts):
+            if geom is None:
+                comparators.append(None)
+                continue
+            comparator = cls(geom)
+            comparator._canonical_wkt = canonical_wkt
+            comparators.append(comparator)
+        return comparators
+
     def to_wkt(self, rounding_precision=5) -> str:
         """Convert GeometryComparator back to WKT string."""
-        return dumps(self._shapely_geom, rounding_precision=rounding_precision)
+        import shapely
+
+        if rounding_precision == 5:
+            if self._canonical_wkt is None:
+                self._canonical_wkt = shapely.to_wkt(
+                    self._shapely_geom, rounding_precision=5, trim=False
+                )
+            return self._canonical_wkt
+
+        return shapely.to_wkt(
+            self._shapely_geom, rounding_precision=rounding_precision, trim=False
+        )
 
     @property
     def geom_type(self) -> str:
@@ -118,60 +303,139 @@ class GeometryComparator:
         return self.to_wkt() == other.to_wkt()
 
     def __hash__(self):
-        """Hash based on WKT representation."""
-        return hash(self._shapely_geom.wkt)
+        """Hash based on the same rounded WKT used for equality."""
+        return hash(self.to_wkt())
 
     def __repr__(self):
         """String representation."""
         return f"GeometryComparator({self.to_wkt()})"
 
 
-load_dotenv()
+_env_loaded = False
+
+
+def load_env():
+    """Load the variables in the `.env` file into the environment (only once)."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _env_loaded = True
+
+
+def bq_workflows_temp():
+    load_env()
+    return f"`{os.getenv('BQ_TEST_PROJECT')}.{os.getenv('BQ_TEST_DATASET')}`"
+
+
+def sf_workflows_temp():
+    load_env()
+    return f"{os.getenv('SF_TEST_DATABASE')}.{os.getenv('SF_TEST_SCHEMA')}"
+
+
+def or_workflows_temp():
+    load_env()
+    return os.getenv("OR_TEST_SCHEMA", "CARTO_AT")
 
-bq_workflows_temp = f"`{os.getenv('BQ_TEST_PROJECT')}.{os.getenv('BQ_TEST_DATASET')}`"
-sf_workflows_temp = f"{os.getenv('SF_TEST_DATABASE')}.{os.getenv('SF_TEST_SCHEMA')}"
-or_workflows_temp = os.getenv("OR_TEST_SCHEMA", "CARTO_AT")
 
+def local_workflows_temp(provider: str) -> str:
+    """Schema of the local engine, named as in the data warehouse if it's configured.
+
+    Keeping the same name lets SQL code reference tables by their full name.
+    """
+    load_env()
+    if provider == "bigquery" and os.getenv("BQ_TEST_PROJECT") and os.getenv(
+        "BQ_TEST_DATASET"
+    ):
+        return bq_workflows_temp()
+    elif provider == "snowflake" and os.getenv("SF_TEST_DATABASE") and os.getenv(
+        "SF_TEST_SCHEMA"
+    ):
+        return sf_workflows_temp()
+    elif provider == "oracle":
+        return or_workflows_temp()
+    return LOCAL_WORKFLOWS_TEMP
+
+
+# Clients are created on first use, which can happen in the threads that run
+# test queries concurrently
+_clients_lock = threading.RLock()
 sf_client_instance = None
 bq_client_instance = None
+bq_storage_client_instance = None
 or_client_instance = None
+or_pool_instance = None
+or_connection_params = None
 or_wallet_temp_dir = None
+duckdb_client_instance = None
+duckdb_has_spatial = False
 
 
 def bq_client():
     global bq_client_instance
-    if bq_client_instance is None:
-        try:
-            bq_client_instance = bigquery.Client(project=os.getenv("BQ_TEST_PROJECT"))
-        except Exception as e:
-            raise Exception(f"Error connecting to BigQuery: {e}")
+    with _clients_lock:
+        if bq_client_instance is None:
+            from google.cloud import bigquery
+
+            load_env()
+            try:
+                bq_client_instance = bigquery.Client(
+                    project=os.getenv("BQ_TEST_PROJECT")
+                )
+            except Exception as e:
+                raise Exception(f"Error connecting to BigQuery: {e}")
     return bq_client_instance
 
 
+def bq_storage_client():
+    """Return a BigQuery Storage Read API client, or None if it's not installed."""
+    global bq_storage_client_instance
+    with _clients_lock:
+        if bq_storage_client_instance is None:
+            try:
+                from google.cloud import bigquery_storage
+            except ImportError:
+                return None
+
+            load_env()
+            try:
+                bq_storage_client_instance = bigquery_storage.BigQueryReadClient()
+            except Exception as e:
+                raise Exception(f"Error connecting to BigQuery Storage: {e}")
+    return bq_storage_client_instance
+
+
 def sf_client():
     global sf_client_instance
-    if sf_client_instance is None:
-        try:
-            sf_client_instance = snowflake.connector.connect(
-                user=os.getenv("SF_USER"),
-                password=os.getenv("SF_PASSWORD"),
-                account=os.getenv("SF_ACCOUNT"),
-                database=os.getenv("SF_TEST_DATABASE"),
-                schema=os.getenv("SF_TEST_SCHEMA"),
-            )
-        except Exception as e:
-            raise Exception(f"Error connecting to SnowFlake: {e}")
+    with _clients_lock:
+        if sf_client_instance is None:
+            import snowflake.connector
+
+            load_env()
+            try:
+                sf_client_instance = snowflake.connector.connect(
+                    user=os.getenv("SF_USER"),
+                    password=os.getenv("SF_PASSWORD"),
+                    account=os.getenv("SF_ACCOUNT"),
+                    database=os.getenv("SF_TEST_DATABASE"),
+                    schema=os.getenv("SF_TEST_SCHEMA"),
+                )
+            except Exception as e:
+                raise Exception(f"Error connecting to SnowFlake: {e}")
     return sf_client_instance
 
 
-def or_client():
-    global or_client_instance, or_wallet_temp_dir
-    if or_client_instance is None:
-        try:
-            import tempfile
+def _or_connection_params():
+    """Connection parameters for Oracle, extracting the wallet if needed."""
+    global or_connection_params, or_wallet_temp_dir
+    with _clients_lock:
+        if or_connection_params is None:
             import atexit
             import shutil
 
+            load_env()
+
             # Handle wallet if configured
             wallet_dir = None
             wallet_location = os.getenv("OR_WALLET_LOCATION")
@@ -189,7 +453,7 @@ def or_client():
             elif wallet_location:
                 wallet_dir = wallet_location
 
-            or_client_instance = oracledb.connect(
+            or_connection_params = dict(
                 user=os.getenv("OR_USER"),
                 password=os.getenv("OR_PASSWORD"),
                 dsn=os.getenv("OR_CONNECTION_STRING"),
@@ -197,11 +461,73 @@ def or_client():
                 wallet_location=wallet_dir,
                 wallet_password=os.getenv("OR_WALLET_PASSWORD"),
             )
-        except Exception as e:
-            raise Exception(f"Error connecting to Oracle: {e}")
+    return or_connection_params
+
+
+def or_client():
+    global or_client_instance
+    with _clients_lock:
+        if or_client_instance is None:
+            import oracledb
+
+            try:
+                or_client_instance = oracledb.connect(**_or_connection_params())
+            except Exception as e:
+                raise Exception(f"Error connecting to Oracle: {e}")
     return or_client_instance
 
 
+def or_pool():
+    """Pool of Oracle connections, for queries that run concurrently.
+
+    A single Oracle connection runs one statement at a time, so the test
+    queries that run in parallel (including the dry and full run of each test
+    case) take their own connection from this pool.
+    """
+    global or_pool_instance
+    with _clients_lock:
+        if or_pool_instance is None:
+            import oracledb
+
+            try:
+                or_pool_instance = oracledb.create_pool(
+                    **_or_connection_params(),
+                    min=1,
+                    max=2 * MAX_TEST_JOBS["oracle"],
+                    increment=1,
+                )
+            except Exception as e:
+                raise Exception(f"Error connecting to Oracle: {e}")
+    return or_pool_instance
+
+
+def duckdb_client():
+    """In-memory DuckDB database of the local engine.
+
+    Geographies are stored as geometries of the spatial extension, which is
+    installed the first time if needed. Without it, they are kept as text.
+    """
+    global duckdb_client_instance, duckdb_has_spatial
+    with _clients_lock:
+        if duckdb_client_instance is None:
+            import duckdb
+
+            duckdb_client_instance = duckdb.connect()
+            try:
+                try:
+                    duckdb_client_instance.execute("LOAD spatial")
+                except duckdb.Error:
+                    duckdb_client_instance.execute("INSTALL spatial")
+                    duckdb_client_instance.execute("LOAD spatial")
+                duckdb_has_spatial = True
+            except duckdb.Error as e:
+                print(
+                    "Warning: could not load the DuckDB spatial extension, "
+                    f"geographies will be kept as text: {e}"
+                )
+    return duckdb_client_instance
+
+
 def add_namespace_to_component_names(metadata):
     for component in metadata["components"]:
         component["name"] = f'{metadata["name"]}.{component["name"]}'
@@ -220,6 +546,160 @@ def _encode_image(image_path):
             return f"data:image/png;base64,{base64.b64encode(f.read()).decode('utf-8')}"
 
 
+def _content_hash(*parts) -> str:
+    """Hash a sequence of str/bytes parts, keeping the boundaries between them."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def _read_bytes(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _build_cache_folder() -> str:
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_folder, BUILD_CACHE_FOLDER)
+
+
+def _write_json_atomically(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=os.path.dirname(path), suffix=".tmp", delete=False
+    ) as f:
+        json.dump(value, f)
+    os.replace(f.name, path)
+
+
+def _build_cache_manifest() -> dict:
+    """Load the manifest that maps every cached unit to its current key."""
+    global _build_manifest
+    if _build_manifest is None:
+        manifest_file = os.path.join(_build_cache_folder(), "manifest.json")
+        try:
+            with open(manifest_file, "r") as f:
+                _build_manifest = json.load(f)
+        except (OSError, ValueError):
+            _build_manifest = {}
+    return _build_manifest
+
+
+def _cached_build(kind: str, unit: str, key_parts: list, build):
+    """Return the build output of a unit, reusing it from the build cache.
+
+    The cache key is a hash of the inputs of the unit (`key_parts`) and of the
+    source of this script, so any change in either regenerates the unit. When
+    a unit is rebuilt, its previous entry is removed from the cache.
+
+    Args:
+        kind: Type of build output (e.g. 'component', 'procedure_bigquery')
+        unit: Name of the component or function being built
+        key_parts: Contents the build output depends on
+        build: Function that generates the output when it's not cached
+    """
+    global _tool_source_hash
+    if not use_build_cache:
+        return build()
+
+    if _tool_source_hash is None:
+        _tool_source_hash = _content_hash(_read_bytes(os.path.abspath(__file__)))
+    key = _content_hash(kind, _tool_source_hash, *key_parts)
+    entry_file = os.path.join(_build_cache_folder(), kind, f"{key}.json")
+    try:
+        with open(entry_file, "r") as f:
+            return json.load(f)["value"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    value = build()
+    if not value:
+        # Don't cache failed builds, so that their errors are reported again
+        return value
+
+    _write_json_atomically(entry_file, {"value": value})
+    manifest = _build_cache_manifest()
+    previous_key = manifest.setdefault(kind, {}).get(unit)
+    if previous_key and previous_key != key:
+        previous_file = os.path.join(_build_cache_folder(), kind, f"{previous_key}.json")
+        if os.path.exists(previous_file):
+            os.unlink(previous_file)
+    manifest[kind][unit] = key
+    _write_json_atomically(
+        os.path.join(_build_cache_folder(), "manifest.json"), manifest
+    )
+    return value
+
+
+def _referenced_variable_values(code: str, provider: str) -> str:
+    """Values of the @@variables@@ that code references (empty if there are none).
+
+    Unset variables have a null value, so they fail when the code is deployed.
+    """
+    names = sorted({name.upper() for name in VARIABLE_PATTERN.findall(code)})
+    if not names:
+        return ""
+    variables = _get_substitution_variables(provider)
+    return json.dumps({name: variables.get(name) for name in names})
+
+
+def _build_component_metadata(
+    metadata, component, components_folder, icon_folder, variable_values=""
+):
+    metadata_file = os.path.join(components_folder, component, "metadata.json")
+    with open(metadata_file, "r") as f:
+        component_metadata = json.load(f)
+        component_metadata["group"] = metadata["title"]
+        component_metadata["cartoEnvVars"] = component_metadata.get(
+            "cartoEnvVars", []
+        )
+
+    fullrun_file = os.path.join(components_folder, component, "src", "fullrun.sql")
+    with open(fullrun_file, "r") as f:
+        fullrun_code = f.read()
+    dryrun_file = os.path.join(components_folder, component, "src", "dryrun.sql")
+    with open(dryrun_file, "r") as f:
+        dryrun_code = f.read()
+
+    # The hash covers everything the generated procedure depends on (including
+    # the values of the variables substituted in its code), so that incremental
+    # deploys can tell which procedures changed from their name
+    signature = json.dumps(
+        [
+            component_metadata.get("inputs", []),
+            component_metadata.get("outputs", []),
+            component_metadata["cartoEnvVars"],
+        ],
+        sort_keys=True,
+    )
+    code_hash = (
+        int(
+            hashlib.sha256(
+                (fullrun_code + dryrun_code + signature + variable_values).encode(
+                    "utf-8"
+                )
+            ).hexdigest(),
+            16,
+        )
+        % 10**8
+    )
+    # Use PROC_ for Oracle, __proc_ for BigQuery/Snowflake
+    if metadata.get("provider") == "oracle":
+        component_metadata["procedureName"] = f"PROC_{component}_{code_hash}"
+    else:
+        component_metadata["procedureName"] = f"__proc_{component}_{code_hash}"
+    icon_filename = component_metadata.get("icon")
+    if icon_filename:
+        icon_full_path = os.path.join(icon_folder, icon_filename)
+        component_metadata["icon"] = _encode_image(icon_full_path)
+
+    return component_metadata
+
+
 def create_metadata():
     current_folder = os.path.dirname(os.path.abspath(__file__))
     metadata_file = os.path.join(current_folder, "metadata.json")
@@ -233,31 +713,38 @@ def create_metadata():
         icon_full_path = os.path.join(icon_folder, icon_filename)
         metadata["icon"] = _encode_image(icon_full_path)
     for component in metadata["components"]:
-        metadata_file = os.path.join(components_folder, component, "metadata.json")
-        with open(metadata_file, "r") as f:
-            component_metadata = json.load(f)
-            component_metadata["group"] = metadata["title"]
-            component_metadata["cartoEnvVars"] = component_metadata.get(
-                "cartoEnvVars", []
+        component_folder = os.path.join(components_folder, component)
+        component_metadata_contents = _read_bytes(
+            os.path.join(component_folder, "metadata.json")
+        )
+        fullrun_code = _read_bytes(os.path.join(component_folder, "src", "fullrun.sql"))
+        dryrun_code = _read_bytes(os.path.join(component_folder, "src", "dryrun.sql"))
+        variable_values = _referenced_variable_values(
+            (fullrun_code + dryrun_code).decode("utf-8"), metadata.get("provider", "")
+        )
+        key_parts = [
+            metadata["title"],
+            metadata.get("provider", ""),
+            component,
+            component_metadata_contents,
+            fullrun_code,
+            dryrun_code,
+            variable_values,
+        ]
+        component_icon = json.loads(component_metadata_contents).get("icon")
+        if component_icon and os.path.exists(os.path.join(icon_folder, component_icon)):
+            key_parts.append(_read_bytes(os.path.join(icon_folder, component_icon)))
+
+        components.append(
+            _cached_build(
+                "component",
+                component,
+                key_parts,
+                lambda: _build_component_metadata(
+                    metadata, component, components_folder, icon_folder, variable_values
+                ),
             )
-            components.append(component_metadata)
-
-        fullrun_file = os.path.join(components_folder, component, "src", "fullrun.sql")
-        with open(fullrun_file, "r") as f:
-            fullrun_code = f.read()
-
-        code_hash = (
-            int(hashlib.sha256(fullrun_code.encode("utf-8")).hexdigest(), 16) % 10**8
         )
-        # Use PROC_ for Oracle, __proc_ for BigQuery/Snowflake
-        if metadata.get("provider") == "oracle":
-            component_metadata["procedureName"] = f"PROC_{component}_{code_hash}"
-        else:
-            component_metadata["procedureName"] = f"__proc_{component}_{code_hash}"
-        icon_filename = component_metadata.get("icon")
-        if icon_filename:
-            icon_full_path = os.path.join(icon_folder, icon_filename)
-            component_metadata["icon"] = _encode_image(icon_full_path)
 
     metadata["components"] = components
     return metadata
@@ -365,6 +852,8 @@ def _extract_pep723_metadata(python_code: str) -> dict:
             if line.strip()
         )
 
+        import toml
+
         metadata = toml.loads(toml_content)
         dependencies = metadata.get("dependencies", [])
 
@@ -494,6 +983,12 @@ def generate_function_sql_bigquery(function_metadata: dict) -> str:
             print(f"Error in function {func_name}: {e}")
             return ""
 
+        if function_metadata.get("vectorized"):
+            print(
+                f"Warning: BigQuery doesn't support vectorized Python UDFs, "
+                f"'{func_name}' will call main() once per row"
+            )
+
         # BigQuery Python UDF format
         packages_str = ",".join([f"'{pkg}'" for pkg in packages]) if packages else ""
         options = []
@@ -583,6 +1078,77 @@ def generate_function_sql_bigquery(function_metadata: dict) -> str:
         return ""
 
 
+def _python_package_name(requirement: str) -> str:
+    return re.split(r"[<>=!~;\[\s]", requirement.strip(), maxsplit=1)[0].lower()
+
+
+def _snowflake_vectorized_handler(function_metadata: dict) -> str:
+    """Generate the handler of a vectorized Snowflake Python UDF.
+
+    The handler receives each batch of rows as a pandas DataFrame, calls
+    `main_vectorized()` (or `main()`, if the function doesn't define it) with
+    one NumPy array per parameter, and checks that the result has one value
+    per row, of a type that matches the return type of the function.
+
+    Raises:
+        ValueError: If `max_batch_size` isn't a positive integer
+    """
+    max_batch_size = function_metadata.get("max_batch_size")
+    decorator_args = "input=_carto_pandas.DataFrame"
+    if max_batch_size is not None:
+        if (
+            not isinstance(max_batch_size, int)
+            or isinstance(max_batch_size, bool)
+            or max_batch_size < 1
+        ):
+            raise ValueError(
+                f"Function '{function_metadata['name']}' has an invalid "
+                f"max_batch_size: {max_batch_size!r} (must be a positive integer)"
+            )
+        decorator_args += f", max_batch_size={max_batch_size}"
+
+    return_type = function_metadata["returns"]["type"]
+    result_kinds = SF_VECTORIZED_RESULT_KINDS.get(
+        return_type.split("(")[0].strip().upper()
+    )
+    type_check = ""
+    if result_kinds:
+        # NULL results (None) make an array of objects, so the type of the
+        # other values is checked instead
+        type_check = f"""
+            kind = result.dtype.kind
+            if kind == "O":
+                kind = {SF_VECTORIZED_INFERRED_KINDS!r}.get(
+                    _carto_pandas.api.types.infer_dtype(result, skipna=True), "O"
+                )
+            if kind and kind not in {result_kinds!r}:
+                raise TypeError(
+                    f"{{function.__name__}}() returned values of type "
+                    f"{{result.dtype}} for a function that returns {return_type}"
+                )"""
+    return dedent(
+        f"""
+        import numpy as _carto_numpy
+        import pandas as _carto_pandas
+        from _snowflake import vectorized as _carto_vectorized
+
+
+        @_carto_vectorized({decorator_args})
+        def {SF_VECTORIZED_HANDLER}(df):
+            function = globals().get("main_vectorized", main)
+            result = _carto_numpy.asarray(
+                function(*(df[column].to_numpy() for column in df.columns))
+            )
+            if result.shape != (len(df),):
+                raise ValueError(
+                    f"{{function.__name__}}() returned an array of shape "
+                    f"{{result.shape}} for a batch of {{len(df)}} rows"
+                ){type_check}
+            return _carto_pandas.Series(result, index=df.index)
+        """
+    ).strip()
+
+
 def generate_function_sql_snowflake(function_metadata: dict) -> str:
     """Generate Snowflake SQL code for a single function or procedure.
 
@@ -705,6 +1271,22 @@ def generate_function_sql_snowflake(function_metadata: dict) -> str:
             print(f"Error in function {func_name}: {e}")
             return ""
 
+        handler = "main"
+        if function_metadata.get("vectorized"):
+            if func_type == "procedure":
+                print(
+                    f"Warning: Procedure '{func_name}' can't be vectorized, "
+                    f"ignoring its 'vectorized' option"
+                )
+            else:
+                # The handler needs pandas, which comes with NumPy
+                if "pandas" not in map(_python_package_name, packages):
+                    packages = [*packages, "pandas"]
+                clean_python_code += "\n\n\n" + _snowflake_vectorized_handler(
+                    function_metadata
+                )
+                handler = SF_VECTORIZED_HANDLER
+
         # Snowflake Python UDF/stored procedure format
         packages_str = ",".join([f"'{pkg}'" for pkg in packages]) if packages else ""
         packages_clause = f"PACKAGES = ({packages_str})" if packages else ""
@@ -750,7 +1332,7 @@ def generate_function_sql_snowflake(function_metadata: dict) -> str:
             LANGUAGE PYTHON
             RUNTIME_VERSION = '{python_version}'
             {packages_clause}{extra_options_line}
-            HANDLER = 'main'
+            HANDLER = '{handler}'
             AS
             $$\n{clean_python_code}\n$$;
             """
@@ -793,6 +1375,33 @@ def generate_function_sql_snowflake(function_metadata: dict) -> str:
         return ""
 
 
+def _procedure_code_key_parts(component: dict) -> list:
+    """Contents the generated procedure of a component depends on."""
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    src_folder = os.path.join(current_folder, "components", component["name"], "src")
+    return [
+        json.dumps(component, sort_keys=True),
+        _read_bytes(os.path.join(src_folder, "fullrun.sql")),
+        _read_bytes(os.path.join(src_folder, "dryrun.sql")),
+    ]
+
+
+def _function_code_key_parts(function_metadata: dict) -> list:
+    """Contents the generated SQL of a function depends on."""
+    src_folder = function_metadata["_path"] / "src"
+    key_parts = [
+        json.dumps(
+            {k: v for k, v in function_metadata.items() if k != "_path"},
+            sort_keys=True,
+        )
+    ]
+    if src_folder.exists():
+        for definition_file in sorted(src_folder.iterdir()):
+            if definition_file.is_file():
+                key_parts += [definition_file.name, _read_bytes(definition_file)]
+    return key_parts
+
+
 def get_functions_code(
     provider: str = "bigquery", extension_metadata: Optional[dict] = None
 ) -> str:
@@ -805,16 +1414,44 @@ def get_functions_code(
     Returns:
         SQL code to create all functions
     """
+    function_codes = [
+        func_code
+        for _, func_code in get_function_entries(provider, extension_metadata)
+        if func_code
+    ]
+
+    if function_codes:
+        return "\n\n".join(function_codes)
+    else:
+        return ""
+
+
+def get_function_entries(
+    provider: str = "bigquery", extension_metadata: Optional[dict] = None
+) -> list[tuple[str, str]]:
+    """Generate the code of every UDF, along with the name used to track it.
+
+    Functions are tracked in the extensions table with a prefix that tells
+    functions and stored procedures apart (e.g. `__func_MY_FUNCTION`).
+
+    Args:
+        provider: Target provider ('bigquery' or 'snowflake')
+        extension_metadata: Extension metadata to validate functions against
+
+    Returns:
+        List of (tracking name, SQL code) tuples, with an empty code for the
+        functions that could not be generated
+    """
     functions = discover_functions(extension_metadata=extension_metadata)
     if not functions:
-        return ""
+        return []
 
-    function_codes = []
+    function_entries = []
     for function_metadata in functions:
         if provider == "bigquery":
-            func_code = generate_function_sql_bigquery(function_metadata)
+            generate_function_sql = generate_function_sql_bigquery
         elif provider == "snowflake":
-            func_code = generate_function_sql_snowflake(function_metadata)
+            generate_function_sql = generate_function_sql_snowflake
         elif provider == "oracle":
             raise NotImplementedError(
                 f"User-defined functions (UDFs) are not supported for Oracle. "
@@ -825,16 +1462,31 @@ def get_functions_code(
         else:
             raise ValueError(f"Unsupported provider: {provider}")
 
-        if func_code:
-            function_codes.append(func_code)
+        func_code = _cached_build(
+            f"function_{provider}",
+            function_metadata["name"],
+            _function_code_key_parts(function_metadata),
+            lambda: generate_function_sql(function_metadata),
+        )
+        if function_metadata.get("type", "function") == "procedure":
+            func_entry = f"{STORED_PROCEDURE_PREFIX}{function_metadata['name'].upper()}"
+        else:
+            func_entry = f"{FUNCTION_PREFIX}{function_metadata['name'].upper()}"
+        function_entries.append((func_entry, func_code))
 
-    if function_codes:
-        return "\n\n".join(function_codes)
-    else:
-        return ""
+    return function_entries
 
 
 def get_procedure_code_bq(component):
+    return _cached_build(
+        "procedure_bigquery",
+        component["name"],
+        _procedure_code_key_parts(component),
+        lambda: _generate_procedure_code_bq(component),
+    )
+
+
+def _generate_procedure_code_bq(component):
     current_folder = os.path.dirname(os.path.abspath(__file__))
     components_folder = os.path.join(current_folder, "components")
     fullrun_file = os.path.join(
@@ -890,26 +1542,59 @@ def get_procedure_code_bq(component):
     return procedure_code
 
 
-def create_sql_code_bq(metadata):
+def _procedure_entry_bq(component):
+    """Name used to track the procedure of a component in BigQuery."""
+    return component["procedureName"]
+
+
+def _procedure_entry_sf(component):
+    """Name used to track the procedure of a component in Snowflake.
+
+    Snowflake procedures are overloaded by signature, so the input types are
+    needed to drop them.
+    """
+    param_types = [f"{p['type']}" for p in component["inputs"]]
+    return f"{component['procedureName']}({','.join(param_types)})"
+
+
+def create_sql_code_bq(metadata, kept_entries=()):
+    """Generate the SQL script that installs the extension.
+
+    Args:
+        metadata: Extension metadata, as returned by `create_metadata`
+        kept_entries: Procedures and functions (as tracked in the extensions
+            table) that are already installed and unchanged. They are neither
+            dropped nor created again, which allows incremental deploys.
+    """
     functions_code = ""
     function_names = []
     if metadata.get("functions"):
-        functions_code = get_functions_code("bigquery", extension_metadata=metadata)
+        function_entries = get_function_entries("bigquery", extension_metadata=metadata)
         # Get function names for tracking with appropriate prefixes
-        functions = discover_functions(extension_metadata=metadata)
-        function_names = []
-        for func in functions:
-            func_type = func.get("type", "function")
-            if func_type == "procedure":
-                function_names.append(f"{STORED_PROCEDURE_PREFIX}{func['name'].upper()}")
-            else:
-                function_names.append(f"{FUNCTION_PREFIX}{func['name'].upper()}")
+        function_names = [func_entry for func_entry, _ in function_entries]
+        functions_code = "\n\n".join(
+            func_code
+            for func_entry, func_code in function_entries
+            if func_code and func_entry not in kept_entries
+        )
 
     procedures_code = ""
     for component in metadata["components"]:
+        if _procedure_entry_bq(component) in kept_entries:
+            continue
         procedure_code = get_procedure_code_bq(component)
         procedures_code += "\n" + procedure_code
-    procedures = [c["procedureName"] for c in metadata["components"]]
+    procedures = [_procedure_entry_bq(c) for c in metadata["components"]]
+
+    kept_check = ""
+    if kept_entries:
+        kept_list = ", ".join(f"'{e}'" for e in sorted(kept_entries))
+        kept_check = (
+            "\n" + " " * 16 + f"IF proceduresArray[ORDINAL(i)] IN UNNEST([{kept_list}]) THEN"
+            "\n" + " " * 20 + "-- Unchanged since the previous installation"
+            "\n" + " " * 20 + "CONTINUE;"
+            "\n" + " " * 16 + "END IF;"
+        )
 
     metadata_string = json.dumps(metadata).replace("\\n", "\\\\n")
     code = dedent(
@@ -937,7 +1622,7 @@ def create_sql_code_bq(metadata):
                 SET i = i + 1;
                 IF i > ARRAY_LENGTH(proceduresArray) THEN
                     LEAVE;
-                END IF;
+                END IF;{kept_check}
                 -- Check if this is custom function or procedure based on prefix
                 IF STARTS_WITH(proceduresArray[ORDINAL(i)], '{FUNCTION_PREFIX}') THEN
                     EXECUTE IMMEDIATE 'DROP FUNCTION IF EXISTS {WORKFLOWS_TEMP_PLACEHOLDER}.' || SUBSTR(proceduresArray[ORDINAL(i)], {len(FUNCTION_PREFIX) + 1});
@@ -969,6 +1654,15 @@ def create_sql_code_bq(metadata):
 
 
 def get_procedure_code_sf(component):
+    return _cached_build(
+        "procedure_snowflake",
+        component["name"],
+        _procedure_code_key_parts(component),
+        lambda: _generate_procedure_code_sf(component),
+    )
+
+
+def _generate_procedure_code_sf(component):
     current_folder = os.path.dirname(os.path.abspath(__file__))
     components_folder = os.path.join(current_folder, "components")
     fullrun_file = os.path.join(
@@ -1048,6 +1742,15 @@ def _strip_sql_comments(sql_code):
 
 
 def get_procedure_code_oracle(component):
+    return _cached_build(
+        "procedure_oracle",
+        component["name"],
+        _procedure_code_key_parts(component),
+        lambda: _generate_procedure_code_oracle(component),
+    )
+
+
+def _generate_procedure_code_oracle(component):
     current_folder = os.path.dirname(os.path.abspath(__file__))
     components_folder = os.path.join(current_folder, "components")
     fullrun_file = os.path.join(
@@ -1116,29 +1819,44 @@ def get_procedure_code_oracle(component):
     return procedure_code + "\n/"
 
 
-def create_sql_code_sf(metadata):
+def create_sql_code_sf(metadata, kept_entries=()):
+    """Generate the SQL script that installs the extension.
+
+    Args:
+        metadata: Extension metadata, as returned by `create_metadata`
+        kept_entries: Procedures and functions (as tracked in the extensions
+            table) that are already installed and unchanged. They are neither
+            dropped nor created again, which allows incremental deploys.
+    """
     functions_code = ""
     function_names = []
     if metadata.get("functions"):
-        functions_code = get_functions_code("snowflake", extension_metadata=metadata)
+        function_entries = get_function_entries("snowflake", extension_metadata=metadata)
         # Get function names for tracking with appropriate prefixes
-        functions = discover_functions(extension_metadata=metadata)
-        function_names = []
-        for func in functions:
-            func_type = func.get("type", "function")
-            if func_type == "procedure":
-                function_names.append(f"{STORED_PROCEDURE_PREFIX}{func['name'].upper()}")
-            else:
-                function_names.append(f"{FUNCTION_PREFIX}{func['name'].upper()}")
+        function_names = [func_entry for func_entry, _ in function_entries]
+        functions_code = "\n\n".join(
+            func_code
+            for func_entry, func_code in function_entries
+            if func_code and func_entry not in kept_entries
+        )
 
     procedures_code = ""
     for component in metadata["components"]:
+        if _procedure_entry_sf(component) in kept_entries:
+            continue
         procedure_code = get_procedure_code_sf(component)
         procedures_code += "\n" + procedure_code
-    procedures = []
-    for c in metadata["components"]:
-        param_types = [f"{p['type']}" for p in c["inputs"]]
-        procedures.append(f"{c['procedureName']}({','.join(param_types)})")
+    procedures = [_procedure_entry_sf(c) for c in metadata["components"]]
+    kept_check = ""
+    if kept_entries:
+        kept_list = ", ".join(f"'{e}'" for e in sorted(kept_entries))
+        kept_check = (
+            "\n" + " " * 24 + f"IF (ARRAY_CONTAINS(proc_item::VARIANT, ARRAY_CONSTRUCT({kept_list}))) THEN"
+            "\n" + " " * 28 + "-- Unchanged since the previous installation"
+            "\n" + " " * 28 + "i := i + 1;"
+            "\n" + " " * 28 + "CONTINUE;"
+            "\n" + " " * 24 + "END IF;"
+        )
     metadata_string = json.dumps(metadata).replace("\\n", "\\\\n").replace("'", "\\'")
     procedures_string = ";".join(procedures).replace("'", "'")
     code = dedent(
@@ -1168,7 +1886,7 @@ def create_sql_code_sf(metadata):
                 BEGIN
                     proc_array := SPLIT(procedures, ';');
                     WHILE (i < ARRAY_SIZE(proc_array)) DO
-                        proc_item := proc_array[i];
+                        proc_item := proc_array[i];{kept_check}
                         -- Check if this is a function or procedure based on prefix
                         IF (STARTSWITH(proc_item, '{FUNCTION_PREFIX}')) THEN
                             BEGIN
@@ -1304,46 +2022,207 @@ def create_sql_code_oracle(metadata):
     return code
 
 
-def deploy_bq(metadata, destination):
-    print("Deploying extension to BigQuery...")
-    if not destination:
-        destination = bq_workflows_temp
-    elif not (destination.startswith("`") and destination.endswith("`")):
-        destination = f"`{destination}`"
+def _registered_entries_bq(extension_name, destination) -> set[str]:
+    """Procedures and functions currently registered for the extension."""
+    from google.api_core.exceptions import NotFound
+    from google.cloud import bigquery
 
-    sql_code = create_sql_code_bq(metadata)
-    sql_code = sql_code.replace(WORKFLOWS_TEMP_PLACEHOLDER, destination)
-    sql_code = substitute_vars(sql_code, provider="bigquery")
-    if verbose:
-        print(sql_code)
-    query_job = bq_client().query(sql_code)
-    query_job.result()
-    print("Extension correctly deployed to BigQuery.")
+    query = f"SELECT procedures FROM {destination}.{EXTENSIONS_TABLENAME} WHERE name = @name"
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("name", "STRING", extension_name)
+        ]
+    )
+    try:
+        rows = list(bq_client().query(query, job_config=job_config).result())
+    except NotFound:
+        return set()
+    if not rows or not rows[0]["procedures"]:
+        return set()
+    return set(rows[0]["procedures"].split(","))
 
 
-def deploy_sf(metadata, destination):
-    print("Deploying extension to SnowFlake...")
-    destination = destination or sf_workflows_temp
-    sql_code = create_sql_code_sf(metadata)
-    sql_code = sql_code.replace(WORKFLOWS_TEMP_PLACEHOLDER, destination)
-    sql_code = substitute_vars(sql_code, provider="snowflake")
+def _registered_entries_sf(extension_name, destination) -> set[str]:
+    """Procedures and functions currently registered for the extension."""
+    import snowflake.connector
 
-    if verbose:
-        print(sql_code)
     cur = sf_client().cursor()
-    cur.execute(sql_code)
-    print("Extension correctly deployed to SnowFlake.")
+    try:
+        cur.execute(
+            f"SELECT procedures FROM {destination}.{EXTENSIONS_TABLENAME} WHERE name = %s",
+            (extension_name,),
+        )
+        row = cur.fetchone()
+    except snowflake.connector.errors.ProgrammingError:
+        # The extensions table doesn't exist yet
+        return set()
+    finally:
+        cur.close()
+    if not row or not row[0]:
+        return set()
+    return set(row[0].split(";"))
 
 
-def deploy_oracle(metadata, destination):
-    print("Deploying extension to Oracle...")
-    destination = destination or or_workflows_temp
+def _registered_entries_oracle(extension_name, destination) -> set[str]:
+    """Procedures currently registered for the extension."""
+    import oracledb
 
     cursor = or_client().cursor()
     try:
-        # Create extensions table if it doesn't exist
-        create_table_sql = f"""
-        BEGIN
+        cursor.execute(
+            f"SELECT procedures FROM {destination}.{EXTENSIONS_TABLENAME} WHERE name = :name",
+            {"name": extension_name},
+        )
+        row = cursor.fetchone()
+    except oracledb.DatabaseError:
+        # The extensions table doesn't exist yet
+        return set()
+    finally:
+        cursor.close()
+    if not row or not row[0]:
+        return set()
+    return set(row[0].split(";"))
+
+
+def _deployed_functions_file() -> str:
+    return os.path.join(_build_cache_folder(), "deployed_functions.json")
+
+
+def _function_hashes(metadata, provider, destination) -> dict[str, str]:
+    """Hash of the final SQL code of every function, as sent to the warehouse."""
+    if not metadata.get("functions"):
+        return {}
+    return {
+        func_entry: _content_hash(
+            substitute_vars(
+                func_code.replace(WORKFLOWS_TEMP_PLACEHOLDER, destination), provider
+            )
+        )
+        for func_entry, func_code in get_function_entries(provider, metadata)
+        if func_code
+    }
+
+
+def _save_deployed_functions(metadata, provider, destination):
+    """Remember the code of the functions deployed to a destination.
+
+    Function names don't change with their code (unlike component procedures),
+    so incremental deploys compare against the code deployed the last time.
+    """
+    try:
+        with open(_deployed_functions_file(), "r") as f:
+            deployed_functions = json.load(f)
+    except (OSError, ValueError):
+        deployed_functions = {}
+    deployed_functions[f"{provider}:{destination}"] = _function_hashes(
+        metadata, provider, destination
+    )
+    _write_json_atomically(_deployed_functions_file(), deployed_functions)
+
+
+def _kept_entries(metadata, provider, destination, registered_entries) -> set[str]:
+    """Registered procedures and functions that don't need to be recreated.
+
+    Component procedures are kept when their name, which includes a hash of
+    their source code, is already registered. Functions are kept when they are
+    registered and their code matches the one deployed the last time from
+    this repository.
+    """
+    if provider == "snowflake":
+        procedure_entry = _procedure_entry_sf
+    else:
+        # BigQuery and Oracle track procedures just by their name
+        procedure_entry = _procedure_entry_bq
+
+    kept_entries = {
+        procedure_entry(component)
+        for component in metadata["components"]
+        if procedure_entry(component) in registered_entries
+    }
+
+    try:
+        with open(_deployed_functions_file(), "r") as f:
+            deployed_functions = json.load(f).get(f"{provider}:{destination}", {})
+    except (OSError, ValueError):
+        deployed_functions = {}
+    for func_entry, func_hash in _function_hashes(
+        metadata, provider, destination
+    ).items():
+        if (
+            func_entry in registered_entries
+            and deployed_functions.get(func_entry) == func_hash
+        ):
+            kept_entries.add(func_entry)
+
+    total = len(metadata["components"]) + len(metadata.get("functions") or [])
+    print(
+        f"Incremental deploy: {len(kept_entries)} of {total} procedures and "
+        f"functions are unchanged and will be kept."
+    )
+    return kept_entries
+
+
+def deploy_bq(metadata, destination, incremental=False):
+    print("Deploying extension to BigQuery...")
+    if not destination:
+        destination = bq_workflows_temp()
+    elif not (destination.startswith("`") and destination.endswith("`")):
+        destination = f"`{destination}`"
+
+    kept_entries = set()
+    if incremental:
+        registered_entries = _registered_entries_bq(metadata["name"], destination)
+        kept_entries = _kept_entries(
+            metadata, "bigquery", destination, registered_entries
+        )
+    sql_code = create_sql_code_bq(metadata, kept_entries)
+    sql_code = sql_code.replace(WORKFLOWS_TEMP_PLACEHOLDER, destination)
+    sql_code = substitute_vars(sql_code, provider="bigquery")
+    if verbose:
+        print(sql_code)
+    query_job = bq_client().query(sql_code)
+    query_job.result()
+    _save_deployed_functions(metadata, "bigquery", destination)
+    print("Extension correctly deployed to BigQuery.")
+
+
+def deploy_sf(metadata, destination, incremental=False):
+    print("Deploying extension to SnowFlake...")
+    destination = destination or sf_workflows_temp()
+    kept_entries = set()
+    if incremental:
+        registered_entries = _registered_entries_sf(metadata["name"], destination)
+        kept_entries = _kept_entries(
+            metadata, "snowflake", destination, registered_entries
+        )
+    sql_code = create_sql_code_sf(metadata, kept_entries)
+    sql_code = sql_code.replace(WORKFLOWS_TEMP_PLACEHOLDER, destination)
+    sql_code = substitute_vars(sql_code, provider="snowflake")
+
+    if verbose:
+        print(sql_code)
+    cur = sf_client().cursor()
+    cur.execute(sql_code)
+    _save_deployed_functions(metadata, "snowflake", destination)
+    print("Extension correctly deployed to SnowFlake.")
+
+
+def deploy_oracle(metadata, destination, incremental=False):
+    print("Deploying extension to Oracle...")
+    destination = destination or or_workflows_temp()
+    kept_entries = set()
+    registered_entries = set()
+    if incremental:
+        registered_entries = _registered_entries_oracle(metadata["name"], destination)
+        kept_entries = _kept_entries(
+            metadata, "oracle", destination, registered_entries
+        )
+
+    cursor = or_client().cursor()
+    try:
+        # Create extensions table if it doesn't exist
+        create_table_sql = f"""
+        BEGIN
             EXECUTE IMMEDIATE 'CREATE TABLE {destination}.{EXTENSIONS_TABLENAME} (
                 name VARCHAR2(200),
                 metadata CLOB,
@@ -1367,9 +2246,15 @@ def deploy_oracle(metadata, destination):
         # Create procedures first (before inserting metadata)
         created_procedures = []
         for component in metadata["components"]:
+            if component["procedureName"] in kept_entries:
+                created_procedures.append(component["procedureName"])
+                if verbose:
+                    print(f"  = {component['procedureName']} is unchanged")
+                continue
+
             procedure_code = get_procedure_code_oracle(component)
             procedure_code = procedure_code.replace(WORKFLOWS_TEMP_PLACEHOLDER, destination)
-            procedure_code = substitute_vars(procedure_code)
+            procedure_code = substitute_vars(procedure_code, "oracle")
             # Strip the / separator as it's only needed for SQL*Plus scripts
             procedure_code = procedure_code.rstrip().rstrip('/')
             if verbose:
@@ -1410,6 +2295,12 @@ def deploy_oracle(metadata, destination):
                 print(f"  ✗ Error creating procedure: {str(e)}")
                 raise
 
+        # Drop the procedures of the previous installation that are gone
+        for procedure_name in registered_entries - set(created_procedures):
+            cursor.execute(
+                f"BEGIN EXECUTE IMMEDIATE 'DROP PROCEDURE {destination}.{procedure_name}'; EXCEPTION WHEN OTHERS THEN NULL; END;"
+            )
+
         # Insert extension metadata only if procedures were created successfully
         metadata_string = json.dumps(metadata)
         procedures_string = ';'.join(created_procedures)
@@ -1432,20 +2323,53 @@ def deploy_oracle(metadata, destination):
         cursor.close()
 
 
-def deploy(destination):
+def deploy(destination, incremental=False):
+    """Deploy the extension to the data warehouse.
+
+    With `incremental`, only the procedures and functions that changed since
+    the previous installation are dropped and created again.
+    """
     metadata = create_metadata()
 
     if metadata["provider"] == "bigquery":
-        deploy_bq(metadata, destination or bq_workflows_temp)
+        deploy_bq(metadata, destination or bq_workflows_temp(), incremental)
     elif metadata["provider"] == "snowflake":
-        deploy_sf(metadata, destination or sf_workflows_temp)
+        deploy_sf(metadata, destination or sf_workflows_temp(), incremental)
     elif metadata["provider"] == "oracle":
-        deploy_oracle(metadata, destination or or_workflows_temp)
+        deploy_oracle(metadata, destination or or_workflows_temp(), incremental)
     else:
         raise ValueError(f"Unknown provider: {metadata['provider']}")
 
 
-def substitute_vars(text: str, provider: str) -> str:
+VARIABLE_PATTERN = re.compile(r"@@([a-zA-Z0-9_]+)@@")
+
+# Environment variables available for substitution, per provider (they are
+# read once per run)
+_substitution_variables = {}
+
+
+def _get_substitution_variables(provider: str) -> MappingProxyType:
+    """Return the frozen map of variables used by substitute_vars()."""
+    if provider not in _substitution_variables:
+        load_env()
+
+        # Set workflows_temp if not already set
+        if not os.getenv("WORKFLOWS_TEMP") and test_engine == "local":
+            os.environ["WORKFLOWS_TEMP"] = local_workflows_temp(provider).strip("`")
+        elif not os.getenv("WORKFLOWS_TEMP") and provider == "bigquery":
+            os.environ["WORKFLOWS_TEMP"] = bq_workflows_temp().strip("`")
+        elif not os.getenv("WORKFLOWS_TEMP") and provider == "snowflake":
+            os.environ["WORKFLOWS_TEMP"] = sf_workflows_temp()
+        elif not os.getenv("WORKFLOWS_TEMP") and provider == "oracle":
+            os.environ["WORKFLOWS_TEMP"] = or_workflows_temp()
+
+        _substitution_variables[provider] = MappingProxyType(dict(os.environ))
+    return _substitution_variables[provider]
+
+
+def substitute_vars(
+    text: str, provider: str, source: Optional[str] = None, first_line: int = 1
+) -> str:
     """Substitute all variables in a string with their values from the environment.
 
     For a given string, all the variables using the syntax `@@variable_name@@`
@@ -1453,123 +2377,363 @@ def substitute_vars(text: str, provider: str) -> str:
     It will raise a ValueError if any variable name is not present in the
     environment.
 
+    The text is scanned once, and the values are looked up in a map of the
+    environment variables that is built on the first call.
+
     Args:
         text: The text to substitute variables in
         provider: The provider type ('bigquery', 'snowflake', or 'oracle') to auto-infer workflows_temp
+        source: Name of the file the text comes from, for error messages
+        first_line: Line number of the text within `source`
     """
-    # Set workflows_temp if not already set
-    if not os.getenv("WORKFLOWS_TEMP") and provider == "bigquery":
-        os.environ["WORKFLOWS_TEMP"] = bq_workflows_temp.strip("`")
-    elif not os.getenv("WORKFLOWS_TEMP") and provider == "snowflake":
-        os.environ["WORKFLOWS_TEMP"] = sf_workflows_temp
-    elif not os.getenv("WORKFLOWS_TEMP") and provider == "oracle":
-        os.environ["WORKFLOWS_TEMP"] = or_workflows_temp
+    if "@@" not in text:
+        return text
+
+    variables = _get_substitution_variables(provider)
+
+    def replace(match):
+        value = variables.get(match.group(1).upper())
+        if value is None:
+            location = ""
+            if source:
+                line = first_line + text.count("\n", 0, match.start())
+                location = f" ({source}:{line})"
+            raise ValueError(
+                f"Environment variable {match.group(1)} is not set{location}"
+            )
+        return value
 
-    pattern = r"@@([a-zA-Z0-9_]+)@@"
+    return VARIABLE_PATTERN.sub(replace, text)
 
-    for variable in re.findall(pattern, text, re.MULTILINE):
-        env_var_value = os.getenv(variable.upper())
-        if env_var_value is None:
-            raise ValueError(f"Environment variable {variable} is not set")
-        text = text.replace(f"@@{variable}@@", env_var_value)
 
-    return text
+@functools.lru_cache(maxsize=None)
+def _compile_key_substitution(
+    dotenv_items: tuple[tuple[str, Optional[str]], ...],
+) -> tuple[Optional[re.Pattern], dict[str, str]]:
+    """Build the pattern that matches any of the values of the .env file.
 
+    Values are tried longest first, so when values overlap, the longest one
+    is replaced. Empty values are skipped, and when several keys have the
+    same value, the first one is used.
+    """
+    keys_by_value = {}
+    for key, value in dotenv_items:
+        if value and value not in keys_by_value:
+            keys_by_value[value] = key
+    if not keys_by_value:
+        return None, keys_by_value
+
+    values = sorted(keys_by_value, key=len, reverse=True)
+    return re.compile("|".join(re.escape(value) for value in values)), keys_by_value
 
-def substitute_keys(text: str, dotenv: dict[str, str]) -> str:
+
+def substitute_keys(
+    text: str, dotenv: dict[str, str], replaced: Optional[dict[str, str]] = None
+) -> str:
     """Substitute all variables in the .env file with their key.
 
     For a given string, find all occurences of the contents in the .env file and
     substitute them for their respective keys using the `@@variable_name@@`
     syntax. This function is written to be used when capturing results of tests.
+
+    All the values are replaced in a single scan of the text. If `replaced`
+    is given, the keys that were substituted are added to it, with their value.
     """
-    for key, value in dotenv.items():
-        if value in text:
-            print(f"Changing {value} for @@{key}@@ in the captured results...")
-            text = text.replace(value, f"@@{key}@@")
+    pattern, keys_by_value = _compile_key_substitution(tuple(dotenv.items()))
+    return _substitute_keys(text, pattern, keys_by_value, replaced)
 
-    return text
 
+def _substitute_keys(text, pattern, keys_by_value, replaced=None) -> str:
+    if pattern is None:
+        return text
 
-def infer_schema_field_bq(
-    key: str, value: Any, from_array: bool = False
-) -> bigquery.SchemaField:
-    mode = "REPEATED" if from_array else "NULLABLE"
+    def replace(match):
+        key = keys_by_value[match.group(0)]
+        if replaced is not None:
+            replaced[key] = match.group(0)
+        return f"@@{key}@@"
 
-    if isinstance(value, int):
-        return bigquery.SchemaField(key, "INT64", mode=mode)
-    elif isinstance(value, float):
-        return bigquery.SchemaField(key, "FLOAT64", mode=mode)
-
-    elif isinstance(value, str):
-        if key.endswith("date"):
-            return bigquery.SchemaField(key, "DATE", mode=mode)
-        elif key.endswith("timestamp") or key == "t":
-            return bigquery.SchemaField(key, "TIMESTAMP", mode=mode)
-        elif key.endswith("datetime"):
-            return bigquery.SchemaField(key, "DATETIME", mode=mode)
-        else:
-            try:
-                wkt.loads(value)
-                return bigquery.SchemaField(key, "GEOGRAPHY", mode=mode)
-            except Exception:
-                return bigquery.SchemaField(key, "STRING", mode=mode)
+    return pattern.sub(replace, text)
 
-    elif isinstance(value, list):
-        return infer_schema_field_bq(key, value[0], from_array=True)
 
-    elif isinstance(value, dict):
-        sub_schema = [
-            infer_schema_field_bq(sub_key, sub_value)
-            for sub_key, sub_value in value.items()
-        ]
+def _write_fixture(f, fixture: dict, dotenv: dict[str, str]) -> None:
+    """Write a fixture as indented JSON, replacing the .env values with their keys.
 
-        return bigquery.SchemaField(key, "RECORD", fields=sub_schema, mode=mode)
+    The JSON is substituted in blocks of whole lines as it's encoded, instead
+    of as a single string. Values can't span lines, as JSON escapes line
+    breaks.
+    """
+    pattern, keys_by_value = _compile_key_substitution(tuple(dotenv.items()))
+    replaced = {}
+    chunks = []
+    for chunk in json.JSONEncoder(indent=2, default=str).iterencode(fixture):
+        chunks.append(chunk)
+        if len(chunks) >= 65536 and "\n" in chunk:
+            block, _, pending = "".join(chunks).rpartition("\n")
+            f.write(_substitute_keys(block + "\n", pattern, keys_by_value, replaced))
+            chunks = [pending]
+    f.write(_substitute_keys("".join(chunks), pattern, keys_by_value, replaced))
+
+    for key, value in replaced.items():
+        print(f"Changing {value} for @@{key}@@ in the captured results...")
+
+
+def _substituted_lines(filename: str, provider: str):
+    """Yield the non-empty lines of an NDJSON file with their variables substituted."""
+    with open(filename, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                yield substitute_vars(line, provider, filename, line_number)
 
-    else:
+
+def _test_table_hash(content_digest: str, schema: Any) -> str:
+    """Hash the content of a test table (after variable substitution) and its schema.
+
+    Args:
+        content_digest: SHA-256 hex digest of the substituted NDJSON content
+        schema: JSON-serializable schema of the table
+    """
+    return _content_hash(content_digest, json.dumps(schema, sort_keys=True))[:32]
+
+
+def _test_table_hash_tag(content_hash: str) -> str:
+    return f"{TEST_TABLE_HASH_TAG}:{content_hash}"
+
+
+def _schema_sample_rows() -> int:
+    load_env()
+    return int(os.getenv("TEST_SCHEMA_SAMPLE_ROWS", TEST_SCHEMA_SAMPLE_ROWS))
+
+
+def _widen_type(current, new):
+    """Return the narrowest column type that holds values of both types.
+
+    Types are the ones returned by `_SchemaInference.value_type()`. Nulls fit
+    in any type, integers widen to floats, arrays and records widen their
+    elements and fields, and any other mix falls back to a string (or to JSON,
+    when arrays or records are involved).
+    """
+    if current is None:
+        return new
+    if new is None or current == new:
+        return current
+    if current in ("INT", "FLOAT") and new in ("INT", "FLOAT"):
+        return "FLOAT"
+    if isinstance(current, tuple) and isinstance(new, tuple) and current[0] == new[0]:
+        if current[0] == "ARRAY":
+            return ("ARRAY", _widen_type(current[1], new[1]))
+        fields = dict(current[1])
+        for key, value in new[1].items():
+            fields[key] = _widen_type(fields.get(key), value)
+        return ("RECORD", fields)
+    if isinstance(current, tuple) or isinstance(new, tuple) or "JSON" in (current, new):
+        return "JSON"
+    return "STRING"
+
+
+class _SchemaInference:
+    """Infer the column types of a test table from its rows.
+
+    Rows are added one at a time, and the type of each column is widened to
+    fit all of them. Only the first `sample_rows` rows are used (all of them
+    if it's 0). Strings with a WKT geometry are geographies, and so are the
+    ones with a GeoJSON geometry if `geojson` is set (BigQuery tables only
+    take WKT geographies).
+    """
+
+    def __init__(self, sample_rows: int = 0, geojson: bool = True):
+        self.sample_rows = sample_rows
+        self.geojson = geojson
+        self.rows = 0
+        self.types = {}
+        # Columns (as paths of keys) with a string that isn't a geometry,
+        # whose values don't need to be parsed anymore
+        self._non_geometry_columns = set()
+
+    def add_line(self, line: str):
+        if self.sample_rows and self.rows >= self.sample_rows:
+            return
+        self.rows += 1
+        for key, value in json.loads(line).items():
+            self.types[key] = _widen_type(
+                self.types.get(key), self.value_type((key,), value)
+            )
+
+    def value_type(self, path: tuple, value: Any):
+        """Return the type of a value in the column with the given path of keys."""
+        if value is None:
+            return None
+        if isinstance(value, bool):
+            return "BOOL"
+        if isinstance(value, int):
+            return "INT"
+        if isinstance(value, float):
+            return "FLOAT"
+        if isinstance(value, str):
+            key = path[-1]
+            if key.endswith("date"):
+                return "DATE"
+            elif key.endswith("timestamp") or key == "t":
+                return "TIMESTAMP"
+            elif key.endswith("datetime"):
+                return "DATETIME"
+            if (
+                path not in self._non_geometry_columns
+                and (
+                    _may_be_geometry(value)
+                    if self.geojson
+                    else _WKT_PATTERN.match(value)
+                )
+                and _geometry_string_to_wkt(value) is not None
+            ):
+                return "GEOGRAPHY"
+            self._non_geometry_columns.add(path)
+            return "STRING"
+        if isinstance(value, list):
+            element_type = None
+            for element in value:
+                element_type = _widen_type(
+                    element_type, self.value_type(path, element)
+                )
+            return ("ARRAY", element_type)
+        if isinstance(value, dict):
+            return (
+                "RECORD",
+                {
+                    key: self.value_type(path + (key,), sub_value)
+                    for key, sub_value in value.items()
+                },
+            )
         raise NotImplementedError(
-            f"Could not infer a BigQuery SchemaField for {value} ({type(value)})"
+            f"Could not infer a type for {value} ({type(value)})"
         )
 
 
-def _upload_test_table_bq(filename, component):
+def _infer_test_table_types(filename: str, inference: _SchemaInference) -> dict:
+    if not inference.rows:
+        raise ValueError(f"Cannot infer the schema of {filename}: the file has no rows")
+    return inference.types
+
+
+def _test_table_schema_file(filename: str) -> str:
+    return filename.replace(".ndjson", ".schema")
+
+
+def _write_test_table_schema(filename: str, data_types: dict):
+    """Save an inferred schema as the .schema file of a test table, if enabled."""
+    if write_test_schemas:
+        _write_json_atomically(_test_table_schema_file(filename), data_types)
+        print(f"Schema of {filename} written to {_test_table_schema_file(filename)}")
+
+
+BQ_COLUMN_TYPES = {
+    None: "STRING",
+    "BOOL": "BOOL",
+    "INT": "INT64",
+    "FLOAT": "FLOAT64",
+    "STRING": "STRING",
+    "DATE": "DATE",
+    "TIMESTAMP": "TIMESTAMP",
+    "DATETIME": "DATETIME",
+    "GEOGRAPHY": "GEOGRAPHY",
+    "JSON": "JSON",
+}
+
+
+def _bq_schema_field(key: str, column_type, mode: str = "NULLABLE"):
+    from google.cloud import bigquery
+
+    if isinstance(column_type, tuple):
+        kind, inner_type = column_type
+        if kind == "ARRAY":
+            if isinstance(inner_type, tuple) and inner_type[0] == "ARRAY":
+                # BigQuery has no arrays of arrays
+                return bigquery.SchemaField(key, "JSON", mode=mode)
+            return _bq_schema_field(key, inner_type, mode="REPEATED")
+        sub_schema = [
+            _bq_schema_field(sub_key, sub_type)
+            for sub_key, sub_type in inner_type.items()
+        ]
+        return bigquery.SchemaField(key, "RECORD", fields=sub_schema, mode=mode)
+    return bigquery.SchemaField(key, BQ_COLUMN_TYPES[column_type], mode=mode)
+
+
+def infer_schema_field_bq(
+    key: str, value: Any, from_array: bool = False
+) -> bigquery.SchemaField:
+    column_type = _SchemaInference(geojson=False).value_type((key,), value)
+    return _bq_schema_field(
+        key, column_type, mode="REPEATED" if from_array else "NULLABLE"
+    )
+
+
+def _upload_test_table_bq(filename, setup_table_name=None):
+    """Upload a test table to BigQuery, unless it's already there.
+
+    Returns:
+        The name of the table: `setup_table_name` for setup tables, or a name
+        derived from the content hash for regular test tables
+    """
+    from google.api_core.exceptions import NotFound
+    from google.cloud import bigquery
+
+    # Stream the substituted file into a spooled file (which moves to disk
+    # once it's large), so memory use doesn't grow with the size of the file
+    processed = tempfile.SpooledTemporaryFile(max_size=TEST_TABLE_SPOOL_SIZE)
+    content_digest = hashlib.sha256()
+    schema_file = _test_table_schema_file(filename)
+    inference = None
+    if not os.path.exists(schema_file):
+        inference = _SchemaInference(_schema_sample_rows(), geojson=False)
+    for line in _substituted_lines(filename, "bigquery"):
+        if inference is not None:
+            inference.add_line(line)
+        encoded_line = line.encode("utf-8")
+        processed.write(encoded_line)
+        content_digest.update(encoded_line)
+
     schema = []
-    with open(filename) as f:
-        data = [json.loads(line) for line in f.readlines()]
-    if os.path.exists(filename.replace(".ndjson", ".schema")):
-        with open(filename.replace(".ndjson", ".schema")) as f:
+    if inference is None:
+        with open(schema_file) as f:
             jsonschema = json.load(f)
             for key, value in jsonschema.items():
                 schema.append(bigquery.SchemaField(key, value))
     else:
-        for key, value in data[0].items():
-            schema.append(infer_schema_field_bq(key, value))
+        for key, column_type in _infer_test_table_types(filename, inference).items():
+            schema.append(_bq_schema_field(key, column_type))
+        # Only flat schemas can be written as a .schema file
+        if all(
+            field.field_type != "RECORD" and field.mode == "NULLABLE"
+            for field in schema
+        ):
+            _write_test_table_schema(
+                filename, {field.name: field.field_type for field in schema}
+            )
 
-    dataset_id = os.getenv("BQ_TEST_DATASET")
-    if component.get("_is_setup_table", False):
-        # For setup tables, use direct naming
-        table_id = component["name"]
-    else:
-        table_id = (
-            f"_test_{component['name']}_{os.path.basename(filename).split('.')[0]}"
-        )
+    content_hash = _test_table_hash(
+        content_digest.hexdigest(), [field.to_api_repr() for field in schema]
+    )
+    # Setup tables keep their explicit names, and have the hash as a label
+    table_id = setup_table_name or f"{TEST_INPUT_TABLE_PREFIX}{content_hash}"
 
+    dataset_id = os.getenv("BQ_TEST_DATASET")
     dataset_ref = bq_client().dataset(dataset_id)
     table_ref = dataset_ref.table(table_id)
+    try:
+        table = bq_client().get_table(table_ref)
+        if table.labels.get(TEST_TABLE_HASH_TAG) == content_hash:
+            return table_id
+    except NotFound:
+        pass
+
     job_config = bigquery.LoadJobConfig()
     job_config.source_format = bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
     job_config.autodetect = True
     job_config.write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE
     job_config.schema = schema
 
-    with open(filename, "rb") as source_file:
-        processed = io.BytesIO()
-        for line in source_file:
-            processed_line = substitute_vars(line.decode("utf-8"), "bigquery")
-            processed.write(processed_line.encode("utf-8"))
-
+    with processed:
         processed.seek(0)
-
         job = bq_client().load_table_from_file(
             processed,
             table_ref,
@@ -1577,162 +2741,219 @@ def _upload_test_table_bq(filename, component):
         )
     try:
         job.result()
-    except Exception:
-        pass
+    except Exception as e:
+        errors = "\n".join(
+            f"  {error.get('location', '')}: {error.get('message', '')}"
+            for error in job.errors or []
+        )
+        raise Exception(
+            f"Error loading {filename} into BigQuery table {table_id}: {e}\n{errors}"
+        )
 
+    table = bq_client().get_table(table_ref)
+    table.labels = {**table.labels, TEST_TABLE_HASH_TAG: content_hash}
+    bq_client().update_table(table, ["labels"])
 
-def infer_schema_field_sf(key: str, value: Any) -> str:
-    if isinstance(value, int):
-        return "NUMBER"
-    elif isinstance(value, float):
-        return "FLOAT"
-    elif isinstance(value, bool):
-        return "BOOLEAN"
-    elif isinstance(value, list):
-        return "VARIANT"  # Use VARIANT for complex structures
-    elif isinstance(value, dict):
+    return table_id
+
+
+SF_COLUMN_TYPES = {
+    None: "VARCHAR",
+    "BOOL": "BOOLEAN",
+    "INT": "NUMBER",
+    "FLOAT": "FLOAT",
+    "STRING": "VARCHAR",
+    "DATE": "DATE",
+    "TIMESTAMP": "TIMESTAMP",
+    "DATETIME": "DATETIME",
+    "GEOGRAPHY": "GEOGRAPHY",
+    "JSON": "VARIANT",
+}
+
+
+def _sf_column_type(column_type) -> str:
+    if isinstance(column_type, tuple):
         return "VARIANT"  # Use VARIANT for complex structures
-    elif isinstance(value, str):
-        if key.endswith("date"):
-            return "DATE"
-        elif key.endswith("timestamp") or key == "t":
-            return "TIMESTAMP"
-        elif key.endswith("datetime"):
-            return "DATETIME"
-        else:
-            # Try to create GEOGRAPHY from WKT or GeoJSON, fall back to VARCHAR if it fails
-            try:
-                GeometryComparator.from_geography_string(value)
-                return "GEOGRAPHY"
-            except Exception:
-                return "VARCHAR"
-    elif value is None:
-        return "VARCHAR"  # Default for null values
-    else:
-        raise NotImplementedError(
-            f"Could not infer a Snowflake SchemaField for {value} ({type(value)})"
-        )
+    return SF_COLUMN_TYPES[column_type]
 
 
-def _upload_test_table_sf(filename, component):
-    with open(filename) as f:
-        data = []
-        for line in f.readlines():
-            if line.strip():
-                data.append(json.loads(substitute_vars(line, "snowflake")))
-    if os.path.exists(filename.replace(".ndjson", ".schema")):
-        with open(filename.replace(".ndjson", ".schema")) as f:
-            data_types = json.load(f)
-    else:
-        data_types = {
-            key: infer_schema_field_sf(key, value) for key, value in data[0].items()
-        }
+def infer_schema_field_sf(key: str, value: Any) -> str:
+    return _sf_column_type(_SchemaInference().value_type((key,), value))
 
-    if component.get("_is_setup_table", False):
-        # For setup tables, use direct naming
-        table_id = component["name"]
-    else:
-        table_id = (
-            f"_test_{component['name']}_{os.path.basename(filename).split('.')[0]}"
-        )
-    create_table_sql = f"CREATE OR REPLACE TABLE {sf_workflows_temp}.{table_id} ("
-    for key, value in data[0].items():
-        create_table_sql += f"{key} {data_types[key]}, "
-    create_table_sql = create_table_sql.rstrip(", ")
-    create_table_sql += ");\n"
-    cursor = sf_client().cursor()
-    cursor.execute(create_table_sql)
-
-    # For VARIANT columns with large data, use a different approach
-    has_variant = any(data_types[key] == "VARIANT" for key in data_types)
-
-    if has_variant:
-        # Create a temporary file with the data in NDJSON format
-        with tempfile.NamedTemporaryFile(
-            mode="w", suffix=".json", delete=False
-        ) as temp_file:
-            for row in data:
-                # Convert VARIANT fields to proper JSON strings
-                processed_row = {}
-                for key, value in row.items():
-                    if data_types[key] == "VARIANT":
-                        processed_row[key] = json.dumps(value)
-                    else:
-                        processed_row[key] = value
-                temp_file.write(json.dumps(processed_row) + "\n")
-            temp_file_path = temp_file.name
 
+def _upload_test_table_sf(filename, setup_table_name=None):
+    """Upload a test table to Snowflake, unless it's already there.
+
+    The substituted NDJSON file is staged with PUT and loaded with a single
+    COPY INTO, which casts each column to its type.
+
+    Returns:
+        The name of the table: `setup_table_name` for setup tables, or a name
+        derived from the content hash for regular test tables
+    """
+    schema_file = _test_table_schema_file(filename)
+    inference = None
+    if not os.path.exists(schema_file):
+        inference = _SchemaInference(_schema_sample_rows())
+    with tempfile.NamedTemporaryFile(suffix=".ndjson", delete=False) as temp_file:
+        temp_file_path = temp_file.name
+        content_digest = hashlib.sha256()
         try:
-            # Create a temporary stage
-            stage_name = f"temp_stage_{table_id}"
-            cursor.execute(f"CREATE OR REPLACE TEMPORARY STAGE {stage_name}")
-
-            # Upload the file to the stage
-            cursor.execute(f"PUT file://{temp_file_path} @{stage_name}")
-
-            # Copy from stage with PARSE_JSON for VARIANT columns
-            copy_columns = []
-            for key in data[0].keys():
-                if data_types[key] == "VARIANT":
-                    copy_columns.append(f"PARSE_JSON($1:{key}) as {key}")
-                else:
-                    copy_columns.append(f"$1:{key} as {key}")
+            for line in _substituted_lines(filename, "snowflake"):
+                if inference is not None:
+                    inference.add_line(line)
+                encoded_line = line.encode("utf-8")
+                temp_file.write(encoded_line)
+                content_digest.update(encoded_line)
+        except BaseException:
+            # The file is only removed below once it's filled
+            temp_file.close()
+            os.unlink(temp_file_path)
+            raise
 
-            copy_sql = f"""
-            COPY INTO {sf_workflows_temp}.{table_id}
-            FROM (
-                SELECT {', '.join(copy_columns)}
-                FROM @{stage_name}
-            )
-            FILE_FORMAT = (TYPE = JSON)
-            """
-            cursor.execute(copy_sql)
+    cursor = sf_client().cursor()
+    try:
+        if inference is None:
+            with open(schema_file) as f:
+                data_types = json.load(f)
+        else:
+            data_types = {
+                key: _sf_column_type(column_type)
+                for key, column_type in _infer_test_table_types(
+                    filename, inference
+                ).items()
+            }
+            _write_test_table_schema(filename, data_types)
+
+        content_hash = _test_table_hash(content_digest.hexdigest(), data_types)
+        # Setup tables keep their explicit names, and have the hash as a comment
+        table_id = setup_table_name or f"{TEST_INPUT_TABLE_PREFIX}{content_hash}"
+
+        database, schema = sf_workflows_temp().split(".")
+        cursor.execute(
+            f"SELECT COMMENT FROM {database}.INFORMATION_SCHEMA.TABLES "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s",
+            (schema.upper(), table_id.upper()),
+        )
+        row = cursor.fetchone()
+        if row and row[0] == _test_table_hash_tag(content_hash):
+            return table_id
+
+        create_table_sql = (
+            f"CREATE OR REPLACE TABLE {sf_workflows_temp()}.{table_id} ("
+        )
+        for key, data_type in data_types.items():
+            create_table_sql += f"{key} {data_type}, "
+        create_table_sql = create_table_sql.rstrip(", ")
+        create_table_sql += ");\n"
+        cursor.execute(create_table_sql)
+
+        # Cast each JSON field to the type of its column
+        copy_columns = []
+        for key, data_type in data_types.items():
+            if data_type == "VARIANT":
+                copy_columns.append(f'$1:"{key}"')
+            elif data_type in ["GEOGRAPHY", "GEOMETRY"]:
+                copy_columns.append(f'TO_{data_type}($1:"{key}"::VARCHAR)')
+            else:
+                copy_columns.append(f'$1:"{key}"::{data_type}')
 
+        stage_name = f"{sf_workflows_temp()}.temp_stage_{table_id}"
+        cursor.execute(f"CREATE OR REPLACE TEMPORARY STAGE {stage_name}")
+        try:
+            cursor.execute(
+                f"PUT 'file://{temp_file_path}' @{stage_name} "
+                "AUTO_COMPRESS = TRUE PARALLEL = 8"
+            )
+            cursor.execute(
+                f"""
+                COPY INTO {sf_workflows_temp()}.{table_id}
+                FROM (
+                    SELECT {', '.join(copy_columns)}
+                    FROM @{stage_name}
+                )
+                FILE_FORMAT = (TYPE = JSON)
+                """
+            )
         finally:
-            # Clean up
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
             cursor.execute(f"DROP STAGE IF EXISTS {stage_name}")
-    else:
-        # Use regular INSERT for simple data types
-        for row in data:
-            placeholders = []
-            params = []
-
-            for key, value in row.items():
-                if value is None:
-                    placeholders.append("null")
-                elif data_types[key] in ["NUMBER", "FLOAT"]:
-                    placeholders.append(str(value))
-                else:
-                    placeholders.append("%s")
-                    params.append(str(value))
 
-            insert_sql = f"INSERT INTO {sf_workflows_temp}.{table_id} ({', '.join(row.keys())}) VALUES ({', '.join(placeholders)})"
-            cursor.execute(insert_sql, params)
+        # Tag the table once it's fully loaded
+        cursor.execute(
+            f"ALTER TABLE {sf_workflows_temp()}.{table_id} "
+            f"SET COMMENT = '{_test_table_hash_tag(content_hash)}'"
+        )
+    finally:
+        cursor.close()
+        os.unlink(temp_file_path)
+
+    return table_id
+
+
+def _oracle_bind_value(value: Any, data_type: str) -> Any:
+    """Convert a JSON value to the Python value bound to an Oracle column."""
+    from datetime import datetime
+
+    if value is None:
+        return None
+    if data_type.startswith("NUMBER"):
+        return value
+    if data_type.startswith("DATE") or data_type.startswith("TIMESTAMP"):
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if data_type == "SDO_GEOMETRY":
+        if str(value).lstrip().startswith("{"):
+            # GeoJSON, converted to the WKT expected by SDO_UTIL.FROM_WKTGEOMETRY
+            return GeometryComparator.from_geography_string(value)._shapely_geom.wkt
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
 
-    cursor.close()
+def _upload_test_table_oracle(filename, setup_table_name=None):
+    """Upload a test table to Oracle, unless it's already there.
 
+    Rows are inserted with executemany() in batches of OR_UPLOAD_BATCH_SIZE,
+    using typed binds, and committed once at the end.
 
-def _upload_test_table_oracle(filename, component):
-    with open(filename) as f:
-        data = []
-        for l in f.readlines():
-            if l.strip():
-                data.append(json.loads(substitute_vars(l, "oracle")))
+    Returns:
+        The name of the table: `setup_table_name` for setup tables, or a name
+        derived from the content hash for regular test tables
+    """
+    import oracledb
 
-    if os.path.exists(filename.replace(".ndjson", ".schema")):
-        with open(filename.replace(".ndjson", ".schema")) as f:
+    processed = tempfile.SpooledTemporaryFile(
+        max_size=TEST_TABLE_SPOOL_SIZE, mode="w+", encoding="utf-8"
+    )
+    content_digest = hashlib.sha256()
+    schema_file = _test_table_schema_file(filename)
+    inference = None
+    if not os.path.exists(schema_file):
+        inference = _SchemaInference(_schema_sample_rows())
+    for line in _substituted_lines(filename, "oracle"):
+        if inference is not None:
+            inference.add_line(line)
+        processed.write(line)
+        content_digest.update(line.encode("utf-8"))
+
+    if inference is None:
+        with open(schema_file) as f:
             data_types = json.load(f)
     else:
+        try:
+            column_types = _infer_test_table_types(filename, inference)
+        except ValueError:
+            processed.close()
+            raise
         data_types = {
-            key: infer_schema_field_sf(key, value)  # Reuse SF type inference for Oracle
-            for key, value in data[0].items()
+            key: _sf_column_type(column_type)  # Reuse SF types for Oracle
+            for key, column_type in column_types.items()
         }
         # Convert SF types to Oracle types
         type_mapping = {
             "NUMBER": "NUMBER",
             "FLOAT": "NUMBER",
+            "BOOLEAN": "NUMBER(1)",
             "VARCHAR": "VARCHAR2(4000)",
             "DATE": "DATE",
             "TIMESTAMP": "TIMESTAMP",
@@ -1742,771 +2963,3335 @@ def _upload_test_table_oracle(filename, component):
         data_types = {
             k: type_mapping.get(v, "VARCHAR2(4000)") for k, v in data_types.items()
         }
+        _write_test_table_schema(filename, data_types)
 
-    if component.get("_is_setup_table", False):
-        # For setup tables, use direct naming
-        table_id = component["name"]
-    else:
-        table_id = (
-            f"_test_{component['name']}_{os.path.basename(filename).split('.')[0]}"
-        )
+    content_hash = _test_table_hash(content_digest.hexdigest(), data_types)
+    # Setup tables keep their explicit names, and have the hash as a comment
+    table_id = setup_table_name or f"{TEST_INPUT_TABLE_PREFIX}{content_hash}"
+
+    cursor = or_client().cursor()
+    cursor.execute(
+        "SELECT comments FROM all_tab_comments WHERE owner = :owner AND table_name = :name",
+        owner=or_workflows_temp().upper(),
+        name=table_id.upper(),
+    )
+    row = cursor.fetchone()
+    if row and row[0] == _test_table_hash_tag(content_hash):
+        cursor.close()
+        processed.close()
+        return table_id
 
     # Create table
-    create_table_sql = f"CREATE TABLE {or_workflows_temp}.{table_id} ("
+    create_table_sql = f"CREATE TABLE {or_workflows_temp()}.{table_id} ("
     for key, dtype in data_types.items():
         create_table_sql += f"{key} {dtype}, "
     create_table_sql = create_table_sql.rstrip(", ") + ")"
 
-    cursor = or_client().cursor()
+    # One named bind per column; geometries are bound as CLOBs of WKT
+    columns = list(data_types)
+    bind_names = [f"c{i}" for i in range(len(columns))]
+    bind_types = {}
+    values = []
+    for bind_name, key in zip(bind_names, columns):
+        data_type = data_types[key]
+        if data_type == "SDO_GEOMETRY":
+            bind_types[bind_name] = oracledb.DB_TYPE_CLOB
+            values.append(
+                f"CASE WHEN :{bind_name} IS NULL THEN NULL "
+                f"ELSE SDO_UTIL.FROM_WKTGEOMETRY(:{bind_name}, 4326) END"
+            )
+            continue
+        if data_type.startswith("NUMBER"):
+            bind_types[bind_name] = oracledb.DB_TYPE_NUMBER
+        elif data_type.startswith("DATE"):
+            bind_types[bind_name] = oracledb.DB_TYPE_DATE
+        elif data_type.startswith("TIMESTAMP"):
+            bind_types[bind_name] = oracledb.DB_TYPE_TIMESTAMP
+        values.append(f":{bind_name}")
+    insert_sql = (
+        f"INSERT INTO {or_workflows_temp()}.{table_id} ({', '.join(columns)}) "
+        f"VALUES ({', '.join(values)})"
+    )
+
+    load_env()
+    batch_size = int(os.getenv("OR_UPLOAD_BATCH_SIZE", OR_UPLOAD_BATCH_SIZE))
+
+    def insert_batch(batch):
+        cursor.setinputsizes(**bind_types)
+        cursor.executemany(insert_sql, batch)
+
     try:
         # Drop table if exists
         cursor.execute(
-            f"BEGIN EXECUTE IMMEDIATE 'DROP TABLE {or_workflows_temp}.{table_id}'; EXCEPTION WHEN OTHERS THEN NULL; END;"
+            f"BEGIN EXECUTE IMMEDIATE 'DROP TABLE {or_workflows_temp()}.{table_id}'; EXCEPTION WHEN OTHERS THEN NULL; END;"
         )
         cursor.execute(create_table_sql)
 
         # Insert data
-        for row in data:
-            columns = list(row.keys())
-            values_list = []
-            for key, value in row.items():
-                if value is None:
-                    values_list.append("NULL")
-                elif data_types[key].startswith("NUMBER"):
-                    values_list.append(str(value))
-                else:
-                    # Escape single quotes
-                    escaped_value = str(value).replace("'", "''")
-                    values_list.append(f"'{escaped_value}'")
-
-            values_string = ", ".join(values_list)
-            insert_sql = f"INSERT INTO {or_workflows_temp}.{table_id} ({', '.join(columns)}) VALUES ({values_string})"
-            cursor.execute(insert_sql)
+        batch = []
+        processed.seek(0)
+        for line in processed:
+            row = json.loads(line)
+            batch.append(
+                {
+                    bind_name: _oracle_bind_value(row.get(key), data_types[key])
+                    for bind_name, key in zip(bind_names, columns)
+                }
+            )
+            if len(batch) >= batch_size:
+                insert_batch(batch)
+                batch = []
+        if batch:
+            insert_batch(batch)
 
         or_client().commit()
+        # Tag the table once it's fully loaded
+        cursor.execute(
+            f"COMMENT ON TABLE {or_workflows_temp()}.{table_id} "
+            f"IS '{_test_table_hash_tag(content_hash)}'"
+        )
     except Exception as e:
         or_client().rollback()
         raise e
     finally:
         cursor.close()
+        processed.close()
 
+    return table_id
 
-def _get_test_results(metadata, component, progress_bar=None, use_ci_logging=False):
-    if metadata["provider"] == "bigquery":
-        upload_function = _upload_test_table_bq
-        workflows_temp = bq_workflows_temp
-    elif metadata["provider"] == "snowflake":
-        upload_function = _upload_test_table_sf
-        workflows_temp = sf_workflows_temp
-    elif metadata["provider"] == "oracle":
-        upload_function = _upload_test_table_oracle
-        workflows_temp = or_workflows_temp
-    else:
-        raise ValueError(f"Unknown provider: {metadata['provider']}")
-    results = {}
-    if component:
-        components = [c for c in metadata["components"] if c["name"] == component]
-    else:
-        components = metadata["components"]
-    current_folder = os.path.dirname(os.path.abspath(__file__))
-    components_folder = os.path.join(current_folder, "components")
 
-    for component in components:
-        if use_ci_logging:
-            print(f"Processing component: {component['name']}")
-        component_folder = os.path.join(components_folder, component["name"])
-        test_folder = os.path.join(component_folder, "test")
+_BACKSLASH_ESCAPE_PATTERN = re.compile(
+    r"\\(x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|[0-7]{3}|[\s\S])"
+)
+_BACKSLASH_ESCAPES = {
+    "a": "\a",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+    "v": "\v",
+    "0": "\0",
+}
+
+
+def _decode_backslash_escapes(text: str) -> str:
+    def replace(match):
+        escape = match.group(1)
+        if escape[0] in "xuU" and len(escape) > 1:
+            return chr(int(escape[1:], 16))
+        if len(escape) == 3:
+            return chr(int(escape, 8))
+        return _BACKSLASH_ESCAPES.get(escape, escape)
+
+    return _BACKSLASH_ESCAPE_PATTERN.sub(replace, text)
+
+
+# String literals and quoted identifiers of each SQL dialect
+_SQL_STRING_PATTERNS = {
+    "bigquery": (
+        r"(?:[rR][bB]?|[bB][rR]?)?(?:'''(?:\\[\s\S]|[^\\])*?'''"
+        r'|"""(?:\\[\s\S]|[^\\])*?"""'
+        r"|'(?:\\[\s\S]|[^\\'\n])*'"
+        r'|"(?:\\[\s\S]|[^\\"\n])*")'
+    ),
+    "snowflake": r"'(?:\\[\s\S]|''|[^\\'])*'|\$\$[\s\S]*?\$\$",
+    "oracle": r"'(?:''|[^'])*'",
+}
+_SQL_QUOTED_IDENTIFIER_PATTERNS = {
+    "bigquery": r"`[^`]*`",
+    "snowflake": r'"(?:""|[^"])*"',
+    "oracle": r'"(?:""|[^"])*"',
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _sql_token_pattern(dialect: str) -> re.Pattern:
+    if dialect not in _SQL_STRING_PATTERNS:
+        raise ValueError(f"Unknown provider: {dialect}")
+    comment = r"--[^\n]*|/\*[\s\S]*?\*/"
+    if dialect == "bigquery":
+        comment += r"|#[^\n]*"
+    return re.compile(
+        rf"(?P<ws>\s+)"
+        rf"|(?P<comment>{comment})"
+        rf"|(?P<string>{_SQL_STRING_PATTERNS[dialect]})"
+        rf"|(?P<quoted>{_SQL_QUOTED_IDENTIFIER_PATTERNS[dialect]})"
+        r"|(?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)"
+        r"|(?P<ident>[A-Za-z_][A-Za-z0-9_$]*)"
+        r"|(?P<op>\|\||::|:=|=>|->|<=|>=|<>|!=)"
+        r"|(?P<param>:[A-Za-z_][A-Za-z0-9_]*)"
+        r"|(?P<char>[\s\S])"
+    )
 
-        # run tests
-        test_configuration_file = os.path.join(test_folder, "test.json")
-        if not os.path.exists(test_configuration_file):
-            print(
-                f"Warning: Test configuration file not found for component '{component['name']}' at {test_configuration_file}"
-            )
+
+def _string_literal_value(text: str, dialect: str) -> str:
+    if dialect == "bigquery":
+        prefix_length = len(text) - len(text.lstrip("rRbB"))
+        prefix, text = text[:prefix_length], text[prefix_length:]
+        quote_length = 3 if text[:3] in ("'''", '"""') else 1
+        value = text[quote_length:-quote_length]
+        return value if "r" in prefix.lower() else _decode_backslash_escapes(value)
+    elif dialect == "snowflake":
+        if text.startswith("$$"):
+            return text[2:-2]
+        return _decode_backslash_escapes(text[1:-1].replace("''", "\\'"))
+    return text[1:-1].replace("''", "'")
+
+
+def _lex_sql(code: str, dialect: str) -> list[tuple[str, str]]:
+    """Split SQL code into (kind, text) tokens, following the rules of a dialect.
+
+    String literals are decoded, so their text is their value. Everything
+    else keeps its original text.
+    """
+    tokens = []
+    for match in _sql_token_pattern(dialect).finditer(code):
+        kind, text = match.lastgroup, match.group()
+        if kind == "string":
+            text = _string_literal_value(text, dialect)
+        elif kind == "char":
+            if text in "'\"`":
+                raise ValueError(
+                    "Unterminated quoted text in SQL code: "
+                    f"{code[match.start() : match.start() + 80]}"
+                )
+            kind = "op"
+        tokens.append((kind, text))
+    return tokens
+
+
+def _significant(tokens):
+    return [token for token in tokens if token[0] not in ("ws", "comment")]
+
+
+def _split_sql_statements(tokens):
+    """Split the tokens of a script at its semicolons."""
+    statement = []
+    for token in tokens:
+        if token == ("op", ";"):
+            yield statement
+            statement = []
+        else:
+            statement.append(token)
+    yield statement
+
+
+def _sql_literal(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# Types of the data warehouses that DuckDB calls differently. Types in
+# LOCAL_SIZED_TYPE_NAMES are also renamed when they have a size or precision
+LOCAL_TYPE_NAMES = {
+    "INT64": "BIGINT",
+    "FLOAT64": "DOUBLE",
+    "BOOL": "BOOLEAN",
+    "STRING": "VARCHAR",
+    "BYTES": "BLOB",
+    "NUMERIC": "DECIMAL(38, 9)",
+    "BIGNUMERIC": "DECIMAL(38, 9)",
+    "NUMBER": "DOUBLE",
+    "VARCHAR2": "VARCHAR",
+    "NVARCHAR2": "VARCHAR",
+    "DATETIME": "TIMESTAMP",
+    "TIMESTAMP_NTZ": "TIMESTAMP",
+    "TIMESTAMP_LTZ": "TIMESTAMPTZ",
+    "TIMESTAMP_TZ": "TIMESTAMPTZ",
+    "VARIANT": "JSON",
+    "GEOGRAPHY": "GEOMETRY",
+    "SDO_GEOMETRY": "GEOMETRY",
+}
+LOCAL_SIZED_TYPE_NAMES = {
+    "NUMERIC": "DECIMAL",
+    "BIGNUMERIC": "DECIMAL",
+    "NUMBER": "DECIMAL",
+    "STRING": "VARCHAR",
+    "VARCHAR2": "VARCHAR",
+    "NVARCHAR2": "VARCHAR",
+}
+
+# Functions of the data warehouses that DuckDB calls differently
+LOCAL_FUNCTION_NAMES = {
+    "SAFE_CAST": "TRY_CAST",
+    "ST_GEOGFROMTEXT": "ST_GeomFromText",
+    "ST_GEOGFROMWKT": "ST_GeomFromText",
+    "ST_GEOGRAPHYFROMTEXT": "ST_GeomFromText",
+    "TO_GEOGRAPHY": "ST_GeomFromText",
+    "TO_GEOMETRY": "ST_GeomFromText",
+    "SDO_UTIL.FROM_WKTGEOMETRY": "ST_GeomFromText",
+    "ST_GEOGFROMGEOJSON": "ST_GeomFromGeoJSON",
+    "ST_GEOGPOINT": "ST_Point",
+    "ST_MAKEPOINT": "ST_Point",
+    "SDO_UTIL.TO_WKTGEOMETRY": "ST_AsText",
+    "GENERATE_UUID": "uuid",
+    "UUID_STRING": "uuid",
+    "TO_JSON_STRING": "to_json",
+    "IFF": "if",
+    "NVL": "coalesce",
+}
+
+
+# Functions whose argument is followed by AS and a type
+_SQL_CAST_FUNCTIONS = {"CAST", "SAFE_CAST", "TRY_CAST"}
+
+
+def _sql_type_positions(tokens, is_type: bool = False) -> set[int]:
+    """Find the positions of the tokens that are type names.
+
+    Types follow `::`, the AS of a CAST(...), the names of the columns of
+    CREATE TABLE and ALTER TABLE ... ADD COLUMN, and the names of the
+    variables of DECLARE, and are nested in ARRAY<...> and STRUCT<...>. Any
+    other identifier is a column, table or function name, even if it's
+    called like a type. With `is_type`, the tokens are a type.
+    """
+    positions = set()
+    expect_type = is_type
+    # The next identifier is the name of a column or a STRUCT field
+    expect_name = False
+    # What each open parenthesis or angle bracket is for: the function before
+    # it, "COLUMNS" for column definitions, or ARRAY or STRUCT for types
+    nesting = []
+    keywords = []  # Keywords of the current statement, outside of nesting
+    previous, previous_index = (None, None), None
+    last_type = None
+    for index, (kind, text) in enumerate(tokens):
+        if kind in ("ws", "comment"):
             continue
-        with open(test_configuration_file, "r") as f:
-            test_configurations = json.loads(
-                substitute_vars(f.read(), metadata["provider"])
-            )
+        name = text.upper() if kind == "ident" else None
+        top = nesting[-1] if nesting else None
+        type_expected, expect_type = expect_type, False
+        if type_expected and kind == "ident":
+            positions.add(index)
+            last_type = name
+        elif expect_name and kind in ("ident", "quoted"):
+            # Column definitions may start with IF NOT EXISTS
+            if name not in ("IF", "NOT", "EXISTS"):
+                expect_name = False
+                expect_type = True
+        elif text == ";" and kind == "op":
+            expect_name = False
+            nesting, keywords, last_type = [], [], None
+        elif text == "::" and kind == "op":
+            expect_type = True
+        elif text == "<" and kind == "op" and previous_index in positions:
+            if last_type == "ARRAY":
+                nesting.append("ARRAY")
+                expect_type = True
+            elif last_type == "STRUCT":
+                nesting.append("STRUCT")
+                expect_name = True
+        elif text == ">" and kind == "op" and top in ("ARRAY", "STRUCT"):
+            nesting.pop()
+        elif text == "(" and kind == "op":
+            if (
+                not nesting
+                and keywords[:1] == ["CREATE"]
+                and "TABLE" in keywords
+                and not {"AS", "SELECT", "COLUMNS"} & set(keywords)
+                and previous[0] in ("ident", "quoted")
+            ):
+                keywords.append("COLUMNS")
+                nesting.append("COLUMNS")
+                expect_name = True
+            else:
+                nesting.append(previous[1].upper() if previous[0] == "ident" else None)
+        elif text == ")" and kind == "op":
+            if nesting:
+                nesting.pop()
+        elif text == "," and kind == "op" and top in ("COLUMNS", "STRUCT"):
+            expect_name = True
+        elif name == "AS" and top in _SQL_CAST_FUNCTIONS:
+            expect_type = True
+        elif name is not None and not nesting:
+            if keywords[:1] == ["ALTER"] and name == "COLUMN":
+                expect_name = True
+            elif (
+                keywords[:1] == ["DECLARE"]
+                and len(keywords) > 1
+                and previous[0] in ("ident", "quoted")
+                and last_type is None
+            ):
+                # DECLARE name [, name...] type
+                positions.add(index)
+                last_type = name
+            keywords.append(name)
+        previous, previous_index = (kind, text), index
+    return positions
+
+
+def _to_duckdb_sql(
+    code, dialect: str, variables: Optional[dict] = None, is_type: bool = False
+) -> str:
+    """Translate SQL code (or its tokens) from the dialect of a provider to DuckDB.
 
-        # Collect setup tables from all test configurations
-        setup_tables_map = {}  # filename -> table_name
-        for test_configuration in test_configurations:
-            setup_tables = test_configuration.get("setup_tables", {})
-            for table_name, filename in setup_tables.items():
-                if filename not in setup_tables_map:
-                    setup_tables_map[filename] = table_name
-
-        # Upload all test tables (setup tables with explicit naming, regular tables with prefix)
-        for filename in os.listdir(test_folder):
-            if filename.endswith(".ndjson"):
-                ndjson_full_path = os.path.join(test_folder, filename)
-                filename_without_ext = filename.replace(".ndjson", "")
-
-                if filename_without_ext in setup_tables_map:
-                    # This is a setup table - upload with explicit naming
-                    table_name = setup_tables_map[filename_without_ext]
-                    setup_component = {"name": table_name, "_is_setup_table": True}
-                    upload_function(ndjson_full_path, setup_component)
+    The translation is lexical: quoting is converted, OPTIONS(...) clauses are
+    removed, and types and functions are renamed. Snowflake and Oracle bind
+    variables (`:name`) are replaced with the values in `variables`. With
+    `is_type`, the code is a type.
+    """
+    tokens = _lex_sql(code, dialect) if isinstance(code, str) else code
+    variables = variables or {}
+    type_positions = _sql_type_positions(tokens, is_type)
+
+    def next_significant(index):
+        for position in range(index + 1, len(tokens)):
+            if tokens[position][0] not in ("ws", "comment"):
+                return position
+        return len(tokens)
+
+    def token_at(index):
+        return tokens[index] if index < len(tokens) else (None, None)
+
+    def variable(name):
+        if name.lower() not in variables:
+            raise ValueError(f"Unknown variable :{name} in SQL code")
+        return variables[name.lower()]
+
+    sql = []
+    previous = (None, None)
+    index = 0
+    while index < len(tokens):
+        kind, text = tokens[index]
+        following = next_significant(index)
+        next_token = token_at(following)
+        if kind == "comment":
+            sql.append(" ")
+        elif kind == "string":
+            sql.append(_sql_literal(text))
+        elif kind == "quoted" and text.startswith("`"):
+            sql.append(
+                ".".join(
+                    '"' + part.replace('"', '""') + '"'
+                    for part in text[1:-1].split(".")
+                )
+            )
+        elif kind == "param":
+            sql.append(_sql_literal(variable(text[1:])))
+        elif kind == "ident" and previous != ("op", "."):
+            name = text.upper()
+            if name == "OPTIONS" and next_token == ("op", "("):
+                # Skip the table options, up to the matching parenthesis
+                depth = 0
+                for index in range(following, len(tokens)):
+                    if tokens[index] == ("op", "("):
+                        depth += 1
+                    elif tokens[index] == ("op", ")"):
+                        depth -= 1
+                        if depth == 0:
+                            break
+                index += 1
+                continue
+            elif name == "IDENTIFIER" and next_token == ("op", "("):
+                # Snowflake's IDENTIFIER(:name) references a table by name
+                argument = next_significant(following)
+                closing = next_significant(argument)
+                if token_at(argument)[0] == "param" and token_at(closing) == (
+                    "op",
+                    ")",
+                ):
+                    sql.append(str(variable(token_at(argument)[1][1:])))
+                    previous = ("ident", text)
+                    index = closing + 1
+                    continue
+                sql.append(text)
+            elif name == "EXCEPT" and previous == ("op", "*"):
+                sql.append("EXCLUDE")
+            elif name == "TRANSIENT" and previous[1] and previous[1].upper() in (
+                "CREATE",
+                "REPLACE",
+            ):
+                pass
+            elif next_token == ("op", "."):
+                qualified = next_significant(following)
+                call = next_significant(qualified)
+                function = f"{name}.{str(token_at(qualified)[1]).upper()}"
+                if function in LOCAL_FUNCTION_NAMES and token_at(call) == ("op", "("):
+                    sql.append(LOCAL_FUNCTION_NAMES[function])
+                    previous = ("ident", text)
+                    index = call
+                    continue
+                sql.append(text)
+            elif index in type_positions:
+                if next_token == ("op", "("):
+                    sql.append(LOCAL_SIZED_TYPE_NAMES.get(name, text))
                 else:
-                    # This is a regular test table - upload with prefix
-                    upload_function(ndjson_full_path, component)
+                    sql.append(LOCAL_TYPE_NAMES.get(name, text))
+            elif next_token == ("op", "("):
+                sql.append(LOCAL_FUNCTION_NAMES.get(name, text))
+            else:
+                sql.append(text)
+        else:
+            sql.append(text)
+        if kind not in ("ws", "comment"):
+            previous = (kind, text)
+        index += 1
+    return "".join(sql)
 
-        component_results = {}
-        for test_configuration in test_configurations:
-            setup_tables = test_configuration.get("setup_tables", {})
-
-            param_values = []
-            test_id = test_configuration["id"]
-            skip_outputs = test_configuration.get("skip_output", [])
-            component_results[test_id] = {}
-            tables = {}
-            for inputparam in component["inputs"]:
-                param_value = test_configuration["inputs"][inputparam["name"]]
-                if param_value is None:
-                    param_values.append(None)
-                else:
-                    if inputparam["type"] == "Table":
-                        # Check if this is a setup table (use clean name) or regular test table
-                        if param_value in setup_tables:
-                            tablename = f"'{workflows_temp}.{param_value}'"
-                        else:
-                            tablename = f"'{workflows_temp}._test_{component['name']}_{param_value}'"
-                        param_values.append(tablename)
-                    elif inputparam["type"] in [
-                        "String",
-                        "Selection",
-                        "StringSql",
-                        "Json",
-                        "GeoJson",
-                        "Column",
-                    ]:
-                        param_values.append(f"'{param_value}'")
-                    else:
-                        param_values.append(param_value)
 
-            for outputparam in component["outputs"]:
-                tablename = f"{workflows_temp}._table_{uuid4().hex}"
-                param_values.append(f"'{tablename}'")
-                tables[outputparam["name"]] = tablename
+def _duckdb_type_name(type_name: str) -> str:
+    """Translate the name of a column type of a provider to DuckDB."""
+    return _to_duckdb_sql(type_name, "bigquery", is_type=True)
 
-            env_vars_value = test_configuration.get("env_vars", None)
-            env_vars = f"'{json.dumps(env_vars_value)}'" if env_vars_value else None
 
-            dry_run_params = param_values.copy() + [True, env_vars]
-            dry_run_query = _build_query(
-                workflows_temp, component["procedureName"], dry_run_params, tables
-            )
+def _evaluate_local_expression(tokens, variables: dict, dialect: str):
+    """Evaluate a script expression: literals and variables, joined with ||.
 
-            full_run_params = param_values.copy() + [False, env_vars]
-            full_run_query = _build_query(
-                workflows_temp, component["procedureName"], full_run_params, tables
-            )
+    A few string functions are supported too. Like in Oracle, NULL values
+    are ignored when joining strings in Oracle code.
+    """
+    position = 0
 
-            # TODO: improve argument passing to _run_query()
-            component_results[test_id]["dry"] = _run_query(
-                dry_run_query, component, metadata["provider"], tables
-            )
-            component_results[test_id]["full"] = _run_query(
-                full_run_query, component, metadata["provider"], tables
+    def peek():
+        return tokens[position] if position < len(tokens) else (None, None)
+
+    def advance():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def expect(token):
+        if advance() != token:
+            raise ValueError(
+                f"Expected {token[1]} in expression: {_tokens_text(tokens)}"
             )
-            component_results[test_id]["skip_output"] = skip_outputs
 
-            # Update progress bar or log progress after each test (dry + full run = 1 item)
-            if progress_bar:
-                progress_bar.update(1)
-                progress_bar.set_postfix(
-                    {"component": component["name"], "test": test_id}
+    def text_value(value):
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        return str(value)
+
+    def concatenate(values):
+        if dialect == "oracle":
+            values = ["" if value is None else value for value in values]
+        if any(value is None for value in values):
+            return None
+        return "".join(text_value(value) for value in values)
+
+    def arguments():
+        expect(("op", "("))
+        values = []
+        if peek() != ("op", ")"):
+            values.append(expression())
+            while peek() == ("op", ","):
+                advance()
+                values.append(expression())
+        expect(("op", ")"))
+        return values
+
+    def term():
+        kind, text = advance()
+        if kind == "string":
+            return text
+        if kind == "number":
+            return float(text) if any(c in text for c in ".eE") else int(text)
+        if kind == "param":
+            name = text[1:]
+        elif kind == "ident":
+            name = text
+            upper_name = name.upper()
+            if upper_name in ("TRUE", "FALSE"):
+                return upper_name == "TRUE"
+            if upper_name == "NULL":
+                return None
+            if peek() == ("op", "(") and upper_name == "CAST":
+                expect(("op", "("))
+                value = expression()
+                if str(advance()[1]).upper() != "AS":
+                    raise ValueError(f"Expected AS in CAST: {_tokens_text(tokens)}")
+                type_name = str(advance()[1]).upper()
+                while peek() != ("op", ")") and peek() != (None, None):
+                    advance()
+                expect(("op", ")"))
+                if value is None or type_name not in (
+                    "STRING",
+                    "VARCHAR",
+                    "VARCHAR2",
+                    "TEXT",
+                ):
+                    return value
+                return text_value(value)
+            if peek() == ("op", "("):
+                values = arguments()
+                if upper_name == "CONCAT":
+                    return concatenate(values)
+                if upper_name in ("COALESCE", "IFNULL", "NVL"):
+                    return next((v for v in values if v is not None), None)
+                if upper_name in ("UPPER", "LOWER", "TRIM") and len(values) == 1:
+                    if values[0] is None:
+                        return None
+                    method = {"UPPER": "upper", "LOWER": "lower", "TRIM": "strip"}
+                    return getattr(text_value(values[0]), method[upper_name])()
+                if upper_name == "REPLACE" and len(values) == 3:
+                    if None in values:
+                        return None
+                    return text_value(values[0]).replace(
+                        text_value(values[1]), text_value(values[2])
+                    )
+                raise NotImplementedError(
+                    f"The local engine can't evaluate {name}() in a script expression"
                 )
-            elif use_ci_logging:
-                print(f"Completed test: {component['name']} - {test_id}")
+        elif (kind, text) == ("op", "("):
+            value = expression()
+            expect(("op", ")"))
+            return value
+        elif (kind, text) == ("op", "-") and peek()[0] == "number":
+            return -term()
+        else:
+            raise ValueError(
+                f"Unexpected {text} in expression: {_tokens_text(tokens)}"
+            )
+        if name.lower() not in variables:
+            raise ValueError(
+                f"Unknown variable {name} in expression: {_tokens_text(tokens)}"
+            )
+        return variables[name.lower()]
 
-        results[component["name"]] = component_results
+    def expression():
+        values = [term()]
+        while peek() == ("op", "||"):
+            advance()
+            values.append(term())
+        return values[0] if len(values) == 1 else concatenate(values)
 
-    return results
+    value = expression()
+    if position != len(tokens):
+        raise NotImplementedError(
+            f"The local engine can't evaluate the expression: {_tokens_text(tokens)}"
+        )
+    return value
 
 
-def _build_query(workflows_temp, component_name, param_values, outputs):
-    statements = []
+def _tokens_text(tokens) -> str:
+    return " ".join(text for _, text in tokens)
 
-    for output_table in outputs.values():
-        statements.append(f"DROP TABLE IF EXISTS {output_table}")
 
-    call_statement = f"""CALL {workflows_temp}.{component_name}(
-        {','.join([str(p) if p is not None else 'null' for p in param_values])}
-    )"""
-    statements.append(call_statement)
+def _declare_local_variables(tokens, variables: dict, dialect: str):
+    """Declare the variables of a DECLARE or LET statement (without the keyword)."""
+    names = [tokens[0][1]]
+    position = 1
+    while position + 1 < len(tokens) and tokens[position] == ("op", ","):
+        names.append(tokens[position + 1][1])
+        position += 2
+    value = None
+    for index in range(position, len(tokens)):
+        if tokens[index] == ("op", ":=") or tokens[index][1].upper() == "DEFAULT":
+            value = _evaluate_local_expression(
+                tokens[index + 1 :], variables, dialect
+            )
+            break
+    for name in names:
+        variables[name.lower()] = value
+
+
+# Script statements that the local engine can't run
+_UNSUPPORTED_LOCAL_STATEMENTS = {
+    "IF",
+    "CASE",
+    "WHILE",
+    "LOOP",
+    "FOR",
+    "REPEAT",
+    "CALL",
+    "RAISE",
+    "EXCEPTION",
+    "OPEN",
+    "FETCH",
+    "CLOSE",
+}
+
+
+def _run_script_local(cursor, code, dialect: str, variables: dict) -> bool:
+    """Run a script of a component (or a dynamic SQL string) in the local engine.
+
+    Scripts are sequences of EXECUTE IMMEDIATE, variable declarations and
+    assignments, and plain SQL statements, in the dialect of the provider.
+    Blocks are flattened, and control flow statements aren't supported.
 
-    return statements
+    Returns:
+        True if the script ended with a RETURN statement
+    """
+    in_declare_section = False
+    for statement in _split_sql_statements(_lex_sql(code, dialect)):
+        tokens = _significant(statement)
+        while tokens and tokens[0][1].upper() == "BEGIN":
+            in_declare_section = False
+            statement = statement[statement.index(tokens[0]) + 1 :]
+            tokens = tokens[1:]
+        if not tokens:
+            continue
+        keyword = tokens[0][1].upper() if tokens[0][0] == "ident" else None
 
+        if keyword in ("END", "NULL", "COMMIT"):
+            continue
+        elif keyword == "RETURN":
+            return True
+        elif keyword in _UNSUPPORTED_LOCAL_STATEMENTS:
+            raise NotImplementedError(
+                f"{keyword} statements are not supported by the local engine"
+            )
+        elif keyword == "EXECUTE" and tokens[1][1].upper() == "IMMEDIATE":
+            expression = tokens[2:]
+            if any(
+                kind == "ident" and text.upper() in ("USING", "INTO")
+                for kind, text in expression
+            ):
+                raise NotImplementedError(
+                    "EXECUTE IMMEDIATE with USING or INTO is not supported by the "
+                    "local engine"
+                )
+            sql = _evaluate_local_expression(expression, variables, dialect)
+            if not isinstance(sql, str):
+                raise ValueError(
+                    f"EXECUTE IMMEDIATE of a non-string value: {_tokens_text(tokens)}"
+                )
+            if _run_script_local(cursor, sql, dialect, variables):
+                return True
+        elif keyword == "DECLARE":
+            # Snowflake and Oracle declare variables in a section before BEGIN
+            in_declare_section = dialect != "bigquery"
+            if len(tokens) > 1:
+                _declare_local_variables(tokens[1:], variables, dialect)
+        elif in_declare_section or keyword == "LET":
+            _declare_local_variables(
+                tokens[1:] if keyword == "LET" else tokens, variables, dialect
+            )
+        elif keyword == "SET" and len(tokens) > 2 and tokens[2] == ("op", "="):
+            variables[tokens[1][1].lower()] = _evaluate_local_expression(
+                tokens[3:], variables, dialect
+            )
+        elif len(tokens) > 1 and tokens[1] == ("op", ":="):
+            variables[tokens[0][1].lower()] = _evaluate_local_expression(
+                tokens[2:], variables, dialect
+            )
+        else:
+            sql = _to_duckdb_sql(statement, dialect, variables)
+            if verbose:
+                print(sql)
+            cursor.execute(sql)
+    return False
 
-def _run_query(
-    statements: list, component: dict, provider: str, tables: dict
-) -> dict[str, pd.DataFrame]:
-    results = dict()
 
-    if verbose:
-        for stmt in statements:
-            print(stmt)
+def _call_component_local(cursor, tokens, component: dict, provider: str):
+    """Run the CALL to the procedure of a component in the local engine.
 
-    if provider == "bigquery":
-        # BigQuery can handle a single statement with several queries
-        combined_query = ";\n\n".join(statements)
-        query_job = bq_client().query(combined_query)
-        _ = query_job.result()
+    The dry run or full run script of the component is run with the
+    arguments of the call as its variables.
+    """
+    opening = tokens.index(("op", "("))
+    procedure_name = tokens[opening - 1][1].strip('`"')
+    if procedure_name.lower() != component["procedureName"].lower():
+        raise ValueError(
+            f"The local engine can't call {procedure_name}, only the procedure "
+            f"of component '{component['name']}'"
+        )
 
-        for output in component["outputs"]:
-            query = f"SELECT * FROM {tables[output['name']]}"
-            query_job = bq_client().query(query)
-            df = query_job.result().to_dataframe()
+    arguments = []
+    argument = []
+    depth = 0
+    for token in tokens[opening + 1 : -1]:
+        if token == ("op", ",") and depth == 0:
+            arguments.append(argument)
+            argument = []
+            continue
+        if token == ("op", "("):
+            depth += 1
+        elif token == ("op", ")"):
+            depth -= 1
+        argument.append(token)
+    arguments.append(argument)
+    values = [_evaluate_local_expression(a, {}, provider) for a in arguments]
+
+    names = [p["name"] for p in component["inputs"] + component["outputs"]]
+    names += ["dry_run", "env_vars"]
+    if len(values) != len(names):
+        raise ValueError(
+            f"The procedure of component '{component['name']}' takes "
+            f"{len(names)} arguments, but {len(values)} were given"
+        )
+    variables = {name.lower(): value for name, value in zip(names, values)}
+
+    # Environment variables are declared as the procedures of each provider do
+    env_vars = json.loads(variables["env_vars"]) if variables["env_vars"] else {}
+    for name in component.get("cartoEnvVars", []):
+        value = env_vars.get(name)
+        if value is not None and (
+            provider == "bigquery" or not isinstance(value, str)
+        ):
+            value = json.dumps(value)
+        variables[name.lower()] = value
+
+    script = "dryrun.sql" if variables["dry_run"] else "fullrun.sql"
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    script_file = os.path.join(
+        current_folder, "components", component["name"], "src", script
+    )
+    with open(script_file, "r") as f:
+        code = substitute_vars(f.read(), provider, script_file)
+    _run_script_local(cursor, code, provider, variables)
 
-            if not df.empty:
-                for column in df.columns:
-                    if isinstance(df.iloc[0][column], np.ndarray):
-                        df[column] = df[column].apply(lambda x: x.tolist())
 
-            results[output["name"]] = df
-    elif provider == "snowflake":
-        cur = sf_client().cursor()
-        # Snowflake requires a single query per statement
+def _run_statements_local(statements: list, component: dict, provider: str):
+    """Run the statements of a test in the local engine."""
+    cursor = duckdb_client().cursor()
+    try:
         for statement in statements:
-            cur.execute(statement)
+            tokens = _significant(_lex_sql(statement, provider))
+            if tokens and tokens[0][1].upper() == "CALL":
+                _call_component_local(cursor, tokens, component, provider)
+            else:
+                _run_script_local(cursor, statement, provider, {})
+    except Exception as e:
+        raise Exception(
+            f"Error running component '{component['name']}' in the local engine: {e}"
+        )
+    finally:
+        cursor.close()
 
-        for output in component["outputs"]:
-            output_query = f"SELECT * FROM {tables[output['name']]}"
-            cur = sf_client().cursor()
-            cur.execute(output_query)
-
-            df = cur.fetch_pandas_all()
-
-            # Convert column names to lowercase for consistency with BigQuery
-            df.columns = [col.lower() for col in df.columns]
-
-            if not df.empty:
-                for column in df.columns:
-                    # Check if this looks like a JSON string that should be parsed
-                    sample_value = df.iloc[0][column]
-                    if isinstance(sample_value, str) and (
-                        sample_value.strip().startswith("[")
-                        or sample_value.strip().startswith("{")
-                    ):
-                        try:
-                            # Parse JSON strings back to proper structures
-                            df[column] = df[column].apply(
-                                lambda x: json.loads(x)
-                                if isinstance(x, str) and x.strip()
-                                else x
-                            )
-                        except (json.JSONDecodeError, ValueError):
-                            # If JSON parsing fails, leave as string
-                            pass
 
-            results[output["name"]] = df
-    elif provider == "oracle":
-        cur = or_client().cursor()
-        # Oracle requires a single query per statement
-        for statement in statements:
-            cur.execute(statement)
+def _create_local_schema(workflows_temp: str):
+    """Create the schema of the local engine (and its database, if it has one)."""
+    parts = workflows_temp.strip("`").split(".")
+    cursor = duckdb_client().cursor()
+    try:
+        if len(parts) == 2 and parts[0].lower() != "memory":
+            cursor.execute(f"ATTACH IF NOT EXISTS ':memory:' AS \"{parts[0]}\"")
+        cursor.execute(
+            "CREATE SCHEMA IF NOT EXISTS "
+            + ".".join(f'"{part}"' for part in parts)
+        )
+    finally:
+        cursor.close()
 
-        for output in component["outputs"]:
-            query = f"SELECT * FROM {tables[output['name']]}"
-            cur = or_client().cursor()
-            cur.execute(query)
-            # Fetch results and convert to DataFrame
-            columns = [col[0].lower() for col in cur.description]
-            rows = cur.fetchall()
-            results[output["name"]] = pd.DataFrame(rows, columns=columns)
-    else:
-        raise ValueError(f"Unknown provider: {provider}")
 
-    return results
+LOCAL_COLUMN_TYPES = {
+    None: "VARCHAR",
+    "BOOL": "BOOLEAN",
+    "INT": "BIGINT",
+    "FLOAT": "DOUBLE",
+    "STRING": "VARCHAR",
+    "DATE": "DATE",
+    "TIMESTAMP": "TIMESTAMP",
+    "DATETIME": "TIMESTAMP",
+    "GEOGRAPHY": "GEOMETRY",
+    "JSON": "JSON",
+}
+
+
+def _local_column_type(column_type, nested=False) -> str:
+    if isinstance(column_type, tuple):
+        kind, inner_type = column_type
+        if kind == "ARRAY":
+            return f"{_local_column_type(inner_type, nested=True)}[]"
+        fields = ", ".join(
+            f'"{key}" {_local_column_type(sub_type, nested=True)}'
+            for key, sub_type in inner_type.items()
+        )
+        return f"STRUCT({fields})"
+    if nested and column_type == "GEOGRAPHY":
+        return "VARCHAR"  # Only top-level geographies are converted to geometries
+    return LOCAL_COLUMN_TYPES[column_type]
 
 
-def test(component, no_deploy=False):
-    """Run the pytest-based tests."""
+def _upload_test_table_local(filename, setup_table_name=None, provider="bigquery"):
+    """Load a test table into the local engine.
 
-    # Step 1: Prepare all test data and save to file
-    prepare_test_data(component, no_deploy=no_deploy)
+    The substituted NDJSON file is read with DuckDB's read_json, and its
+    geographies are converted to geometries when the spatial extension is
+    available. Tables are named like in the data warehouse.
 
-    # Save test data to temporary file
-    with tempfile.NamedTemporaryFile(mode="wb", delete=False, suffix=".pkl") as f:
-        pickle.dump({"metadata": _metadata_cache, "results": _test_results_cache}, f)
-        temp_file_path = f.name
+    Returns:
+        The name of the table: `setup_table_name` for setup tables, or a name
+        derived from the content hash for regular test tables
+    """
+    schema_file = _test_table_schema_file(filename)
+    inference = None
+    if not os.path.exists(schema_file):
+        inference = _SchemaInference(
+            _schema_sample_rows(), geojson=provider != "bigquery"
+        )
+    with tempfile.NamedTemporaryFile(suffix=".ndjson", delete=False) as temp_file:
+        temp_file_path = temp_file.name
+        content_digest = hashlib.sha256()
+        try:
+            for line in _substituted_lines(filename, provider):
+                if inference is not None:
+                    inference.add_line(line)
+                encoded_line = line.encode("utf-8")
+                temp_file.write(encoded_line)
+                content_digest.update(encoded_line)
+        except BaseException:
+            # The file is only removed below once it's filled
+            temp_file.close()
+            os.unlink(temp_file_path)
+            raise
 
-    # Set environment variable so pytest can find the data file
-    os.environ["PYTEST_TEST_DATA_FILE"] = temp_file_path
+    try:
+        if inference is None:
+            with open(schema_file) as f:
+                data_types = {
+                    key: _duckdb_type_name(data_type)
+                    for key, data_type in json.load(f).items()
+                }
+        else:
+            data_types = {
+                key: _local_column_type(column_type)
+                for key, column_type in _infer_test_table_types(
+                    filename, inference
+                ).items()
+            }
 
-    # Set component filter for pytest
-    if component:
-        os.environ["PYTEST_COMPONENT_FILTER"] = component
+        content_hash = _test_table_hash(content_digest.hexdigest(), data_types)
+        table_id = setup_table_name or f"{TEST_INPUT_TABLE_PREFIX}{content_hash}"
+        table_name = _to_duckdb_sql(
+            f"{local_workflows_temp(provider)}.{table_id}", provider
+        )
 
-    try:
-        # Step 2: Start pytest session
-        print("Running pytest-based extension tests...")
+        # Geometries are read as text and then converted
+        json_columns = []
+        select_columns = []
+        for key, data_type in data_types.items():
+            column = '"' + key.replace('"', '""') + '"'
+            if data_type == "GEOMETRY":
+                data_type = "VARCHAR"
+                if duckdb_has_spatial:
+                    column = (
+                        f"CASE WHEN ltrim({column}) LIKE '{{%' "
+                        f"THEN ST_GeomFromGeoJSON({column}) "
+                        f"ELSE ST_GeomFromText({column}) END AS {column}"
+                    )
+            json_columns.append(f"{_sql_literal(key)}: {_sql_literal(data_type)}")
+            select_columns.append(column)
 
-        # Configure pytest arguments based on environment
-        if is_ci_environment():
-            # In CI: use -vv by default for detailed output
-            pytest_args = [
-                "-vv",
-                "--tb=short",
-                __file__ + "::test_extension_components",
-            ]
-            print("CI environment detected: using verbose pytest output")
-        else:
-            # Locally: capture user flags from command line and pass them to pytest
-            pytest_args = _build_pytest_args_from_user_flags()
-            pytest_args.append(__file__ + "::test_extension_components")
-            if pytest_args == [__file__ + "::test_extension_components"]:
-                # No user flags provided, use default
-                pytest_args = [
-                    "-v",
-                    "--tb=short",
-                    __file__ + "::test_extension_components",
-                ]
+        cursor = duckdb_client().cursor()
+        try:
+            cursor.execute(
+                f"CREATE OR REPLACE TABLE {table_name} AS "
+                f"SELECT {', '.join(select_columns)} "
+                f"FROM read_json({_sql_literal(temp_file_path)}, "
+                f"format = 'newline_delimited', "
+                f"columns = {{{', '.join(json_columns)}}})"
+            )
+        except Exception as e:
+            raise Exception(f"Error loading {filename} into the local engine: {e}")
+        finally:
+            cursor.close()
+    finally:
+        os.unlink(temp_file_path)
 
-        retcode = pytest.main(pytest_args)
+    return table_id
 
-        if retcode == 0:
-            print("Extension correctly tested with pytest.")
-        else:
-            print(f"Pytest testing failed with exit code {retcode}")
-            exit(retcode)
+
+def _fetch_output_local(table_name: str, provider: str = "bigquery") -> pd.DataFrame:
+    """Read an output table of the local engine, with geometries as WKT."""
+    table_name = _to_duckdb_sql(table_name, provider)
+    cursor = duckdb_client().cursor()
+    try:
+        columns = []
+        for name, data_type, *_ in cursor.execute(
+            f"DESCRIBE SELECT * FROM {table_name}"
+        ).fetchall():
+            column = '"' + name.replace('"', '""') + '"'
+            if data_type.startswith("GEOMETRY"):
+                column = f"ST_AsText({column}) AS {column}"
+            columns.append(column)
+        result = cursor.execute(f"SELECT {', '.join(columns)} FROM {table_name}")
+        # Older versions of DuckDB return a table instead of a reader
+        arrow_table = result.arrow()
+        if hasattr(arrow_table, "read_all"):
+            arrow_table = arrow_table.read_all()
     finally:
-        # Clean up temporary file
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-        if "PYTEST_TEST_DATA_FILE" in os.environ:
-            del os.environ["PYTEST_TEST_DATA_FILE"]
-        if "PYTEST_COMPONENT_FILTER" in os.environ:
-            del os.environ["PYTEST_COMPONENT_FILTER"]
+        cursor.close()
 
+    df = _arrow_to_dataframe(arrow_table)
+    if provider != "bigquery":
+        # Column names are lowercase, like when reading from Snowflake and Oracle
+        df.columns = [col.lower() for col in df.columns]
+    return df
 
-def _build_pytest_args_from_user_flags():
-    """Build pytest arguments from user command line flags.
 
-    Pass all flags that are not used by the script itself to pytest.
+def _setup_tables_map(test_configurations: list) -> dict:
+    """Collect the setup tables of all the test cases of a component.
+
+    Returns:
+        Dictionary mapping each setup table file to its table name
     """
-    pytest_args = []
-    skip_next = False
+    setup_tables_map = {}  # filename -> table_name
+    for test_configuration in test_configurations:
+        setup_tables = test_configuration.get("setup_tables", {})
+        for table_name, filename in setup_tables.items():
+            if filename not in setup_tables_map:
+                setup_tables_map[filename] = table_name
+    return setup_tables_map
 
-    for i, arg in enumerate(argv[1:], 1):  # Skip script name
-        if skip_next:
-            # This argument is a value for a previous flag, skip it
-            skip_next = False
-            continue
 
-        # Skip the action argument (first positional argument after script name)
-        if i == 1 and arg in ["test"]:
-            continue
+def _upload_test_tables(upload_function, test_folder: str, setup_tables_map: dict):
+    """Upload all the test tables of a component.
 
-        # Skip script-specific flags and their values
-        if arg in ["-c", "--component"]:
-            skip_next = True  # Skip the next argument (the value)
-            continue
-        elif arg in ["--verbose"]:
-            continue  # Skip verbose flag
+    Setup tables are uploaded with their explicit names, and regular test
+    tables with a name derived from their content hash.
 
-        # Pass everything else to pytest
-        pytest_args.append(arg)
+    Returns:
+        Dictionary mapping each regular test table file to its table name
+    """
+    input_tables = {}  # filename -> table_name
+    for filename in os.listdir(test_folder):
+        if filename.endswith(".ndjson"):
+            ndjson_full_path = os.path.join(test_folder, filename)
+            filename_without_ext = filename.replace(".ndjson", "")
+
+            if filename_without_ext in setup_tables_map:
+                # This is a setup table - upload with explicit naming
+                upload_function(
+                    ndjson_full_path,
+                    setup_tables_map[filename_without_ext],
+                )
+            else:
+                # This is a regular test table - named after its content
+                input_tables[filename_without_ext] = upload_function(ndjson_full_path)
+    return input_tables
 
-    return pytest_args
 
+def _get_test_results(
+    metadata, component, progress_bar=None, use_ci_logging=False, jobs=1, store=None
+):
+    """Run the tests of the components and collect their outputs.
 
-# Pytest-based testing functions
-_test_results_cache = None
-_metadata_cache = None
+    Test cases run concurrently in a pool of up to `jobs` workers (capped per
+    provider by MAX_TEST_JOBS). The input tables of a component are uploaded
+    before its test cases are submitted; components that share setup table
+    names run in separate waves, so they don't overwrite each other's tables.
+    Input tables whose content hasn't changed since they were last uploaded
+    are reused, and identical files in different components share a table.
 
+    If a ResultStore is given, the outputs are written to it as they are
+    fetched, and the results reference them instead of holding DataFrames.
 
-def prepare_test_data(component=None, no_deploy=False):
-    """Run all SQL and collect test data."""
-    global _test_results_cache, _metadata_cache
+    The output tables created by the tests are dropped once all of them have
+    finished (or failed).
 
-    _metadata_cache = create_metadata()
-    if not no_deploy:
-        deploy(None)
+    Returns:
+        Dictionary with the results of each test of each component, in the
+        same order as the components and their `test.json` files
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-    # Filter components first, then calculate total number of tests for progress bar
-    components_to_test = _metadata_cache["components"]
+    if test_engine == "local":
+        upload_function = functools.partial(
+            _upload_test_table_local, provider=metadata["provider"]
+        )
+        workflows_temp = local_workflows_temp(metadata["provider"])
+        _create_local_schema(workflows_temp)
+    elif metadata["provider"] == "bigquery":
+        upload_function = _upload_test_table_bq
+        workflows_temp = bq_workflows_temp()
+    elif metadata["provider"] == "snowflake":
+        upload_function = _upload_test_table_sf
+        workflows_temp = sf_workflows_temp()
+    elif metadata["provider"] == "oracle":
+        upload_function = _upload_test_table_oracle
+        workflows_temp = or_workflows_temp()
+    else:
+        raise ValueError(f"Unknown provider: {metadata['provider']}")
+    results = {}
     if component:
-        components_to_test = [
-            c for c in _metadata_cache["components"] if c["name"] == component
-        ]
-
+        components = [c for c in metadata["components"] if c["name"] == component]
+    else:
+        components = metadata["components"]
     current_folder = os.path.dirname(os.path.abspath(__file__))
     components_folder = os.path.join(current_folder, "components")
 
-    total_tests = 0
-    for comp in components_to_test:
-        component_folder = os.path.join(components_folder, comp["name"])
-        test_configuration_file = os.path.join(component_folder, "test", "test.json")
+    engine = "local" if test_engine == "local" else metadata["provider"]
+    max_jobs = MAX_TEST_JOBS[engine]
+    if jobs > max_jobs:
+        print(f"Running at most {max_jobs} tests at a time on {engine}")
+        jobs = max_jobs
+
+    # Group components in waves, so that each setup table name is only used
+    # by one component at a time
+    waves = []
+    for component in components:
+        component_folder = os.path.join(components_folder, component["name"])
+        test_folder = os.path.join(component_folder, "test")
+
+        # run tests
+        test_configuration_file = os.path.join(test_folder, "test.json")
         if not os.path.exists(test_configuration_file):
             print(
-                f"Warning: Test configuration file not found for component '{comp['name']}' at {test_configuration_file}"
+                f"Warning: Test configuration file not found for component '{component['name']}' at {test_configuration_file}"
             )
             continue
         with open(test_configuration_file, "r") as f:
             test_configurations = json.loads(
-                substitute_vars(f.read(), _metadata_cache["provider"])
+                substitute_vars(
+                    f.read(), metadata["provider"], test_configuration_file
+                )
             )
-        total_tests += len(test_configurations)
 
-    # Use progress bar locally, detailed logging in CI
-    if is_ci_environment():
-        print(
-            f"CI environment detected: Running {total_tests} SQL tests with detailed logging"
+        setup_tables_map = _setup_tables_map(test_configurations)
+        setup_table_names = set(setup_tables_map.values())
+        if not waves or setup_table_names & waves[-1]["setup_table_names"]:
+            waves.append({"components": [], "setup_table_names": set()})
+        waves[-1]["components"].append(
+            (component, test_folder, test_configurations, setup_tables_map)
         )
-        _test_results_cache = _get_test_results(
-            _metadata_cache, component, use_ci_logging=True
+        waves[-1]["setup_table_names"] |= setup_table_names
+        results[component["name"]] = {
+            test_configuration["id"]: None for test_configuration in test_configurations
+        }
+
+    output_tables = []
+    executor = ThreadPoolExecutor(max_workers=max(jobs, 1))
+    try:
+        for wave in waves:
+            pending = {}
+            for component, test_folder, test_configurations, setup_tables_map in wave[
+                "components"
+            ]:
+                if use_ci_logging:
+                    print(f"Processing component: {component['name']}")
+
+                input_tables = _upload_test_tables(
+                    upload_function, test_folder, setup_tables_map
+                )
+
+                for test_configuration in test_configurations:
+                    future = executor.submit(
+                        _run_test_case,
+                        metadata,
+                        component,
+                        test_configuration,
+                        workflows_temp,
+                        input_tables,
+                        store,
+                        output_tables,
+                    )
+                    pending[future] = (component, test_configuration["id"])
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    component, test_id = pending.pop(future)
+                    results[component["name"]][test_id] = future.result()
+
+                    # Update progress bar or log progress after each test (dry + full run = 1 item)
+                    if progress_bar:
+                        progress_bar.update(1)
+                        progress_bar.set_postfix(
+                            {"component": component["name"], "test": test_id}
+                        )
+                    elif use_ci_logging:
+                        print(f"Completed test: {component['name']} - {test_id}")
+    except BaseException:
+        executor.shutdown(wait=True, cancel_futures=True)
+        raise
+    else:
+        executor.shutdown()
+    finally:
+        _drop_output_tables(metadata["provider"], output_tables)
+
+    return results
+
+
+def _test_case_param_values(
+    component: dict, test_configuration: dict, workflows_temp: str, input_tables: dict
+) -> list:
+    """SQL values of the inputs of a component in a test case.
+
+    `input_tables` maps the test table files of the component to the names of
+    the tables they were uploaded to.
+    """
+    setup_tables = test_configuration.get("setup_tables", {})
+
+    param_values = []
+    for inputparam in component["inputs"]:
+        param_value = test_configuration["inputs"][inputparam["name"]]
+        if param_value is None:
+            param_values.append(None)
+        else:
+            if inputparam["type"] == "Table":
+                # Check if this is a setup table (use clean name) or regular test table
+                if param_value in setup_tables:
+                    tablename = f"'{workflows_temp}.{param_value}'"
+                elif param_value in input_tables:
+                    tablename = f"'{workflows_temp}.{input_tables[param_value]}'"
+                else:
+                    raise ValueError(
+                        f"Test {test_configuration['id']} of component "
+                        f"'{component['name']}' uses table '{param_value}', but "
+                        f"there is no {param_value}.ndjson file in its test folder"
+                    )
+                param_values.append(tablename)
+            elif inputparam["type"] in [
+                "String",
+                "Selection",
+                "StringSql",
+                "Json",
+                "GeoJson",
+                "Column",
+            ]:
+                param_values.append(f"'{param_value}'")
+            else:
+                param_values.append(param_value)
+    return param_values
+
+
+def _test_case_env_vars(test_configuration: dict) -> Optional[str]:
+    env_vars_value = test_configuration.get("env_vars", None)
+    return f"'{json.dumps(env_vars_value)}'" if env_vars_value else None
+
+
+def _run_test_case(
+    metadata,
+    component,
+    test_configuration,
+    workflows_temp,
+    input_tables,
+    store=None,
+    output_tables=None,
+):
+    """Run the dry and full run of a single test case and fetch its outputs.
+
+    `input_tables` maps the test table files of the component to the names of
+    the tables they were uploaded to. The names of the output tables are
+    appended to `output_tables`, if given, so they can be dropped afterwards.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    param_values = _test_case_param_values(
+        component, test_configuration, workflows_temp, input_tables
+    )
+    skip_outputs = test_configuration.get("skip_output", [])
+    test_results = {}
+
+    # The dry and full runs write to different output tables, so that they
+    # can run at the same time
+    dry_run_tables = {}
+    full_run_tables = {}
+    for outputparam in component["outputs"]:
+        dry_run_tables[outputparam["name"]] = _output_table_name(workflows_temp)
+        full_run_tables[outputparam["name"]] = _output_table_name(workflows_temp)
+    if output_tables is not None:
+        output_tables.extend(dry_run_tables.values())
+        output_tables.extend(full_run_tables.values())
+
+    env_vars = _test_case_env_vars(test_configuration)
+
+    dry_run_params = (
+        param_values
+        + [f"'{tablename}'" for tablename in dry_run_tables.values()]
+        + [True, env_vars]
+    )
+    dry_run_query = _build_query(
+        workflows_temp,
+        component["procedureName"],
+        dry_run_params,
+        dry_run_tables,
+        metadata["provider"],
+    )
+
+    full_run_params = (
+        param_values
+        + [f"'{tablename}'" for tablename in full_run_tables.values()]
+        + [False, env_vars]
+    )
+    full_run_query = _build_query(
+        workflows_temp,
+        component["procedureName"],
+        full_run_params,
+        full_run_tables,
+        metadata["provider"],
+    )
+
+    # The dry and full runs are independent, so they run concurrently
+    run_query = functools.partial(
+        _run_query, component=component, provider=metadata["provider"], store=store
+    )
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        dry_run = executor.submit(run_query, dry_run_query, tables=dry_run_tables)
+        full_run = executor.submit(run_query, full_run_query, tables=full_run_tables)
+        test_results["dry"] = dry_run.result()
+        test_results["full"] = full_run.result()
+    test_results["skip_output"] = skip_outputs
+
+    return test_results
+
+
+def _build_query(workflows_temp, component_name, param_values, outputs, provider=None):
+    statements = []
+
+    for output_table in outputs.values():
+        statements.append(f"DROP TABLE IF EXISTS {output_table}")
+
+    call_statement = f"""CALL {workflows_temp}.{component_name}(
+        {','.join([str(p) if p is not None else 'null' for p in param_values])}
+    )"""
+    statements.append(call_statement)
+
+    if provider == "bigquery" and test_engine != "local":
+        # The output tables expire even if the run is interrupted before
+        # dropping them
+        for output_table in outputs.values():
+            statements.append(
+                f"ALTER TABLE IF EXISTS {output_table} SET OPTIONS("
+                "expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), "
+                f"INTERVAL {TEST_OUTPUT_TABLE_EXPIRATION_HOURS} HOUR))"
+            )
+
+    return statements
+
+
+def _output_table_name(workflows_temp: str) -> str:
+    return f"{workflows_temp}.{TEST_OUTPUT_TABLE_PREFIX}{uuid4().hex}"
+
+
+def _drop_tables(provider: str, tables: list[str]):
+    """Drop tables with a single round trip per batch of tables."""
+    batch_size = TEST_OUTPUT_TABLE_DROP_BATCH_SIZE
+    for start in range(0, len(tables), batch_size):
+        batch = tables[start : start + batch_size]
+        if provider == "bigquery":
+            bq_client().query(
+                ";\n".join(f"DROP TABLE IF EXISTS {table}" for table in batch)
+            ).result()
+        elif provider == "snowflake":
+            cur = sf_client().cursor()
+            try:
+                cur.execute(
+                    ";\n".join(f"DROP TABLE IF EXISTS {table}" for table in batch),
+                    num_statements=len(batch),
+                )
+            finally:
+                cur.close()
+        elif provider == "oracle":
+            drop_statements = "\n".join(
+                f"BEGIN EXECUTE IMMEDIATE 'DROP TABLE {table} PURGE'; "
+                "EXCEPTION WHEN OTHERS THEN NULL; END;"
+                for table in batch
+            )
+            with or_pool().acquire() as connection:
+                connection.cursor().execute(f"BEGIN\n{drop_statements}\nEND;")
+        else:
+            raise ValueError(f"Unknown provider: {provider}")
+
+
+def _drop_output_tables(provider: str, tables: list[str]):
+    """Drop the output tables of the tests, only warning if they can't be dropped."""
+    if not tables or test_engine == "local":
+        # The tables of the local engine are only kept in memory
+        return
+    if verbose:
+        print(f"Dropping {len(tables)} test output tables...")
+    try:
+        _drop_tables(provider, tables)
+    except Exception as e:
+        print(f"Warning: could not drop the test output tables: {e}")
+
+
+def _arrow_to_dataframe(arrow_table) -> pd.DataFrame:
+    """Convert an Arrow table read from BigQuery to a pandas DataFrame.
+
+    Scalar columns get the same dtypes as `RowIterator.to_dataframe()`, while
+    nested (ARRAY and STRUCT) columns are converted to Python lists and dicts
+    in a single pass, instead of holding numpy arrays.
+    """
+    import db_dtypes
+    import pandas as pd
+    import pyarrow as pa
+
+    def types_mapper(arrow_type):
+        if pa.types.is_integer(arrow_type):
+            return pd.Int64Dtype()
+        elif pa.types.is_boolean(arrow_type):
+            return pd.BooleanDtype()
+        elif pa.types.is_date32(arrow_type):
+            return db_dtypes.DateDtype()
+        elif pa.types.is_time64(arrow_type):
+            return db_dtypes.TimeDtype()
+        return None
+
+    nested_columns = [
+        field.name for field in arrow_table.schema if pa.types.is_nested(field.type)
+    ]
+    scalar_columns = [
+        name for name in arrow_table.column_names if name not in nested_columns
+    ]
+    if scalar_columns:
+        df = arrow_table.select(scalar_columns).to_pandas(types_mapper=types_mapper)
+    else:
+        df = pd.DataFrame(index=pd.RangeIndex(arrow_table.num_rows))
+    for column in nested_columns:
+        df[column] = pd.Series(
+            arrow_table.column(column).to_pylist(), index=df.index, dtype=object
+        )
+
+    return df[arrow_table.column_names]
+
+
+def _fetch_output_bq(table_name: str) -> pd.DataFrame:
+    # Read the output table directly, through the Storage Read API when it's
+    # available
+    rows = bq_client().list_rows(table_name.replace("`", ""))
+    arrow_table = rows.to_arrow(bqstorage_client=bq_storage_client())
+    return _arrow_to_dataframe(arrow_table)
+
+
+def _fetch_output_sf(table_name: str) -> pd.DataFrame:
+    cur = sf_client().cursor()
+    cur.execute(f"SELECT * FROM {table_name}")
+
+    df = cur.fetch_pandas_all()
+
+    # Convert column names to lowercase for consistency with BigQuery
+    df.columns = [col.lower() for col in df.columns]
+
+    if not df.empty:
+        for column in df.columns:
+            # Check if this looks like a JSON string that should be parsed
+            sample_value = df.iloc[0][column]
+            if isinstance(sample_value, str) and (
+                sample_value.strip().startswith("[")
+                or sample_value.strip().startswith("{")
+            ):
+                try:
+                    # Parse JSON strings back to proper structures
+                    df[column] = df[column].apply(
+                        lambda x: json.loads(x)
+                        if isinstance(x, str) and x.strip()
+                        else x
+                    )
+                except (json.JSONDecodeError, ValueError):
+                    # If JSON parsing fails, leave as string
+                    pass
+
+    return df
+
+
+def _fetch_output_oracle(table_name: str) -> pd.DataFrame:
+    import pandas as pd
+
+    # Each fetch takes its own connection, so outputs are read concurrently
+    with or_pool().acquire() as connection:
+        cur = connection.cursor()
+        cur.execute(f"SELECT * FROM {table_name}")
+        # Fetch results and convert to DataFrame
+        columns = [col[0].lower() for col in cur.description]
+        rows = cur.fetchall()
+    return pd.DataFrame(rows, columns=columns)
+
+
+def _run_query(
+    statements: list,
+    component: dict,
+    provider: str,
+    tables: dict,
+    store: Optional[ResultStore] = None,
+) -> dict[str, pd.DataFrame | dict]:
+    """Run the statements of a test and fetch all of its outputs.
+
+    The outputs are fetched concurrently once the statements have finished.
+    With a `store`, each output is written to it as soon as it arrives, and
+    the reference to the stored output is returned instead of the DataFrame.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    if verbose:
+        for stmt in statements:
+            print(stmt)
+
+    if test_engine == "local":
+        # The provider is the SQL dialect of the component
+        _run_statements_local(statements, component, provider)
+        fetch_output = functools.partial(_fetch_output_local, provider=provider)
+    elif provider == "bigquery":
+        # BigQuery can handle a single statement with several queries
+        combined_query = ";\n\n".join(statements)
+        query_job = bq_client().query(combined_query)
+        _ = query_job.result()
+        fetch_output = _fetch_output_bq
+    elif provider == "snowflake":
+        cur = sf_client().cursor()
+        # Snowflake requires a single query per statement
+        for statement in statements:
+            cur.execute(statement)
+        fetch_output = _fetch_output_sf
+    elif provider == "oracle":
+        # Tests may run concurrently, so each one takes its own connection.
+        # It's released before fetching the outputs, so that a test never
+        # holds a connection while waiting for another one
+        with or_pool().acquire() as connection:
+            cur = connection.cursor()
+            # Oracle requires a single query per statement
+            for statement in statements:
+                cur.execute(statement)
+        fetch_output = _fetch_output_oracle
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+
+    outputs = {}
+    with ThreadPoolExecutor(max_workers=max(len(component["outputs"]), 1)) as executor:
+        futures = {
+            executor.submit(fetch_output, tables[output["name"]]): output["name"]
+            for output in component["outputs"]
+        }
+        for future in as_completed(futures):
+            output = future.result()
+            if store is not None:
+                output = store.write_output(output)
+            outputs[futures[future]] = output
+
+    # Keep the outputs in the order in which the component declares them
+    results = dict()
+    for output in component["outputs"]:
+        results[output["name"]] = outputs[output["name"]]
+
+    return results
+
+
+class ResultStore:
+    """On-disk store of the outputs of the tests, shared with the pytest session.
+
+    Each output DataFrame is written to its own Arrow IPC file as soon as it's
+    fetched, so the outputs of the whole suite are never held in memory at
+    once. The test results then reference the stored outputs, and are saved
+    with the extension metadata in an index file. Outputs are memory-mapped
+    and read back one at a time, when their test runs.
+
+    Object columns that don't convert losslessly to Arrow (mixed types, NaN
+    next to strings, nested values...) are stored as JSON strings, and
+    decoded when read. Decimals are stored as text, so that each value keeps
+    its own scale.
+    """
+
+    INDEX_FILENAME = "index.json"
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def write_output(self, df: pd.DataFrame) -> dict:
+        """Write an output to the store and return the reference to it."""
+        import pandas as pd
+        import pyarrow as pa
+
+        json_columns = []
+        decimal_columns = []
+        for column in df.columns:
+            if df[column].dtype != "object":
+                continue
+            try:
+                arrow_type = pa.array(df[column].tolist(), from_pandas=False).type
+            except pa.ArrowException:
+                arrow_type = None
+            if arrow_type is None or pa.types.is_nested(arrow_type):
+                json_columns.append(column)
+            elif pa.types.is_decimal(arrow_type):
+                # Arrow gives all the decimals of a column the same scale
+                # (2 would come back as 2.00000), so they are kept as text
+                decimal_columns.append(column)
+        if json_columns or decimal_columns:
+            df = df.copy()
+            for column in json_columns:
+                # pd.NA becomes None, as it does in DataFrame.to_dict()
+                df[column] = [
+                    json.dumps(None if value is pd.NA else value, default=str)
+                    for value in df[column]
+                ]
+            for column in decimal_columns:
+                df[column] = [
+                    None if pd.isna(value) else str(value) for value in df[column]
+                ]
+
+        path = os.path.join(self.folder, f"{uuid4().hex}.arrow")
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+        return {
+            "path": path,
+            "json_columns": json_columns,
+            "decimal_columns": decimal_columns,
+        }
+
+    @staticmethod
+    def read_output(output: pd.DataFrame | dict) -> pd.DataFrame:
+        """Read a stored output (outputs that weren't stored are returned as is)."""
+        from decimal import Decimal
+
+        import pyarrow as pa
+
+        if not isinstance(output, dict):
+            return output
+
+        with pa.memory_map(output["path"]) as source:
+            df = pa.ipc.open_file(source).read_all().to_pandas()
+        for column in output["json_columns"]:
+            df[column] = [json.loads(value) for value in df[column]]
+        for column in output.get("decimal_columns", []):
+            df[column] = [
+                None if value is None else Decimal(value) for value in df[column]
+            ]
+        return df
+
+    def write_index(self, metadata: dict, results: dict) -> None:
+        """Save the metadata and the test results referencing the stored outputs."""
+        _write_json_atomically(
+            os.path.join(self.folder, self.INDEX_FILENAME),
+            {"metadata": metadata, "results": results},
+        )
+
+    def read_index(self) -> tuple[dict, dict]:
+        """Return the metadata and the test results saved with `write_index`."""
+        with open(os.path.join(self.folder, self.INDEX_FILENAME)) as f:
+            index = json.load(f)
+        return index["metadata"], index["results"]
+
+
+def test(component, no_deploy=False, incremental=False, jobs=1):
+    """Run the pytest-based tests."""
+    import shutil
+
+    import pytest
+
+    store = ResultStore(tempfile.mkdtemp(prefix="carto_test_results_"))
+    try:
+        # Step 1: Prepare all test data, writing the outputs to the store
+        prepare_test_data(
+            component,
+            no_deploy=no_deploy,
+            incremental=incremental,
+            jobs=jobs,
+            store=store,
+        )
+        store.write_index(_metadata_cache, _test_results_cache)
+
+        # Set environment variable so pytest can find the result store
+        os.environ["PYTEST_TEST_DATA_DIR"] = store.folder
+
+        # Set component filter for pytest
+        if component:
+            os.environ["PYTEST_COMPONENT_FILTER"] = component
+
+        # Step 2: Start pytest session
+        print("Running pytest-based extension tests...")
+
+        # Configure pytest arguments based on environment
+        if is_ci_environment():
+            # In CI: use -vv by default for detailed output
+            pytest_args = [
+                "-vv",
+                "--tb=short",
+                __file__ + "::test_extension_components",
+            ]
+            print("CI environment detected: using verbose pytest output")
+        else:
+            # Locally: capture user flags from command line and pass them to pytest
+            pytest_args = _build_pytest_args_from_user_flags()
+            pytest_args.append(__file__ + "::test_extension_components")
+            if pytest_args == [__file__ + "::test_extension_components"]:
+                # No user flags provided, use default
+                pytest_args = [
+                    "-v",
+                    "--tb=short",
+                    __file__ + "::test_extension_components",
+                ]
+
+        retcode = pytest.main(pytest_args)
+
+        if retcode == 0:
+            print("Extension correctly tested with pytest.")
+        else:
+            print(f"Pytest testing failed with exit code {retcode}")
+            exit(retcode)
+    finally:
+        # Clean up the result store
+        shutil.rmtree(store.folder, ignore_errors=True)
+        if "PYTEST_TEST_DATA_DIR" in os.environ:
+            del os.environ["PYTEST_TEST_DATA_DIR"]
+        if "PYTEST_COMPONENT_FILTER" in os.environ:
+            del os.environ["PYTEST_COMPONENT_FILTER"]
+
+
+def _build_pytest_args_from_user_flags():
+    """Build pytest arguments from user command line flags.
+
+    Pass all flags that are not used by the script itself to pytest.
+    """
+    pytest_args = []
+    skip_next = False
+
+    for i, arg in enumerate(argv[1:], 1):  # Skip script name
+        if skip_next:
+            # This argument is a value for a previous flag, skip it
+            skip_next = False
+            continue
+
+        # Skip the action argument (first positional argument after script name)
+        if i == 1 and arg in ["test"]:
+            continue
+
+        # Skip script-specific flags and their values
+        if arg in ["-c", "--component", "-j", "--jobs", "--engine"]:
+            skip_next = True  # Skip the next argument (the value)
+            continue
+        elif arg.split("=")[0] in ["--component", "--jobs", "--engine"]:
+            continue  # Flag and value in a single argument
+        elif arg in [
+            "--verbose",
+            "--no-deploy",
+            "--no-cache",
+            "--incremental",
+            "--write-schema",
+        ]:
+            continue  # Skip boolean flags of the script
+
+        # Pass everything else to pytest
+        pytest_args.append(arg)
+
+    return pytest_args
+
+
+# Pytest-based testing functions
+_test_results_cache = None
+_metadata_cache = None
+
+
+def prepare_test_data(
+    component=None, no_deploy=False, incremental=False, jobs=1, store=None
+):
+    """Run all SQL and collect test data.
+
+    The outputs are written to `store` when one is given, and kept in memory
+    otherwise.
+    """
+    global _test_results_cache, _metadata_cache
+    from tqdm import tqdm
+
+    _metadata_cache = create_metadata()
+    if not no_deploy and test_engine != "local":
+        deploy(None, incremental)
+
+    # Filter components first, then calculate total number of tests for progress bar
+    components_to_test = _metadata_cache["components"]
+    if component:
+        components_to_test = [
+            c for c in _metadata_cache["components"] if c["name"] == component
+        ]
+
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    components_folder = os.path.join(current_folder, "components")
+
+    total_tests = 0
+    for comp in components_to_test:
+        component_folder = os.path.join(components_folder, comp["name"])
+        test_configuration_file = os.path.join(component_folder, "test", "test.json")
+        if not os.path.exists(test_configuration_file):
+            print(
+                f"Warning: Test configuration file not found for component '{comp['name']}' at {test_configuration_file}"
+            )
+            continue
+        with open(test_configuration_file, "r") as f:
+            test_configurations = json.loads(
+                substitute_vars(
+                    f.read(), _metadata_cache["provider"], test_configuration_file
+                )
+            )
+        total_tests += len(test_configurations)
+
+    # Use progress bar locally, detailed logging in CI
+    if is_ci_environment():
+        print(
+            f"CI environment detected: Running {total_tests} SQL tests with detailed logging"
+        )
+        _test_results_cache = _get_test_results(
+            _metadata_cache, component, use_ci_logging=True, jobs=jobs, store=store
         )
     elif not verbose:
         with tqdm(total=total_tests, desc="Running SQL tests", unit="test") as pbar:
             _test_results_cache = _get_test_results(
-                _metadata_cache, component, progress_bar=pbar
+                _metadata_cache, component, progress_bar=pbar, jobs=jobs, store=store
+            )
+    else:
+        _test_results_cache = _get_test_results(
+            _metadata_cache, component, jobs=jobs, store=store
+        )
+
+
+def load_test_cases():
+    """Generate test cases from pre-collected data."""
+    # Load the index of the result store if available (outputs are only
+    # read when their test runs)
+    test_data_folder = os.environ.get("PYTEST_TEST_DATA_DIR")
+    component_filter = os.environ.get("PYTEST_COMPONENT_FILTER")
+
+    if test_data_folder and os.path.exists(test_data_folder):
+        metadata_cache, test_results_cache = ResultStore(test_data_folder).read_index()
+    else:
+        # Fallback: prepare data if file not available
+        global _test_results_cache, _metadata_cache
+        if _test_results_cache is None or _metadata_cache is None:
+            prepare_test_data()
+        metadata_cache = _metadata_cache
+        test_results_cache = _test_results_cache
+
+    test_cases = []
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    components_folder = os.path.join(current_folder, "components")
+
+    for component in metadata_cache["components"]:
+        # Apply component filter if specified
+        if component_filter and component["name"] != component_filter:
+            continue
+        component_folder = os.path.join(components_folder, component["name"])
+
+        # Load test configuration to get test_sorting parameter
+        test_configuration_file = os.path.join(component_folder, "test", "test.json")
+        if not os.path.exists(test_configuration_file):
+            print(
+                f"Warning: Test configuration file not found for component '{component['name']}' at {test_configuration_file}"
+            )
+            continue
+        with open(test_configuration_file, "r") as f:
+            test_configurations = json.loads(
+                substitute_vars(
+                    f.read(), metadata_cache["provider"], test_configuration_file
+                )
             )
+
+        # Create a mapping of test_id to test configuration
+        test_config_map = {str(config["id"]): config for config in test_configurations}
+
+        for test_id, outputs in test_results_cache[component["name"]].items():
+            test_folder = os.path.join(component_folder, "test", "fixtures")
+            test_filename = os.path.join(test_folder, f"{test_id}.json")
+            skip_outputs = outputs["skip_output"]
+
+            # Results test case (skip if test_id starts with "skip_", skip output if table in skip_outputs)
+            output_names = []
+            for mode in ["dry", "full"]:
+                if mode in outputs:
+                    outputs[mode] = {
+                        k: v for k, v in outputs[mode].items() if k not in skip_outputs
+                    }
+                    output_names.append(list(outputs[mode].keys()))
+            output_names = list(
+                set(item for sublist in output_names for item in sublist)
+            )
+            outputs.pop("skip_output", None)
+
+            # Get test configuration for this test_id
+            test_config = test_config_map.get(str(test_id), {})
+            test_sorting = test_config.get("test_sorting", True)
+
+            # Schema test case
+            test_cases.append(
+                {
+                    "test_type": "schema",
+                    "component": component,
+                    "test_id": test_id,
+                    "outputs": outputs,
+                    "test_sorting": test_sorting,
+                    "provider": metadata_cache["provider"],
+                    "test_name": f"schema_{component['name']}_{test_id}",
+                }
+            )
+
+            # Results test case (skip if test_id starts with "skip_")
+            if not str(test_id).startswith("skip_"):
+                test_cases.append(
+                    {
+                        "test_type": "results",
+                        "component": component,
+                        "test_id": test_id,
+                        "outputs": outputs,
+                        "test_filename": test_filename,
+                        "test_sorting": test_sorting,
+                        "provider": metadata_cache["provider"],
+                        "test_name": f"results_{component['name']}_{test_id}__{'_'.join(output_names)}",
+                    }
+                )
+
+    return test_cases
+
+
+def pytest_generate_tests(metafunc):
+    """Generate test cases dynamically for pytest."""
+    if metafunc.function.__name__ == "test_extension_components":
+        test_cases = load_test_cases()
+        metafunc.parametrize("test_case", test_cases, ids=lambda tc: tc["test_name"])
+
+
+def test_extension_components(test_case):
+    """Parametrized test function that runs all component tests."""
+    if test_case["test_type"] == "schema":
+        # Test schema consistency
+        for output_name, dry_output in test_case["outputs"]["dry"].items():
+            dry_output = ResultStore.read_output(dry_output)
+            full_output = ResultStore.read_output(
+                test_case["outputs"]["full"][output_name]
+            )
+            dry_schema = set(dry_output.dtypes.astype(str).to_dict().keys())
+            full_schema = set(full_output.dtypes.astype(str).to_dict().keys())
+            assert (
+                dry_schema == full_schema
+            ), f"Schema mismatch in {test_case['component']['title']} - {test_case['test_id']} - {output_name}"
+
+    elif test_case["test_type"] == "results":
+        # Test results match expected
+        with open(test_case["test_filename"], "r") as f:
+            expected = json.loads(
+                substitute_vars(
+                    f.read(), test_case["provider"], test_case["test_filename"]
+                )
+            )
+
+        for output_name, test_result_df in test_case["outputs"]["full"].items():
+            test_result_df = ResultStore.read_output(test_result_df)
+            expected_output = expected[output_name]
+
+            # Normalize first
+            expected_normalized = normalize_json(expected_output, decimal_places=3)
+            result_normalized = normalize_dataframe(test_result_df, decimal_places=3)
+
+            # Apply sorting after normalization when test_sorting is False
+            if not test_case["test_sorting"]:
+                expected_normalized = _sorted_json(expected_normalized)
+                result_normalized = _sorted_json(result_normalized)
+
+            # Use unordered comparison for order-independent testing
+            differences = compare_unordered(expected_normalized, result_normalized)
+            assert differences is None, f"Mismatch in {output_name}: {differences}"
+
+
+def dataframe_to_dict(df: pd.DataFrame) -> list[dict[str, Any]]:
+    """Uniformly convert a pandas DataFrame to a neste structure.
+
+    This function ensures that, once calling `to_dict` on a Python DataFrames,
+    only primitive Python types are stored in it. BigQuery tends to download
+    the of `ARRAY<...>` columns as np.ndarray, which can generate errors when
+    capturing or testing. This functions handles that conversion.
+    """
+    import numpy as np
+    for column, dtype in df.dtypes.to_dict().items():
+        if dtype == "object":
+            try:
+                value = df.iloc[0].loc[column]
+            except IndexError:
+                break
+
+            if isinstance(value, np.ndarray):
+                # Convert from numpy to primitive types
+                df[column] = df[column].apply(lambda arr: arr.tolist())
+
+    output = [
+        {str(column): value for column, value in row.items()}
+        for row in df.to_dict(orient="records")
+    ]
+
+    return output
+
+
+def check_schema(dry_result, full_result) -> bool:
+    """Compare two different DataFrames two have the same columns."""
+    dry_schema = dry_result.dtypes.astype(str).to_dict()
+    full_schema = full_result.dtypes.astype(str).to_dict()
+    if dry_schema.keys() == full_schema.keys():
+        return True
     else:
-        _test_results_cache = _get_test_results(_metadata_cache, component)
+        if verbose:
+            print(f"{dry_schema.keys()=}")
+            print(f"{full_schema.keys()=}")
+        return False
 
 
-def load_test_cases():
-    """Generate test cases from pre-collected data."""
-    # Load test data from file if available
-    test_data_file = os.environ.get("PYTEST_TEST_DATA_FILE")
-    component_filter = os.environ.get("PYTEST_COMPONENT_FILTER")
+def normalize_json(original, decimal_places=3):
+    """Ensure that the input for a test is in an uniform format.
+
+    This function takes an input and generates a new version of it that does
+    comply with an uniform format, including the precision of the floats.
+    """
+
+    # GOTCHA: dump and load to pass all values through the JSON parser, to
+    # prevent any mismatch in types that cannot be inferred (i.e. Timestamp)
+    original = json.loads(json.dumps(original, default=_json_default))
+    rows = _sorted_json(original)
+
+    # Decide once per column whether its strings can be geometries, so that
+    # the values of other columns are never parsed, and parse the geometries
+    # of those columns all at once
+    geometry_columns = _geometry_columns(rows)
+    geometry_wkts = _geometry_strings_to_wkt(
+        value
+        for row in rows
+        for column, value in row.items()
+        if column in geometry_columns and isinstance(value, str)
+    )
+
+    processed = list()
+    for row in rows:
+        processed.append(
+            {
+                column: geometry_wkts.get(value, value)
+                if column in geometry_columns and isinstance(value, str)
+                else normalize_element(value, decimal_places, parse_geometry=False)
+                for column, value in row.items()
+            }
+        )
+
+    return processed
+
+
+def normalize_dataframe(df: pd.DataFrame, decimal_places=3) -> list[dict]:
+    """Normalize a DataFrame, column by column.
+
+    The result is the same as `normalize_json(dataframe_to_dict(df))`, but
+    each column is processed as a whole: floats are rounded with numpy, and
+    the other columns are converted once per distinct value. Only nested
+    values (lists and dicts) are normalized one by one.
+    """
+    columns = {
+        str(column): _normalize_column(df[column], decimal_places)
+        for column in df.columns
+    }
+    names = sorted(columns)
+    return [
+        dict(zip(names, values)) for values in zip(*(columns[name] for name in names))
+    ]
+
+
+def _normalize_column(series: pd.Series, decimal_places: int) -> list:
+    import numpy as np
+    import pandas as pd
+
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind == "f":
+        values = series.to_numpy()
+        normalized = np.round(values, decimal_places).astype(object)
+        normalized[np.isnan(values)] = "nan"
+        return normalized.tolist()
+    elif isinstance(dtype, np.dtype) and dtype.kind in "iub":
+        return series.tolist()
+
+    values = series.to_numpy(dtype=object)
+    if dtype == "object" and len(values) and isinstance(values[0], np.ndarray):
+        # Same conversion as dataframe_to_dict()
+        for i, value in enumerate(values):
+            if isinstance(value, np.ndarray):
+                values[i] = value.tolist()
+
+    # Convert each distinct value as DataFrame.to_dict() and the JSON round
+    # trip of normalize_json() would (every value, if they aren't hashable)
+    mask = pd.isna(values)
+    present = np.flatnonzero(~mask)
+    try:
+        codes, uniques = pd.factorize(values[present])
+        distinct = [_to_json_value(value) for value in uniques]
+    except TypeError:
+        codes = np.arange(len(present))
+        distinct = [_to_json_value(values[i]) for i in present]
+    nulls = {i: _to_json_value(values[i]) for i in np.flatnonzero(mask)}
+
+    # Same geometry decision as _geometry_columns()
+    strings = [
+        value for value in [*distinct, *nulls.values()] if isinstance(value, str)
+    ]
+    geometry_wkts = {}
+    if strings and all(_may_be_geometry(value) for value in strings):
+        geometry_wkts = _geometry_strings_to_wkt(strings)
+
+    def normalize(value):
+        if isinstance(value, str) and geometry_wkts:
+            return geometry_wkts.get(value, value)
+        return normalize_element(value, decimal_places, parse_geometry=False)
+
+    normalized_distinct = np.empty(len(distinct), dtype=object)
+    for i, value in enumerate(distinct):
+        normalized_distinct[i] = normalize(value)
+    normalized = np.empty(len(values), dtype=object)
+    normalized[present] = normalized_distinct[codes]
+    for i, value in nulls.items():
+        normalized[i] = normalize(value)
+
+    return normalized.tolist()
+
+
+def _json_default(obj):
+    """Serialize GeometryComparator objects as WKT, and anything else as str."""
+    if isinstance(obj, GeometryComparator):
+        return obj.to_wkt()
+    return str(obj)
+
+
+def _to_json_value(value):
+    """Convert a DataFrame cell as `to_dict()` and a JSON round trip would."""
+    import numpy as np
+    import pandas as pd
+
+    if value is pd.NA:
+        return None
+    elif isinstance(value, np.datetime64):
+        value = pd.Timestamp(value)
+    elif isinstance(value, np.timedelta64):
+        value = pd.Timedelta(value)
+    elif isinstance(value, np.generic):
+        value = value.item()
+    return json.loads(json.dumps(value, default=_json_default))
+
+
+# Cheap lexical checks for strings that may hold a WKT or GeoJSON geometry
+_WKT_PATTERN = re.compile(
+    r"\s*(POINT|LINESTRING|LINEARRING|POLYGON|MULTIPOINT|MULTILINESTRING"
+    r"|MULTIPOLYGON|GEOMETRYCOLLECTION)\s*(Z|M|ZM)?\s*(\(|EMPTY\b)",
+    re.IGNORECASE,
+)
+_GEOJSON_PATTERN = re.compile(r"\s*\{")
+
+
+def _may_be_geometry(value: str) -> bool:
+    """Tell whether a string may be a WKT or GeoJSON geometry, without parsing it."""
+    if _WKT_PATTERN.match(value):
+        return True
+    return bool(_GEOJSON_PATTERN.match(value)) and '"type"' in value
+
+
+@functools.lru_cache(maxsize=65536)
+def _geometry_string_to_wkt(value: str, rounding_precision: int = 5) -> Optional[str]:
+    """Return the normalized WKT of a geometry string, or None if it isn't one."""
+    try:
+        return GeometryComparator.from_geography_string(value).to_wkt(
+            rounding_precision
+        )
+    except ValueError:
+        return None
+
+
+def _geometry_strings_to_wkt(values) -> dict[str, str]:
+    """Map the strings that are geometries to their normalized WKT.
+
+    The distinct strings are parsed all at once.
+    """
+    strings = list(set(values))
+    comparators = GeometryComparator.from_geography_strings(strings)
+    return {
+        string: comparator.to_wkt()
+        for string, comparator in zip(strings, comparators)
+        if comparator is not None
+    }
+
+
+def _geometry_columns(rows: list[dict]) -> set[str]:
+    """Find the columns whose string values may all be geometries.
+
+    A column is only a geometry column if every one of its non-null string
+    values passes the lexical check, regardless of the order of the rows.
+    """
+    candidates = {}
+    for row in rows:
+        for column, value in row.items():
+            if isinstance(value, str) and candidates.get(column, True):
+                candidates[column] = _may_be_geometry(value)
+    return {column for column, candidate in candidates.items() if candidate}
+
+
+def normalize_element(value, decimal_places=5, parse_geometry=True):
+    """Format a single scalar value in the desired format.
+
+    Strings are converted to a normalized WKT when they hold a geometry,
+    unless `parse_geometry` is False (values nested in lists or dicts are
+    always checked).
+    """
+    import numpy as np
+
+    # Try to create geometry comparator for strings
+    if isinstance(value, str):
+        if parse_geometry and _may_be_geometry(value):
+            geometry_wkt = _geometry_string_to_wkt(value)
+            if geometry_wkt is not None:
+                return geometry_wkt
+    elif isinstance(value, dict) and "type" in value and "coordinates" in value:
+        try:
+            return GeometryComparator.from_geojson(value).to_wkt()
+        except Exception:
+            pass  # Not valid GeoJSON, continue
 
-    if test_data_file and os.path.exists(test_data_file):
-        with open(test_data_file, "rb") as f:
-            data = pickle.load(f)
-            metadata_cache = data["metadata"]
-            test_results_cache = data["results"]
+    if isinstance(value, dict):
+        return {
+            key: normalize_element(val, decimal_places) for key, val in value.items()
+        }
+    elif isinstance(value, list):
+        return [normalize_element(x, decimal_places) for x in value]
+    elif isinstance(value, float) and math.isnan(value):
+        return "nan"
+    elif isinstance(value, float):
+        # Rounded with numpy, like the float columns in normalize_dataframe()
+        return float(np.round(value, decimal_places))
+    elif value is None:
+        return "None"
     else:
-        # Fallback: prepare data if file not available
-        global _test_results_cache, _metadata_cache
-        if _test_results_cache is None or _metadata_cache is None:
-            prepare_test_data()
-        metadata_cache = _metadata_cache
-        test_results_cache = _test_results_cache
+        return value
+
+
+def _sorted_json(data):
+    """Recursively sort JSON-like structures (dicts only) to enable consistent ordering."""
+    if isinstance(data, dict):
+        return {key: _sorted_json(data[key]) for key in sorted(data)}
+    elif isinstance(data, list):
+        # Preserve all list order (important for trajectories and result rows)
+        return [_sorted_json(item) for item in data]
+    else:
+        return data
+
+
+def _hashable_json(value):
+    """Convert a JSON-like value to an equivalent hashable value."""
+    if isinstance(value, dict):
+        return frozenset(
+            (key, _hashable_json(val) if isinstance(val, (dict, list)) else val)
+            for key, val in value.items()
+        )
+    elif isinstance(value, list):
+        return tuple(
+            _hashable_json(item) if isinstance(item, (dict, list)) else item
+            for item in value
+        )
+    return value
+
+
+def compare_unordered(
+    expected: list[dict], result: list[dict], max_samples: int = 5
+) -> Optional[str]:
+    """Compare two lists of rows, regardless of their order.
+
+    Rows are compared as multisets of hashable rows, in linear time. The
+    column sets and the row counts are checked first.
+
+    Returns:
+        None if both lists have the same rows, or a description of the
+        differences, with up to `max_samples` missing and unexpected rows
+    """
+    from collections import Counter
+
+    expected_columns = set().union(*expected)
+    result_columns = set().union(*result)
+    if expected_columns != result_columns:
+        return (
+            f"missing columns {sorted(expected_columns - result_columns)}, "
+            f"unexpected columns {sorted(result_columns - expected_columns)}"
+        )
+    if len(expected) != len(result):
+        return f"expected {len(expected)} rows, got {len(result)}"
+
+    if not expected_columns:
+        return None
+
+    # Rows are keyed by the tuple of their values (or by their hashable JSON
+    # when they have nested values or lack some columns)
+    get_values = operator.itemgetter(*sorted(expected_columns))
+
+    def hashable_row(row):
+        try:
+            values = get_values(row)
+            hash(values)
+            return values
+        except (KeyError, TypeError):
+            return _hashable_json(row)
+
+    expected_rows = Counter(map(hashable_row, expected))
+    result_rows = Counter(map(hashable_row, result))
+    missing = expected_rows - result_rows
+    unexpected = result_rows - expected_rows
+    if not missing and not unexpected:
+        return None
+
+    # Find one of the original rows of each sampled row, to show them
+    sampled_rows = set(list(missing)[:max_samples]) | set(
+        list(unexpected)[:max_samples]
+    )
+    original_rows = {}
+    for row in [*expected, *result]:
+        key = hashable_row(row)
+        if key in sampled_rows:
+            original_rows.setdefault(key, row)
+
+    def samples(rows):
+        lines = [
+            f"    {original_rows[row]}" + (f" (x{count})" if count > 1 else "")
+            for row, count in list(rows.items())[:max_samples]
+        ]
+        if len(rows) > max_samples:
+            lines.append(f"    ... and {len(rows) - max_samples} more")
+        return "\n".join(lines)
+
+    return (
+        f"{sum(missing.values())} of {len(expected)} rows don't match\n"
+        f"  missing rows:\n{samples(missing)}\n"
+        f"  unexpected rows:\n{samples(unexpected)}"
+    )
+
+
+def test_output(expected, result, decimal_places=3):
+    expected = normalize_json(_sorted_json(expected), decimal_places=decimal_places)
+    result = normalize_json(_sorted_json(result), decimal_places=decimal_places)
+    return expected == result
+
+
+def capture(component, incremental=False, jobs=1):
+    from dotenv import dotenv_values
+    from tqdm import tqdm
 
-    test_cases = []
+    print("Capturing fixtures... ")
+    metadata = create_metadata()
     current_folder = os.path.dirname(os.path.abspath(__file__))
     components_folder = os.path.join(current_folder, "components")
+    if test_engine != "local":
+        deploy(None, incremental)
+    else:
+        duckdb_client()
+        if not duckdb_has_spatial:
+            # Geographies would be captured as text, and not as the warehouse
+            # returns them
+            raise Exception(
+                "Error capturing fixtures with the local engine: the DuckDB "
+                "spatial extension is not available"
+            )
 
-    for component in metadata_cache["components"]:
-        # Apply component filter if specified
-        if component_filter and component["name"] != component_filter:
-            continue
-        component_folder = os.path.join(components_folder, component["name"])
+    # Filter components first, then calculate total number of tests for progress bar
+    components_to_test = metadata["components"]
+    if component:
+        components_to_test = [
+            c for c in metadata["components"] if c["name"] == component
+        ]
 
-        # Load test configuration to get test_sorting parameter
+    total_tests = 0
+    for comp in components_to_test:
+        component_folder = os.path.join(components_folder, comp["name"])
         test_configuration_file = os.path.join(component_folder, "test", "test.json")
         if not os.path.exists(test_configuration_file):
             print(
-                f"Warning: Test configuration file not found for component '{component['name']}' at {test_configuration_file}"
+                f"Warning: Test configuration file not found for component '{comp['name']}' at {test_configuration_file}"
             )
             continue
         with open(test_configuration_file, "r") as f:
             test_configurations = json.loads(
-                substitute_vars(f.read(), metadata_cache["provider"])
+                substitute_vars(
+                    f.read(), metadata["provider"], test_configuration_file
+                )
+            )
+        total_tests += len(test_configurations)
+
+    # Run tests with progress bar
+    if not verbose:
+        with tqdm(total=total_tests, desc="Running SQL tests", unit="test") as pbar:
+            results = _get_test_results(
+                metadata, component, progress_bar=pbar, jobs=jobs
+            )
+    else:
+        results = _get_test_results(metadata, component, jobs=jobs)
+    dotenv = dotenv_values()
+
+    # Reuse the same filtered component list for results processing
+    for component in components_to_test:
+        component_folder = os.path.join(components_folder, component["name"])
+
+        # Load test configuration to get test_sorting parameter
+        test_configuration_file = os.path.join(component_folder, "test", "test.json")
+        with open(test_configuration_file, "r") as f:
+            test_configurations = json.loads(
+                substitute_vars(
+                    f.read(), metadata["provider"], test_configuration_file
+                )
             )
 
         # Create a mapping of test_id to test configuration
         test_config_map = {str(config["id"]): config for config in test_configurations}
 
-        for test_id, outputs in test_results_cache[component["name"]].items():
+        for test_id, outputs in results[component["name"]].items():
             test_folder = os.path.join(component_folder, "test", "fixtures")
+            os.makedirs(test_folder, exist_ok=True)
             test_filename = os.path.join(test_folder, f"{test_id}.json")
-            skip_outputs = outputs["skip_output"]
-
-            # Results test case (skip if test_id starts with "skip_", skip output if table in skip_outputs)
-            output_names = []
-            for mode in ["dry", "full"]:
-                if mode in outputs:
-                    outputs[mode] = {
-                        k: v for k, v in outputs[mode].items() if k not in skip_outputs
-                    }
-                    output_names.append(list(outputs[mode].keys()))
-            output_names = list(
-                set(item for sublist in output_names for item in sublist)
-            )
-            outputs.pop("skip_output", None)
+            skip_outputs = outputs.get("skip_output", [])
 
             # Get test configuration for this test_id
             test_config = test_config_map.get(str(test_id), {})
             test_sorting = test_config.get("test_sorting", True)
 
-            # Schema test case
-            test_cases.append(
-                {
-                    "test_type": "schema",
-                    "component": component,
-                    "test_id": test_id,
-                    "outputs": outputs,
-                    "test_sorting": test_sorting,
-                    "provider": metadata_cache["provider"],
-                    "test_name": f"schema_{component['name']}_{test_id}",
-                }
-            )
+            with open(test_filename, "w") as f:
+                fixture_outputs = {}
+                for output_name, output_results in outputs["full"].items():
+                    if output_name in skip_outputs:
+                        # Don't capture results for skipped outputs
+                        continue
+                    output_dict = output_results.to_dict(orient="records")
+                    # Normalize first
+                    output_dict = normalize_json(output_dict, decimal_places=3)
+                    # When test_sorting is False, sort for consistent fixture capture
+                    # (set comparison will be used during testing)
+                    if not test_sorting:
+                        output_dict = _sorted_json(output_dict)
+                    fixture_outputs[output_name] = output_dict
 
-            # Results test case (skip if test_id starts with "skip_")
-            if not str(test_id).startswith("skip_"):
-                test_cases.append(
-                    {
-                        "test_type": "results",
-                        "component": component,
-                        "test_id": test_id,
-                        "outputs": outputs,
-                        "test_filename": test_filename,
-                        "test_sorting": test_sorting,
-                        "provider": metadata_cache["provider"],
-                        "test_name": f"results_{component['name']}_{test_id}__{'_'.join(output_names)}",
-                    }
+                _write_fixture(f, fixture_outputs, dotenv)
+
+    print("Fixtures correctly captured.")
+
+
+def _orphan_output_tables(provider: str, older_than: int) -> list[str]:
+    """List the test output tables created more than `older_than` hours ago."""
+    if provider == "bigquery":
+        query = f"""
+            SELECT table_name
+            FROM {bq_workflows_temp()}.INFORMATION_SCHEMA.TABLES
+            WHERE REGEXP_CONTAINS(
+                table_name, r'^{TEST_OUTPUT_TABLE_PREFIX}[0-9a-f]{{32}}$'
+            )
+            AND creation_time
+                < TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {older_than} HOUR)
+        """
+        rows = bq_client().query(query).result()
+        return [f"{bq_workflows_temp()}.{row.table_name}" for row in rows]
+    elif provider == "snowflake":
+        database, schema = sf_workflows_temp().split(".")
+        cur = sf_client().cursor()
+        try:
+            cur.execute(
+                f"""
+                SELECT TABLE_NAME
+                FROM {database}.INFORMATION_SCHEMA.TABLES
+                WHERE TABLE_SCHEMA = %s
+                AND REGEXP_LIKE(
+                    TABLE_NAME, '{TEST_OUTPUT_TABLE_PREFIX}[0-9a-f]{{32}}', 'i'
+                )
+                AND CREATED < DATEADD(HOUR, -{older_than}, CURRENT_TIMESTAMP())
+                """,
+                (schema.upper(),),
+            )
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        return [f"{sf_workflows_temp()}.{row[0]}" for row in rows]
+    elif provider == "oracle":
+        cur = or_client().cursor()
+        try:
+            cur.execute(
+                f"""
+                SELECT object_name
+                FROM all_objects
+                WHERE owner = :owner
+                AND object_type = 'TABLE'
+                AND REGEXP_LIKE(
+                    object_name, '^{TEST_OUTPUT_TABLE_PREFIX}[0-9a-f]{{32}}$', 'i'
                 )
+                AND created < SYSDATE - :hours / 24
+                """,
+                owner=or_workflows_temp().upper(),
+                hours=older_than,
+            )
+            rows = cur.fetchall()
+        finally:
+            cur.close()
+        return [f"{or_workflows_temp()}.{row[0]}" for row in rows]
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
 
-    return test_cases
 
+def gc(older_than=TEST_OUTPUT_TABLE_EXPIRATION_HOURS):
+    """Drop the test output tables left behind by interrupted test runs.
 
-def pytest_generate_tests(metafunc):
-    """Generate test cases dynamically for pytest."""
-    if metafunc.function.__name__ == "test_extension_components":
-        test_cases = load_test_cases()
-        metafunc.parametrize("test_case", test_cases, ids=lambda tc: tc["test_name"])
+    Only the tables created more than `older_than` hours ago are dropped, so
+    the tables of the test runs in progress are kept.
+    """
+    metadata = create_metadata()
+    provider = metadata["provider"]
+    tables = _orphan_output_tables(provider, older_than)
+    if not tables:
+        print("No orphan test output tables found.")
+        return
 
+    print(f"Dropping {len(tables)} orphan test output tables...")
+    _drop_tables(provider, tables)
+    print("Orphan test output tables correctly dropped.")
 
-def test_extension_components(test_case):
-    """Parametrized test function that runs all component tests."""
-    from pytest_unordered import unordered
 
-    if test_case["test_type"] == "schema":
-        # Test schema consistency
-        for output_name, dry_output in test_case["outputs"]["dry"].items():
-            full_output = test_case["outputs"]["full"][output_name]
-            dry_schema = set(dry_output.dtypes.astype(str).to_dict().keys())
-            full_schema = set(full_output.dtypes.astype(str).to_dict().keys())
-            assert (
-                dry_schema == full_schema
-            ), f"Schema mismatch in {test_case['component']['title']} - {test_case['test_id']} - {output_name}"
+def _load_python_function(function_metadata: dict) -> dict:
+    """Run the body of a Python function (without its PEP 723 block).
 
-    elif test_case["test_type"] == "results":
-        # Test results match expected
-        with open(test_case["test_filename"], "r") as f:
-            expected = json.loads(
-                substitute_vars(f.read(), test_case["provider"])
+    Returns:
+        The namespace of the function's code, with its `main` function and
+        its optional `main_vectorized` variant
+    """
+    definition_file = function_metadata["_path"] / "src" / "definition.py"
+    if not definition_file.exists():
+        raise ValueError(
+            f"Function '{function_metadata['name']}' is not a Python function"
+        )
+    with open(definition_file, "r") as f:
+        python_code = f.read()
+    clean_python_body = _extract_pep723_metadata(python_code)["clean_python_body"]
+
+    namespace = {"__name__": f"carto_function_{function_metadata['name']}"}
+    exec(compile(clean_python_body, str(definition_file), "exec"), namespace)
+    if not callable(namespace.get("main")):
+        raise ValueError(
+            f"Python function '{function_metadata['name']}' has no main() function"
+        )
+    return namespace
+
+
+def _synthetic_kind(param_type: str) -> str:
+    """Kind of the synthetic values generated for a parameter type."""
+    param_type = param_type.split("(")[0].strip().upper()
+    if param_type in ("FLOAT", "FLOAT64", "DOUBLE", "NUMERIC", "DECIMAL", "REAL"):
+        return "float"
+    elif param_type in ("INT", "INT64", "INTEGER", "BIGINT", "NUMBER", "SMALLINT"):
+        return "int"
+    elif param_type in ("BOOL", "BOOLEAN"):
+        return "bool"
+    elif param_type in ("GEOGRAPHY", "GEOMETRY"):
+        return "geography"
+    elif param_type in ("DATE",):
+        return "date"
+    elif param_type in ("TIMESTAMP", "DATETIME"):
+        return "timestamp"
+    return "string"
+
+
+def _synthetic_value(param_type: str, row: int, rng):
+    """Generate a value of a parameter type, for functions run on synthetic rows."""
+    kind = _synthetic_kind(param_type)
+    if kind == "float":
+        return rng.uniform(-90, 90)
+    elif kind == "int":
+        return rng.randint(-1000, 1000)
+    elif kind == "bool":
+        return row % 2 == 0
+    elif kind == "geography":
+        return f"POINT({rng.uniform(-180, 180):.6f} {rng.uniform(-90, 90):.6f})"
+    elif kind == "date":
+        return f"2024-01-{row % 28 + 1:02d}"
+    elif kind == "timestamp":
+        return f"2024-01-{row % 28 + 1:02d}T{row % 24:02d}:00:00"
+    return f"value_{row}"
+
+
+def _synthetic_sql_value(param_type: str, provider: str, row: str = "n") -> str:
+    """SQL expression that generates the values of `_synthetic_value()` server-side.
+
+    Args:
+        param_type: Type of the parameter
+        provider: 'bigquery' or 'snowflake'
+        row: SQL expression with the number of the row
+    """
+    kind = _synthetic_kind(param_type)
+    if provider == "bigquery":
+        if kind == "float":
+            return "RAND() * 180 - 90"
+        elif kind == "int":
+            return "CAST(FLOOR(RAND() * 2001) AS INT64) - 1000"
+        elif kind == "bool":
+            return f"MOD({row}, 2) = 0"
+        elif kind == "geography":
+            return "ST_GEOGPOINT(RAND() * 360 - 180, RAND() * 180 - 90)"
+        elif kind == "date":
+            return f"DATE_ADD(DATE '2024-01-01', INTERVAL MOD({row}, 28) DAY)"
+        elif kind == "timestamp":
+            timestamp_type = param_type.split("(")[0].strip().upper()
+            return (
+                f"{timestamp_type}_ADD({timestamp_type} '2024-01-01', "
+                f"INTERVAL MOD({row}, 24 * 28) HOUR)"
+            )
+        return f"CONCAT('value_', CAST({row} AS STRING))"
+    elif provider == "snowflake":
+        if kind == "float":
+            return "UNIFORM(-90::FLOAT, 90::FLOAT, RANDOM())"
+        elif kind == "int":
+            return "UNIFORM(-1000, 1000, RANDOM())"
+        elif kind == "bool":
+            return f"MOD({row}, 2) = 0"
+        elif kind == "geography":
+            make_point = (
+                "ST_MAKEGEOMPOINT"
+                if param_type.strip().upper() == "GEOMETRY"
+                else "ST_MAKEPOINT"
             )
+            return (
+                f"{make_point}(UNIFORM(-180::FLOAT, 180::FLOAT, RANDOM()), "
+                f"UNIFORM(-90::FLOAT, 90::FLOAT, RANDOM()))"
+            )
+        elif kind == "date":
+            return f"DATEADD(DAY, MOD({row}, 28), '2024-01-01'::DATE)"
+        elif kind == "timestamp":
+            return f"DATEADD(HOUR, MOD({row}, 24 * 28), '2024-01-01'::TIMESTAMP)"
+        return f"'value_' || {row}"
+    raise ValueError(f"Unsupported provider: {provider}")
 
-        for output_name, test_result_df in test_case["outputs"]["full"].items():
-            output = dataframe_to_dict(test_result_df)
-            expected_output = expected[output_name]
 
-            # Normalize first
-            expected_normalized = normalize_json(expected_output, decimal_places=3)
-            result_normalized = normalize_json(output, decimal_places=3)
+def _function_input_rows(function_metadata: dict, input_file=None, rows=None):
+    """Rows of arguments for a function, read from an NDJSON file or generated.
 
-            # Apply sorting after normalization when test_sorting is False
-            if not test_case["test_sorting"]:
-                expected_normalized = _sorted_json(expected_normalized)
-                result_normalized = _sorted_json(result_normalized)
+    Rows of the file are objects with the arguments by parameter name. They
+    are repeated when more `rows` than the file has are requested.
+    """
+    import random
+
+    parameters = function_metadata.get("parameters", [])
+    if input_file is None:
+        rng = random.Random(0)
+        return [
+            [_synthetic_value(p["type"], row, rng) for p in parameters]
+            for row in range(FUNCTION_RUN_ROWS if rows is None else rows)
+        ]
 
-            # Use unordered comparison for order-independent testing
-            assert result_normalized == unordered(expected_normalized)
+    with open(input_file, "r") as f:
+        file_rows = [
+            [record.get(p["name"]) for p in parameters]
+            for record in (json.loads(line) for line in f if line.strip())
+        ]
+    if not file_rows:
+        raise ValueError(f"{input_file} has no rows")
+    if rows is None:
+        return file_rows
+    return [file_rows[row % len(file_rows)] for row in range(rows)]
 
 
-def dataframe_to_dict(df: pd.DataFrame) -> list[dict[str, Any]]:
-    """Uniformly convert a pandas DataFrame to a neste structure.
+def _print_latency_histogram(latencies_ns: list[int], width: int = 40):
+    """Print percentiles and a histogram (in 1-2-5 buckets) of call latencies."""
+    latencies_us = sorted(latency / 1000 for latency in latencies_ns)
 
-    This function ensures that, once calling `to_dict` on a Python DataFrames,
-    only primitive Python types are stored in it. BigQuery tends to download
-    the of `ARRAY<...>` columns as np.ndarray, which can generate errors when
-    capturing or testing. This functions handles that conversion.
+    def percentile(fraction):
+        index = min(int(fraction * len(latencies_us)), len(latencies_us) - 1)
+        return latencies_us[index]
+
+    print(
+        "Latency per call (µs): "
+        f"p50 {percentile(0.5):.1f}, p90 {percentile(0.9):.1f}, "
+        f"p99 {percentile(0.99):.1f}, max {latencies_us[-1]:.1f}"
+    )
+
+    bounds = [1]
+    steps = (2, 2.5, 2)
+    while bounds[-1] < latencies_us[-1]:
+        bounds.append(bounds[-1] * steps[(len(bounds) - 1) % len(steps)])
+    counts = [0] * len(bounds)
+    bucket = 0
+    for latency in latencies_us:
+        while latency > bounds[bucket]:
+            bucket += 1
+        counts[bucket] += 1
+    first = next(i for i, count in enumerate(counts) if count)
+    for bound, count in zip(bounds[first:], counts[first:]):
+        bar = "#" * math.ceil(width * count / len(latencies_us))
+        print(f"  <= {bound:>9g} µs {bar:<{width}} {count}")
+
+
+def _same_function_result(expected, result) -> bool:
+    """Compare two results of a function, with NaN and None as the same NULL.
+
+    NumPy arrays of floats hold NULLs as NaN, so a vectorized function returns
+    NaN for the rows where `main()` returns None.
     """
-    for column, dtype in df.dtypes.to_dict().items():
-        if dtype == "object":
-            try:
-                value = df.iloc[0].loc[column]
-            except IndexError:
-                break
 
-            if isinstance(value, np.ndarray):
-                # Convert from numpy to primitive types
-                df[column] = df[column].apply(lambda arr: arr.tolist())
+    def is_null(value):
+        return value is None or (isinstance(value, float) and math.isnan(value))
 
-    output = [
-        {str(column): value for column, value in row.items()}
-        for row in df.to_dict(orient="records")
-    ]
+    if is_null(expected) or is_null(result):
+        return is_null(expected) and is_null(result)
+    if isinstance(expected, float) or isinstance(result, float):
+        try:
+            return math.isclose(expected, result, rel_tol=1e-9)
+        except TypeError:
+            return False
+    return expected == result
 
-    return output
 
+def run_function(function_name, input_file=None, rows=None, batch_size=None):
+    """Run a Python function locally and measure its cost per row.
 
-def check_schema(dry_result, full_result) -> bool:
-    """Compare two different DataFrames two have the same columns."""
-    dry_schema = dry_result.dtypes.astype(str).to_dict()
-    full_schema = full_result.dtypes.astype(str).to_dict()
-    if dry_schema.keys() == full_schema.keys():
-        return True
+    `main()` is called once per row, timing every call. If the function also
+    defines `main_vectorized()`, it's called with NumPy arrays of up to
+    `batch_size` rows, and its results are checked against the ones of
+    `main()`.
+    """
+    import time
+
+    import numpy as np
+
+    functions = {f["name"]: f for f in discover_functions()}
+    if function_name not in functions:
+        raise ValueError(f"Function '{function_name}' not found in functions/")
+    function_metadata = functions[function_name]
+    namespace = _load_python_function(function_metadata)
+    input_rows = _function_input_rows(function_metadata, input_file, rows)
+
+    print(f"Running {function_name} over {len(input_rows)} rows...")
+    main_function = namespace["main"]
+    results = []
+    latencies_ns = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for arguments in input_rows:
+        call_start = clock()
+        results.append(main_function(*arguments))
+        latencies_ns.append(clock() - call_start)
+    elapsed = (clock() - start) / 1e9
+    print(
+        f"main: {len(input_rows)} rows in {elapsed:.3f} s "
+        f"({len(input_rows) / elapsed:,.0f} rows/s)"
+    )
+    _print_latency_histogram(latencies_ns)
+
+    # Vectorized functions without main_vectorized() call main() with arrays,
+    # like their handler in Snowflake does
+    vectorized_function = namespace.get("main_vectorized")
+    if not callable(vectorized_function):
+        if not function_metadata.get("vectorized"):
+            return
+        vectorized_function = main_function
+    vectorized_name = vectorized_function.__name__
+
+    if batch_size is None:
+        batch_size = len(input_rows)
+    columns = [np.array(column) for column in zip(*input_rows)]
+    vectorized_results = []
+    start = clock()
+    for offset in range(0, len(input_rows), batch_size):
+        batch = [column[offset : offset + batch_size] for column in columns]
+        batch_results = np.asarray(vectorized_function(*batch))
+        if batch_results.shape != (len(batch[0]),):
+            raise ValueError(
+                f"{vectorized_name}() returned an array of shape "
+                f"{batch_results.shape} for a batch of {len(batch[0])} rows"
+            )
+        vectorized_results.extend(batch_results.tolist())
+    vectorized_elapsed = (clock() - start) / 1e9
+    print(
+        f"{vectorized_name} (vectorized): {len(input_rows)} rows in "
+        f"{vectorized_elapsed:.3f} s "
+        f"({len(input_rows) / vectorized_elapsed:,.0f} rows/s, batches of "
+        f"{batch_size}), {elapsed / vectorized_elapsed:.1f}x faster than main"
+    )
+
+    mismatches = sum(
+        not _same_function_result(expected, result)
+        for expected, result in zip(results, vectorized_results)
+    )
+    if mismatches:
+        print(
+            f"Warning: {vectorized_name}() with arrays and main() give different "
+            f"results for {mismatches} rows"
+        )
+
+
+def _function_language(function_metadata: dict) -> str:
+    """Language of a function, inferred from its definition file."""
+    for extension, language in [("sql", "SQL"), ("py", "Python"), ("js", "JavaScript")]:
+        if (function_metadata["_path"] / "src" / f"definition.{extension}").exists():
+            return language
+    return ""
+
+
+def _numbers_query(provider: str, count: int) -> str:
+    """Query that generates the numbers from 0 to `count` - 1, in column `n`."""
+    if provider == "bigquery":
+        # Arrays are limited in size, so numbers are generated by blocks of 1000
+        blocks = math.ceil(count / 1000)
+        return (
+            f"SELECT block * 1000 + item AS n "
+            f"FROM UNNEST(GENERATE_ARRAY(0, {blocks - 1})) AS block, "
+            f"UNNEST(GENERATE_ARRAY(0, 999)) AS item "
+            f"WHERE block * 1000 + item < {count}"
+        )
+    elif provider == "snowflake":
+        return f"SELECT SEQ8() AS n FROM TABLE(GENERATOR(ROWCOUNT => {count}))"
+    raise ValueError(f"Unsupported provider: {provider}")
+
+
+def _function_benchmark_query(
+    function_metadata: dict, provider: str, destination: str, rows: int
+) -> str:
+    """Query that calls a deployed function over `rows` synthetic rows.
+
+    The arguments are generated server-side for each row, and the results are
+    counted so that only a single row is returned.
+    """
+    arguments = ", ".join(
+        _synthetic_sql_value(p["type"], provider)
+        for p in function_metadata.get("parameters", [])
+    )
+    function_name = function_metadata["name"].upper()
+    if provider == "bigquery":
+        function_name = f"{destination}.`{function_name}`"
     else:
-        if verbose:
-            print(f"{dry_schema.keys()=}")
-            print(f"{full_schema.keys()=}")
-        return False
+        function_name = f"{destination}.{function_name}"
+    return (
+        f"SELECT COUNT({function_name}({arguments}))\n"
+        f"FROM ({_numbers_query(provider, rows)})"
+    )
+
+
+def _run_benchmark_statements_bq(statements: list[str]) -> dict:
+    """Run statements as a script without the query cache.
+
+    Returns:
+        The duration of the run, and the bytes processed and slot time of all
+        its queries
+    """
+    import time
+
+    from google.cloud import bigquery
+
+    job_config = bigquery.QueryJobConfig(use_query_cache=False)
+    start = time.perf_counter()
+    query_job = bq_client().query(";\n\n".join(statements), job_config=job_config)
+    query_job.result()
+    return {
+        "seconds": time.perf_counter() - start,
+        "bytes": query_job.total_bytes_processed or 0,
+        "slot_ms": query_job.slot_millis or 0,
+    }
+
+
+def _run_benchmark_statements_sf(statements: list[str]) -> dict:
+    """Run statements without the result cache.
+
+    The queries of the run (including the ones run by the procedures it
+    calls) are found in the query history by a query tag. The credits are
+    estimated from the execution time of the statements and the size of the
+    warehouse, plus the cloud services credits of all the queries.
+
+    Returns:
+        The duration of the run, and the bytes scanned and credits used by
+        all its queries
+    """
+    import time
+
+    query_tag = f"carto_benchmark_{uuid4().hex}"
+    statement_ids = set()
+    cur = sf_client().cursor()
+    cur.execute("ALTER SESSION SET USE_CACHED_RESULT = FALSE")
+    try:
+        cur.execute(f"ALTER SESSION SET QUERY_TAG = '{query_tag}'")
+        start = time.perf_counter()
+        for statement in statements:
+            cur.execute(statement)
+            cur.fetchall()
+            statement_ids.add(cur.sfqid)
+        seconds = time.perf_counter() - start
+    finally:
+        # The session is shared with the rest of the tool
+        cur.execute("ALTER SESSION UNSET QUERY_TAG, USE_CACHED_RESULT")
+
+    cur.execute(
+        "SELECT QUERY_ID, BYTES_SCANNED, EXECUTION_TIME, WAREHOUSE_SIZE, "
+        "CREDITS_USED_CLOUD_SERVICES "
+        "FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION("
+        "RESULT_LIMIT => 10000)) WHERE QUERY_TAG = %s",
+        (query_tag,),
+    )
+    history = cur.fetchall()
+    bytes_scanned = 0
+    credits = 0.0
+    for query_id, query_bytes, execution_ms, warehouse_size, cloud_credits in history:
+        bytes_scanned += query_bytes or 0
+        credits += float(cloud_credits or 0)
+        # Statements that call procedures include the time of their queries
+        if query_id in statement_ids:
+            size = re.sub(r"[^0-9A-Z]", "", (warehouse_size or "").upper())
+            credits += (
+                (execution_ms or 0)
+                / 3_600_000
+                * SF_WAREHOUSE_CREDITS_PER_HOUR.get(size, 0)
+            )
+    return {"seconds": seconds, "bytes": bytes_scanned, "credits": credits}
+
+
+def _run_benchmark_statements(provider: str, statements: list[str]) -> dict:
+    if verbose:
+        for statement in statements:
+            print(statement)
+    if provider == "bigquery":
+        return _run_benchmark_statements_bq(statements)
+    elif provider == "snowflake":
+        return _run_benchmark_statements_sf(statements)
+    raise NotImplementedError(f"Benchmarks are not supported for {provider}")
 
 
-def normalize_json(original, decimal_places=3):
-    """Ensure that the input for a test is in an uniform format.
+def _print_table(header: list[str], rows: list[list[str]]):
+    """Print rows of strings as a table with aligned columns."""
+    widths = [
+        max(len(str(row[i])) for row in [header, *rows]) for i in range(len(header))
+    ]
+    for row in [header, *rows]:
+        cells = [
+            str(cell).ljust(width) if i == 0 else str(cell).rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))
+        ]
+        print("  ".join(cells).rstrip())
 
-    This function takes an input and generates a new version of it that does
-    comply with an uniform format, including the precision of the floats.
-    """
 
-    # GOTCHA: dump and load to pass all values through the JSON parser, to
-    # prevent any mismatch in types that cannot be inferred (i.e. Timestamp)
-    # But first, convert any GeometryComparator objects to WKT strings
-    def serialize_with_geom(obj):
-        if isinstance(obj, GeometryComparator):
-            return obj.to_wkt()
-        return str(obj)
+def benchmark_functions(
+    function_name=None,
+    rows=None,
+    repeats=FUNCTION_BENCHMARK_REPEATS,
+    destination=None,
+):
+    """Call the deployed functions over synthetic rows and report their cost.
 
-    original = json.loads(json.dumps(original, default=serialize_with_geom))
+    Each function is called `repeats` times over `rows` rows generated from
+    its parameter types, and the median wall time, bytes processed and slot
+    time (BigQuery) or estimated credits (Snowflake) of the runs are reported
+    per million rows. Caches are disabled, so that every run is computed.
+    """
+    import statistics
 
-    processed = list()
-    for row in _sorted_json(original):
-        processed.append(
-            {
-                column: normalize_element(value, decimal_places)
-                for column, value in row.items()
-            }
+    metadata = create_metadata()
+    provider = metadata["provider"]
+    if provider == "oracle":
+        raise NotImplementedError(
+            "User-defined functions (UDFs) are not supported for Oracle"
         )
+    if provider == "bigquery":
+        destination = destination or bq_workflows_temp()
+        if not (destination.startswith("`") and destination.endswith("`")):
+            destination = f"`{destination}`"
+        cost_metric, cost_header, cost_format = "slot_ms", "slot-ms/M rows", ",.0f"
+    else:
+        destination = destination or sf_workflows_temp()
+        cost_metric, cost_header, cost_format = "credits", "credits/M rows", ".4g"
+
+    functions = [
+        f
+        for f in discover_functions(extension_metadata=metadata)
+        if f.get("type", "function") != "procedure"
+        and (function_name is None or f["name"] == function_name)
+    ]
+    if function_name and not functions:
+        raise ValueError(f"Function '{function_name}' not found in functions/")
+    if rows is None:
+        rows = FUNCTION_BENCHMARK_ROWS
+    print(
+        f"Benchmarking {len(functions)} functions in {destination} over "
+        f"{rows:,} rows ({repeats} runs each)..."
+    )
 
-    return processed
+    table = []
+    per_million = 1e6 / rows
+    for function_metadata in functions:
+        query = _function_benchmark_query(
+            function_metadata, provider, destination, rows
+        )
+        try:
+            runs = [
+                _run_benchmark_statements(provider, [query]) for _ in range(repeats)
+            ]
+        except Exception as e:
+            print(
+                f"Warning: Error benchmarking function "
+                f"'{function_metadata['name']}': {e}"
+            )
+            continue
+        seconds = statistics.median(run["seconds"] for run in runs)
+        megabytes = statistics.median(run["bytes"] for run in runs) / 1e6
+        cost = statistics.median(run[cost_metric] for run in runs)
+        table.append(
+            [
+                function_metadata["name"],
+                _function_language(function_metadata),
+                f"{seconds:.2f}",
+                f"{min(run['seconds'] for run in runs):.2f}",
+                f"{seconds * per_million:.2f}",
+                f"{megabytes * per_million:,.1f}",
+                format(cost * per_million, cost_format),
+            ]
+        )
 
+    _print_table(
+        [
+            "function",
+            "language",
+            "median s",
+            "min s",
+            "s/M rows",
+            "MB/M rows",
+            cost_header,
+        ],
+        table,
+    )
 
-def normalize_element(value, decimal_places=5):
-    """Format a single scalar value in the desired format."""
-    # Try to create geometry comparator for strings
-    if isinstance(value, str):
-        try:
-            return GeometryComparator.from_geography_string(value).to_wkt()
-        except ValueError:
-            pass  # Not a geometry string, continue
-    elif isinstance(value, dict) and "type" in value and "coordinates" in value:
+
+def _fetch_rows(provider: str, query: str) -> list[tuple]:
+    if verbose:
+        print(query)
+    if provider == "bigquery":
+        return [tuple(row.values()) for row in bq_client().query(query).result()]
+    elif provider == "snowflake":
+        cur = sf_client().cursor()
         try:
-            return GeometryComparator.from_geojson(value).to_wkt()
-        except Exception:
-            pass  # Not valid GeoJSON, continue
+            cur.execute(query)
+            return cur.fetchall()
+        finally:
+            cur.close()
+    raise ValueError(f"Unsupported provider: {provider}")
 
-    if isinstance(value, dict):
-        return {
-            key: normalize_element(val, decimal_places) for key, val in value.items()
-        }
-    elif isinstance(value, list):
-        return [normalize_element(x, decimal_places) for x in value]
-    elif isinstance(value, float) and math.isnan(value):
-        return "nan"
-    elif isinstance(value, float):
-        return round(value, decimal_places)
-    elif value is None:
-        return "None"
-    else:
-        return value
 
+def _table_columns(provider: str, workflows_temp: str, table_id: str) -> list:
+    """Columns of a test table, as (quoted name, kind, exact type) tuples.
 
-def _sorted_json(data):
-    """Recursively sort JSON-like structures (dicts only) to enable consistent ordering."""
-    if isinstance(data, dict):
-        return {key: _sorted_json(data[key]) for key in sorted(data)}
-    elif isinstance(data, list):
-        # Preserve all list order (important for trajectories and result rows)
-        return [_sorted_json(item) for item in data]
+    The kind is 'int', 'float', 'string' or 'geography', or None for the
+    columns of other types. The exact type is the type of the 'float' columns
+    with fixed-point numbers (NUMERIC, NUMBER with decimals...), or None.
+    """
+    columns = []
+    if provider == "bigquery":
+        table = bq_client().get_table(f"{workflows_temp.strip('`')}.{table_id}")
+        for field in table.schema:
+            kind = None
+            exact_type = None
+            if field.mode != "REPEATED":
+                kind = {
+                    "INTEGER": "int",
+                    "INT64": "int",
+                    "FLOAT": "float",
+                    "FLOAT64": "float",
+                    "NUMERIC": "float",
+                    "BIGNUMERIC": "float",
+                    "STRING": "string",
+                    "GEOGRAPHY": "geography",
+                }.get(field.field_type)
+            if kind == "float" and field.field_type in ["NUMERIC", "BIGNUMERIC"]:
+                exact_type = field.field_type
+                if field.precision is not None:
+                    exact_type += f"({field.precision}, {field.scale or 0})"
+            columns.append((f"`{field.name}`", kind, exact_type))
+    elif provider == "snowflake":
+        database, schema = workflows_temp.split(".")
+        cur = sf_client().cursor()
+        try:
+            cur.execute(
+                "SELECT COLUMN_NAME, DATA_TYPE, NUMERIC_PRECISION, NUMERIC_SCALE "
+                f"FROM {database}.INFORMATION_SCHEMA.COLUMNS "
+                "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s "
+                "ORDER BY ORDINAL_POSITION",
+                (schema.upper(), table_id.upper()),
+            )
+            for name, data_type, precision, numeric_scale in cur.fetchall():
+                exact_type = None
+                if data_type in ["NUMBER", "DECIMAL", "NUMERIC"]:
+                    kind = "int" if not numeric_scale else "float"
+                    if numeric_scale:
+                        exact_type = f"NUMBER({precision}, {numeric_scale})"
+                else:
+                    kind = {
+                        "FLOAT": "float",
+                        "TEXT": "string",
+                        "GEOGRAPHY": "geography",
+                    }.get(data_type)
+                columns.append((f'"{name}"', kind, exact_type))
+        finally:
+            cur.close()
     else:
-        return data
+        raise ValueError(f"Unsupported provider: {provider}")
+    return columns
 
 
-def test_output(expected, result, decimal_places=3):
-    expected = normalize_json(_sorted_json(expected), decimal_places=decimal_places)
-    result = normalize_json(_sorted_json(result), decimal_places=decimal_places)
-    return expected == result
+def _scaled_table_query(
+    provider: str, source: str, target: str, columns: list, scale: int
+) -> str:
+    """Query that creates a copy of a test table, replicated to `scale` rows.
+
+    The rows of the table are copied as many times as needed. Columns whose
+    values are all different (probably keys) are kept unique in the copies:
+    integers are shifted by a multiple of their range, and strings get the
+    number of the copy as a suffix. Floats and points are jittered, so that
+    the copies aren't exact duplicates, and fixed-point numbers are cast back
+    to their type. The first copy keeps the original values.
+    """
+    stats = []
+    for name, kind, _ in columns:
+        if kind in ["int", "string"]:
+            stats.append(
+                f"COUNT(DISTINCT {name}) = COUNT({name}) AND COUNT({name}) > 1"
+            )
+        else:
+            stats.append("FALSE")
+        stats.append(f"MAX({name}) - MIN({name}) + 1" if kind == "int" else "0")
+    row_count, *stats = _fetch_rows(
+        provider, f"SELECT COUNT(*), {', '.join(stats)} FROM {source}"
+    )[0]
+    if not row_count:
+        raise ValueError(f"Test table {source} has no rows to replicate")
+
+    copy = "copies.n"
+    if provider == "bigquery":
+        condition = "IF"
+        random = "RAND()"
+        suffix = "CONCAT({column}, '_', CAST(copies.n AS STRING))"
+        is_point = "ST_GEOMETRYTYPE({column}) = 'ST_Point'"
+        make_point = "ST_GEOGPOINT"
+    else:
+        condition = "IFF"
+        random = "UNIFORM(0::FLOAT, 1::FLOAT, RANDOM())"
+        suffix = "{column} || '_' || copies.n"
+        is_point = "ST_ASWKT({column}) LIKE 'POINT%'"
+        make_point = "ST_MAKEPOINT"
+
+    select = []
+    for (name, kind, exact_type), is_key, span in zip(
+        columns, stats[::2], stats[1::2]
+    ):
+        column = f"src.{name}"
+        if kind == "int" and is_key:
+            expression = f"{column} + {copy} * {span}"
+        elif kind == "string" and is_key:
+            expression = (
+                f"{condition}({copy} = 0, {column}, {suffix.format(column=column)})"
+            )
+        elif kind == "float":
+            jittered = f"{column} * (1 + ({random} - 0.5) * 1e-6)"
+            if exact_type:
+                jittered = f"CAST({jittered} AS {exact_type})"
+            expression = f"{condition}({copy} = 0, {column}, {jittered})"
+        elif kind == "geography":
+            expression = (
+                f"{condition}({copy} > 0 AND {is_point.format(column=column)}, "
+                f"{make_point}(ST_X({column}) + ({random} - 0.5) * 1e-4, "
+                f"ST_Y({column}) + ({random} - 0.5) * 1e-4), {column})"
+            )
+        else:
+            expression = column
+        select.append(f"{expression} AS {name}")
+
+    copies = math.ceil(scale / row_count)
+    query = (
+        f"SELECT {', '.join(select)}\n"
+        f"FROM {source} AS src, ({_numbers_query(provider, copies)}) AS copies\n"
+        # Only the last copy is cut short
+        f"ORDER BY {copy}\n"
+        f"LIMIT {scale}"
+    )
+    if provider == "bigquery":
+        return (
+            f"CREATE TABLE {target}\n"
+            "OPTIONS(expiration_timestamp = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), "
+            f"INTERVAL {TEST_OUTPUT_TABLE_EXPIRATION_HOURS} HOUR))\n"
+            f"AS {query}"
+        )
+    return f"CREATE TABLE {target} AS {query}"
 
 
-def capture(component):
-    print("Capturing fixtures... ")
-    metadata = create_metadata()
-    current_folder = os.path.dirname(os.path.abspath(__file__))
-    components_folder = os.path.join(current_folder, "components")
-    deploy(None)
+def _scaling_exponent(scales: list[int], values: list[float]) -> Optional[float]:
+    """Slope of the least squares fit of the values to the scales, in log-log.
 
-    # Filter components first, then calculate total number of tests for progress bar
-    components_to_test = metadata["components"]
-    if component:
-        components_to_test = [
-            c for c in metadata["components"] if c["name"] == component
-        ]
+    A value that grows linearly with the scale has an exponent of 1, and one
+    that grows quadratically an exponent of 2.
+    """
+    points = [
+        (math.log(scale), math.log(value))
+        for scale, value in zip(scales, values)
+        if value > 0
+    ]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if not variance:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+
+def benchmark_component(
+    component_name,
+    scales=COMPONENT_BENCHMARK_SCALES,
+    repeats=COMPONENT_BENCHMARK_REPEATS,
+    no_deploy=False,
+) -> bool:
+    """Run the full run of a component on its test tables, scaled up.
+
+    For each test case, the input tables (but not the setup tables) are
+    replicated in the data warehouse to each number of rows in `scales`
+    (see `_scaled_table_query()`), and the full run of the component is run
+    `repeats` times on them. The median duration, bytes processed and rows of
+    the outputs at each scale are reported, with their scaling exponents.
+
+    The exponents are fitted to all the scales and measured between the two
+    largest ones, where the fixed cost of each run matters least. Test cases
+    with an exponent of the duration or bytes processed above
+    SUPERLINEAR_SCALING_EXPONENT are flagged.
 
-    total_tests = 0
-    for comp in components_to_test:
-        component_folder = os.path.join(components_folder, comp["name"])
-        test_configuration_file = os.path.join(component_folder, "test", "test.json")
-        if not os.path.exists(test_configuration_file):
-            print(
-                f"Warning: Test configuration file not found for component '{comp['name']}' at {test_configuration_file}"
-            )
-            continue
-        with open(test_configuration_file, "r") as f:
-            test_configurations = json.loads(
-                substitute_vars(f.read(), metadata["provider"])
-            )
-        total_tests += len(test_configurations)
+    Returns:
+        False if any test case of the component scales super-linearly
+    """
+    import statistics
 
-    # Run tests with progress bar
-    if not verbose:
-        with tqdm(total=total_tests, desc="Running SQL tests", unit="test") as pbar:
-            results = _get_test_results(metadata, component, progress_bar=pbar)
+    metadata = create_metadata()
+    provider = metadata["provider"]
+    if provider == "bigquery":
+        upload_function = _upload_test_table_bq
+        workflows_temp = bq_workflows_temp()
+    elif provider == "snowflake":
+        upload_function = _upload_test_table_sf
+        workflows_temp = sf_workflows_temp()
     else:
-        results = _get_test_results(metadata, component)
-    dotenv = dotenv_values()
+        raise NotImplementedError(
+            f"Component benchmarks are not supported for {provider}"
+        )
+    components = [c for c in metadata["components"] if c["name"] == component_name]
+    if not components:
+        raise ValueError(f"Component '{component_name}' not found")
+    component = components[0]
+    if not no_deploy:
+        deploy(None)
 
-    # Reuse the same filtered component list for results processing
-    for component in components_to_test:
-        component_folder = os.path.join(components_folder, component["name"])
+    current_folder = os.path.dirname(os.path.abspath(__file__))
+    test_folder = os.path.join(current_folder, "components", component_name, "test")
+    test_configuration_file = os.path.join(test_folder, "test.json")
+    with open(test_configuration_file, "r") as f:
+        test_configurations = json.loads(
+            substitute_vars(f.read(), provider, test_configuration_file)
+        )
+    input_tables = _upload_test_tables(
+        upload_function, test_folder, _setup_tables_map(test_configurations)
+    )
+    table_inputs = [i["name"] for i in component["inputs"] if i["type"] == "Table"]
 
-        # Load test configuration to get test_sorting parameter
-        test_configuration_file = os.path.join(component_folder, "test", "test.json")
-        with open(test_configuration_file, "r") as f:
-            test_configurations = json.loads(
-                substitute_vars(f.read(), metadata["provider"])
+    print(
+        f"Benchmarking component '{component_name}' with input tables of "
+        f"{', '.join(f'{scale:,}' for scale in scales)} rows "
+        f"({repeats} runs each)..."
+    )
+    scales_linearly = True
+    table_columns = {}  # filename -> columns
+    scaled_tables = {}  # (filename, scale) -> table_name
+    created_tables = []
+    try:
+        for test_configuration in test_configurations:
+            filenames = sorted(
+                {
+                    test_configuration["inputs"][name]
+                    for name in table_inputs
+                    if test_configuration["inputs"][name] in input_tables
+                }
             )
+            if not filenames:
+                print(
+                    f"Warning: Test {test_configuration['id']} has no input "
+                    f"tables to scale, skipping it"
+                )
+                continue
 
-        # Create a mapping of test_id to test configuration
-        test_config_map = {str(config["id"]): config for config in test_configurations}
-
-        for test_id, outputs in results[component["name"]].items():
-            test_folder = os.path.join(component_folder, "test", "fixtures")
-            os.makedirs(test_folder, exist_ok=True)
-            test_filename = os.path.join(test_folder, f"{test_id}.json")
-            skip_outputs = outputs.get("skip_output", [])
-
-            # Get test configuration for this test_id
-            test_config = test_config_map.get(str(test_id), {})
-            test_sorting = test_config.get("test_sorting", True)
-
-            with open(test_filename, "w") as f:
-                fixture_outputs = {}
-                for output_name, output_results in outputs["full"].items():
-                    if output_name in skip_outputs:
-                        # Don't capture results for skipped outputs
+            results = []
+            for scale in scales:
+                for filename in filenames:
+                    if (filename, scale) in scaled_tables:
                         continue
-                    output_dict = output_results.to_dict(orient="records")
-                    # Normalize first
-                    output_dict = normalize_json(output_dict, decimal_places=3)
-                    # When test_sorting is False, sort for consistent fixture capture
-                    # (set comparison will be used during testing)
-                    if not test_sorting:
-                        output_dict = _sorted_json(output_dict)
-                    fixture_outputs[output_name] = output_dict
+                    if filename not in table_columns:
+                        table_columns[filename] = _table_columns(
+                            provider, workflows_temp, input_tables[filename]
+                        )
+                    table_id = f"{TEST_OUTPUT_TABLE_PREFIX}{uuid4().hex}"
+                    created_tables.append(f"{workflows_temp}.{table_id}")
+                    _fetch_rows(
+                        provider,
+                        _scaled_table_query(
+                            provider,
+                            f"{workflows_temp}.{input_tables[filename]}",
+                            f"{workflows_temp}.{table_id}",
+                            table_columns[filename],
+                            scale,
+                        ),
+                    )
+                    scaled_tables[(filename, scale)] = table_id
 
-                contents = json.dumps(fixture_outputs, indent=2, default=str)
-                contents = substitute_keys(contents, dotenv=dotenv)
-                f.write(contents)
+                param_values = _test_case_param_values(
+                    component,
+                    test_configuration,
+                    workflows_temp,
+                    {
+                        **input_tables,
+                        **{name: scaled_tables[(name, scale)] for name in filenames},
+                    },
+                )
+                runs = []
+                for _ in range(repeats):
+                    full_run_tables = {
+                        output["name"]: _output_table_name(workflows_temp)
+                        for output in component["outputs"]
+                    }
+                    created_tables.extend(full_run_tables.values())
+                    full_run_params = (
+                        param_values
+                        + [f"'{tablename}'" for tablename in full_run_tables.values()]
+                        + [False, _test_case_env_vars(test_configuration)]
+                    )
+                    run = _run_benchmark_statements(
+                        provider,
+                        _build_query(
+                            workflows_temp,
+                            component["procedureName"],
+                            full_run_params,
+                            full_run_tables,
+                            provider,
+                        ),
+                    )
+                    run["output_rows"] = sum(
+                        _fetch_rows(provider, f"SELECT COUNT(*) FROM {table}")[0][0]
+                        for table in full_run_tables.values()
+                    )
+                    runs.append(run)
+                results.append(
+                    {
+                        metric: statistics.median(run[metric] for run in runs)
+                        for metric in ["seconds", "bytes", "output_rows"]
+                    }
+                )
 
-    print("Fixtures correctly captured.")
+            print(f"\nTest {test_configuration['id']} ({', '.join(filenames)}):")
+            _print_table(
+                ["input rows", "seconds", "MB processed", "output rows"],
+                [
+                    [
+                        f"{scale:,}",
+                        f"{result['seconds']:.2f}",
+                        f"{result['bytes'] / 1e6:,.1f}",
+                        f"{result['output_rows']:,.0f}",
+                    ]
+                    for scale, result in zip(scales, results)
+                ],
+            )
+            exponents = []
+            for metric, label in [
+                ("seconds", "duration"),
+                ("bytes", "bytes processed"),
+                ("output_rows", "output rows"),
+            ]:
+                values = [result[metric] for result in results]
+                fitted = _scaling_exponent(scales, values)
+                largest = _scaling_exponent(scales[-2:], values[-2:])
+                fitted_str = "-" if fitted is None else f"{fitted:.2f}"
+                largest_str = "-" if largest is None else f"{largest:.2f}"
+                print(
+                    f"Scaling exponent of the {label}: {fitted_str} (fitted), "
+                    f"{largest_str} (largest scales)"
+                )
+                if metric != "output_rows":
+                    exponents += [e for e in [fitted, largest] if e is not None]
+            if exponents and max(exponents) > SUPERLINEAR_SCALING_EXPONENT:
+                scales_linearly = False
+                print(
+                    f"Warning: Test {test_configuration['id']} of component "
+                    f"'{component_name}' scales super-linearly (exponent "
+                    f"{max(exponents):.2f} > {SUPERLINEAR_SCALING_EXPONENT})"
+                )
+    finally:
+        _drop_output_tables(provider, created_tables)
+
+    return scales_linearly
 
 
 def package():
@@ -2677,9 +6462,24 @@ parser.add_argument(
     "action",
     nargs=1,
     type=str,
-    choices=["package", "deploy", "test", "capture", "check", "update"],
+    choices=[
+        "package",
+        "deploy",
+        "test",
+        "capture",
+        "check",
+        "update",
+        "gc",
+        "run-function",
+        "benchmark",
+    ],
+)
+parser.add_argument(
+    "-c",
+    "--component",
+    help="Choose one component (for benchmark action, benchmark it instead of the functions)",
+    type=str,
 )
-parser.add_argument("-c", "--component", help="Choose one component", type=str)
 parser.add_argument(
     "-d",
     "--destination",
@@ -2688,33 +6488,228 @@ parser.add_argument(
     required=False,
 )
 parser.add_argument("-v", "--verbose", help="Verbose mode", action="store_true")
+parser.add_argument(
+    "-j",
+    "--jobs",
+    help="Number of tests to run concurrently (for test and capture actions)",
+    type=int,
+    default=1,
+)
+parser.add_argument(
+    "--incremental",
+    help="Only recreate the procedures and functions that changed since the previous deployment",
+    action="store_true",
+)
+parser.add_argument(
+    "--no-cache",
+    help="Regenerate all metadata and SQL code instead of reusing the build cache",
+    action="store_true",
+)
 parser.add_argument(
     "--no-deploy",
-    help="Skip deployment before testing (for test action only)",
+    help="Skip deployment before testing (for test action, and benchmark action with --component)",
+    action="store_true",
+)
+parser.add_argument(
+    "-f",
+    "--function",
+    help="Function to run (for run-function and benchmark actions)",
+    type=str,
+)
+parser.add_argument(
+    "--input",
+    help="NDJSON file with the arguments of each call, by parameter name (for run-function action only)",
+    type=str,
+)
+parser.add_argument(
+    "--rows",
+    help=f"Number of rows to run the function on (for run-function and benchmark actions, default: all the rows of --input, or {FUNCTION_RUN_ROWS} generated rows for run-function and {FUNCTION_BENCHMARK_ROWS} for benchmark)",
+    type=int,
+)
+parser.add_argument(
+    "--batch-size",
+    help="Rows per call to main_vectorized(), if the function defines it (for run-function action only, default: all the rows)",
+    type=int,
+)
+parser.add_argument(
+    "--repeats",
+    help=f"Number of runs of each query (for benchmark action only, default: {FUNCTION_BENCHMARK_REPEATS} for functions and {COMPONENT_BENCHMARK_REPEATS} for components)",
+    type=int,
+)
+parser.add_argument(
+    "--scales",
+    help=f"Comma-separated numbers of rows to scale the input tables to (for benchmark action with --component only, default: {','.join(str(scale) for scale in COMPONENT_BENCHMARK_SCALES)})",
+    type=str,
+)
+parser.add_argument(
+    "--older-than",
+    help=f"Only drop the tables created more than this number of hours ago (for gc action only, default: {TEST_OUTPUT_TABLE_EXPIRATION_HOURS})",
+    type=int,
+)
+parser.add_argument(
+    "--engine",
+    help="Run the tests in the data warehouse, or locally in an embedded DuckDB database (for test and capture actions)",
+    choices=["warehouse", "local"],
+    default="warehouse",
+)
+parser.add_argument(
+    "--allow-local-capture",
+    help="Confirm capturing fixtures with --engine local, which must be captured again in the data warehouse before they're committed (for capture action only)",
+    action="store_true",
+)
+parser.add_argument(
+    "--write-schema",
+    help="Save the inferred schema of test tables as .schema files (for test and capture actions)",
     action="store_true",
 )
 
-# Only parse args and run if this file is executed directly
-if __name__ == "__main__":
-    args = parser.parse_args()
+
+def main(arguments=None):
+    global verbose, use_build_cache, write_test_schemas, test_engine
+
+    args = parser.parse_args(arguments)
     action = args.action[0]
     verbose = args.verbose
-    if args.component and action not in ["capture", "test"]:
-        parser.error("Component can only be used with 'capture' and 'test' actions")
-    if args.destination and action not in ["deploy"]:
-        parser.error("Destination can only be used with 'deploy' action")
-    if args.no_deploy and action != "test":
-        parser.error("--no-deploy can only be used with 'test' action")
+    use_build_cache = not args.no_cache
+    write_test_schemas = args.write_schema
+    test_engine = args.engine
+    if args.component and action not in ["capture", "test", "benchmark"]:
+        parser.error(
+            "Component can only be used with 'capture', 'test' and 'benchmark' actions"
+        )
+    if args.destination and action not in ["deploy", "benchmark"]:
+        parser.error(
+            "Destination can only be used with 'deploy' and 'benchmark' actions"
+        )
+    if args.no_deploy and action != "test" and not (
+        action == "benchmark" and args.component
+    ):
+        parser.error(
+            "--no-deploy can only be used with 'test' action, and 'benchmark' "
+            "action with --component"
+        )
+    if args.jobs != 1 and action not in ["capture", "test"]:
+        parser.error("--jobs can only be used with 'capture' and 'test' actions")
+    if args.jobs < 1:
+        parser.error("--jobs must be a positive number")
+    if args.incremental and action not in ["deploy", "test", "capture"]:
+        parser.error(
+            "--incremental can only be used with 'deploy', 'test' and 'capture' actions"
+        )
+    if args.incremental and args.no_deploy:
+        parser.error("--incremental can't be used with --no-deploy")
+    if args.write_schema and action not in ["capture", "test"]:
+        parser.error("--write-schema can only be used with 'capture' and 'test' actions")
+    if args.engine != "warehouse" and action not in ["capture", "test"]:
+        parser.error("--engine can only be used with 'capture' and 'test' actions")
+    if args.engine == "local" and args.incremental:
+        parser.error("--incremental can't be used with --engine local")
+    if args.allow_local_capture and (action != "capture" or args.engine != "local"):
+        parser.error(
+            "--allow-local-capture can only be used with 'capture' action and "
+            "--engine local"
+        )
+    if action == "capture" and args.engine == "local" and not args.allow_local_capture:
+        parser.error(
+            "Fixtures captured with --engine local must be captured again in the "
+            "data warehouse: pass --allow-local-capture to capture them anyway"
+        )
+    if action == "run-function" and not args.function:
+        parser.error("--function is required for 'run-function' action")
+    for option in ["input", "batch_size"]:
+        if getattr(args, option) is not None and action != "run-function":
+            parser.error(
+                f"--{option.replace('_', '-')} can only be used with 'run-function' action"
+            )
+    for option in ["function", "rows"]:
+        if getattr(args, option) is not None and action not in [
+            "run-function",
+            "benchmark",
+        ]:
+            parser.error(
+                f"--{option} can only be used with 'run-function' and 'benchmark' actions"
+            )
+    if args.repeats is not None and action != "benchmark":
+        parser.error("--repeats can only be used with 'benchmark' action")
+    if action == "benchmark" and args.component and (
+        args.function or args.rows is not None or args.destination
+    ):
+        parser.error(
+            "--function, --rows and --destination can't be used with 'benchmark' "
+            "action with --component"
+        )
+    scales = COMPONENT_BENCHMARK_SCALES
+    if args.scales is not None:
+        if action != "benchmark" or not args.component:
+            parser.error(
+                "--scales can only be used with 'benchmark' action with --component"
+            )
+        try:
+            scales = sorted({int(scale) for scale in args.scales.split(",")})
+        except ValueError:
+            parser.error("--scales must be a comma-separated list of numbers of rows")
+        if len(scales) < 2 or scales[0] < 1:
+            parser.error("--scales needs at least two different positive numbers")
+    for option in ["rows", "batch_size", "repeats"]:
+        if getattr(args, option) is not None and getattr(args, option) < 1:
+            parser.error(f"--{option.replace('_', '-')} must be a positive number")
+    if args.older_than is not None and action != "gc":
+        parser.error("--older-than can only be used with 'gc' action")
+    if args.older_than is not None and args.older_than < 0:
+        parser.error("--older-than can't be negative")
+    if args.no_cache and action in ["check", "update"]:
+        parser.error("--no-cache can't be used with 'check' and 'update' actions")
     if action == "package":
         check()
         package()
     elif action == "deploy":
-        deploy(args.destination)
+        deploy(args.destination, args.incremental)
     elif action == "test":
-        test(args.component, no_deploy=args.no_deploy)
+        test(
+            args.component,
+            no_deploy=args.no_deploy,
+            incremental=args.incremental,
+            jobs=args.jobs,
+        )
     elif action == "capture":
-        capture(args.component)
+        capture(args.component, incremental=args.incremental, jobs=args.jobs)
     elif action == "check":
         check()
     elif action == "update":
         update()
+    elif action == "run-function":
+        run_function(
+            args.function,
+            input_file=args.input,
+            rows=args.rows,
+            batch_size=args.batch_size,
+        )
+    elif action == "benchmark" and args.component:
+        if not benchmark_component(
+            args.component,
+            scales=scales,
+            repeats=(
+                COMPONENT_BENCHMARK_REPEATS if args.repeats is None else args.repeats
+            ),
+            no_deploy=args.no_deploy,
+        ):
+            exit(1)
+    elif action == "benchmark":
+        benchmark_functions(
+            args.function,
+            rows=args.rows,
+            repeats=(
+                FUNCTION_BENCHMARK_REPEATS if args.repeats is None else args.repeats
+            ),
+            destination=args.destination,
+        )
+    elif action == "gc":
+        if args.older_than is None:
+            gc()
+        else:
+            gc(older_than=args.older_than)
+
+
+# Only parse args and run if this file is executed directly
+if __name__ == "__main__":
+    main()
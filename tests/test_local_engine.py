@@ -0,0 +1,236 @@
+"""Translation and interpretation of component SQL by the local engine."""
+
+import duckdb
+import pytest
+
+from carto_extension import (
+    _call_component_local,
+    _duckdb_type_name,
+    _lex_sql,
+    _run_script_local,
+    _significant,
+    _to_duckdb_sql,
+)
+
+TRANSLATIONS = [
+    # Identifiers called like a type are columns, not types
+    (
+        "bigquery",
+        "SELECT number, string, t.datetime, bool FROM t",
+        "SELECT number, string, t.datetime, bool FROM t",
+    ),
+    (
+        "bigquery",
+        "SELECT STRING(ts) AS string FROM t",
+        "SELECT STRING(ts) AS string FROM t",
+    ),
+    # Types
+    (
+        "bigquery",
+        "SELECT CAST(a AS STRING), SAFE_CAST(b AS NUMERIC(10, 2)) FROM t",
+        "SELECT CAST(a AS VARCHAR), TRY_CAST(b AS DECIMAL(10, 2)) FROM t",
+    ),
+    (
+        "bigquery",
+        "SELECT CAST(string AS INT64) AS number FROM t",
+        "SELECT CAST(string AS BIGINT) AS number FROM t",
+    ),
+    (
+        "snowflake",
+        "SELECT number::NUMBER(10, 2), v::VARIANT FROM t",
+        "SELECT number::DECIMAL(10, 2), v::JSON FROM t",
+    ),
+    (
+        "bigquery",
+        "CREATE TABLE t (string STRING, a ARRAY<INT64>, "
+        "s STRUCT<number FLOAT64, g GEOGRAPHY>)",
+        "CREATE TABLE t (string VARCHAR, a ARRAY<BIGINT>, "
+        "s STRUCT<number DOUBLE, g GEOMETRY>)",
+    ),
+    (
+        "oracle",
+        "CREATE TABLE t (name VARCHAR2(10), geom SDO_GEOMETRY)",
+        "CREATE TABLE t (name VARCHAR(10), geom GEOMETRY)",
+    ),
+    (
+        "bigquery",
+        "ALTER TABLE t ADD COLUMN IF NOT EXISTS number FLOAT64",
+        "ALTER TABLE t ADD COLUMN IF NOT EXISTS number DOUBLE",
+    ),
+    (
+        "bigquery",
+        "DECLARE a, string STRING DEFAULT 'x'",
+        "DECLARE a, string VARCHAR DEFAULT 'x'",
+    ),
+    (
+        "bigquery",
+        "CREATE TABLE t AS SELECT string FROM s WHERE a < b",
+        "CREATE TABLE t AS SELECT string FROM s WHERE a < b",
+    ),
+    # Quoted identifiers
+    (
+        "bigquery",
+        "SELECT `string` FROM `project.dataset.table`",
+        'SELECT "string" FROM "project"."dataset"."table"',
+    ),
+    (
+        "snowflake",
+        'SELECT "Number", "a""b" FROM db.schema.t',
+        'SELECT "Number", "a""b" FROM db.schema.t',
+    ),
+    # Comments and string literals are never translated
+    (
+        "bigquery",
+        "SELECT a -- CAST(a AS STRING)\n# OPTIONS(x)\nFROM t",
+        "SELECT a  \n \nFROM t",
+    ),
+    (
+        "bigquery",
+        "SELECT a /* SAFE_CAST(a AS INT64) */ FROM t",
+        "SELECT a   FROM t",
+    ),
+    (
+        "bigquery",
+        "SELECT 'CAST(a AS STRING)', \"OPTIONS(x)\", '''it's''', r'\\n' FROM t",
+        "SELECT 'CAST(a AS STRING)', 'OPTIONS(x)', 'it''s', '\\n' FROM t",
+    ),
+    (
+        "snowflake",
+        "SELECT 'it''s ::STRING', $$NVL(a)$$ FROM t",
+        "SELECT 'it''s ::STRING', 'NVL(a)' FROM t",
+    ),
+    # Clauses, functions and bind variables
+    (
+        "bigquery",
+        "CREATE TABLE t OPTIONS (expiration_timestamp = TIMESTAMP_ADD("
+        "CURRENT_TIMESTAMP(), INTERVAL 1 DAY)) AS SELECT * EXCEPT (a) FROM s",
+        "CREATE TABLE t  AS SELECT * EXCLUDE (a) FROM s",
+    ),
+    (
+        "bigquery",
+        "SELECT ST_GEOGPOINT(x, y), GENERATE_UUID() FROM t",
+        "SELECT ST_Point(x, y), uuid() FROM t",
+    ),
+    (
+        "oracle",
+        "SELECT SDO_UTIL.TO_WKTGEOMETRY(geom), NVL(a, b) FROM t",
+        "SELECT ST_AsText(geom), coalesce(a, b) FROM t",
+    ),
+    (
+        "snowflake",
+        "CREATE TRANSIENT TABLE IDENTIFIER(:output) AS SELECT IFF(a, :value, b) "
+        "FROM t",
+        "CREATE  TABLE out AS SELECT if(a, 'it''s', b) FROM t",
+    ),
+]
+
+
+@pytest.mark.parametrize("dialect,code,expected", TRANSLATIONS)
+def test_translation(dialect, code, expected):
+    variables = {"output": "out", "value": "it's"}
+    assert _to_duckdb_sql(code, dialect, variables) == expected
+
+
+@pytest.mark.parametrize(
+    "type_name,expected",
+    [
+        ("STRING", "VARCHAR"),
+        ("NUMERIC(10, 2)", "DECIMAL(10, 2)"),
+        (
+            "ARRAY<STRUCT<string STRING, n INT64>>",
+            "ARRAY<STRUCT<string VARCHAR, n BIGINT>>",
+        ),
+        ("DATE", "DATE"),
+    ],
+)
+def test_type_names(type_name, expected):
+    assert _duckdb_type_name(type_name) == expected
+
+
+@pytest.mark.parametrize(
+    "dialect,code",
+    [
+        ("bigquery", "SELECT 'a"),
+        ("snowflake", 'SELECT "a'),
+        ("bigquery", "SELECT `a"),
+    ],
+)
+def test_unterminated_quotes(dialect, code):
+    with pytest.raises(ValueError, match="Unterminated"):
+        _lex_sql(code, dialect)
+
+
+def test_unknown_bind_variable():
+    with pytest.raises(ValueError, match="Unknown variable :missing"):
+        _to_duckdb_sql("SELECT :missing", "snowflake")
+
+
+@pytest.fixture
+def cursor():
+    connection = duckdb.connect()
+    yield connection.cursor()
+    connection.close()
+
+
+def test_script(cursor):
+    script = """
+        DECLARE name STRING DEFAULT 'result';
+        DECLARE value STRING;
+        SET value = CONCAT('a', "b");
+        BEGIN
+            EXECUTE IMMEDIATE 'CREATE TABLE ' || name || ' AS SELECT '
+                || "'" || value || "'" || ' AS string';
+        END;
+        RETURN;
+        CREATE TABLE skipped AS SELECT 1 AS a;
+    """
+    assert _run_script_local(cursor, script, "bigquery", {})
+    assert cursor.execute("SELECT string FROM result").fetchall() == [("ab",)]
+    assert not cursor.execute(
+        "SELECT * FROM duckdb_tables() WHERE table_name = 'skipped'"
+    ).fetchall()
+
+
+def test_script_declare_section(cursor):
+    script = """
+        DECLARE
+            suffix VARCHAR DEFAULT '_out';
+        BEGIN
+            LET name VARCHAR := 't' || suffix;
+            EXECUTE IMMEDIATE 'CREATE TABLE ' || name || ' (number NUMBER(4, 1))';
+        END;
+    """
+    assert not _run_script_local(cursor, script, "snowflake", {})
+    assert cursor.execute("DESCRIBE t_out").fetchall()[0][:2] == (
+        "number",
+        "DECIMAL(4,1)",
+    )
+
+
+def test_script_control_flow_is_not_supported(cursor):
+    with pytest.raises(NotImplementedError, match="IF statements"):
+        _run_script_local(cursor, "IF a THEN SELECT 1; END IF;", "bigquery", {})
+
+
+def test_call_component(cursor):
+    cursor.execute("CREATE TABLE input AS SELECT 1 AS number, 'a' AS string")
+    component = {
+        "name": "template",
+        "procedureName": "template_proc",
+        "inputs": [{"name": "input_table"}, {"name": "value"}],
+        "outputs": [{"name": "output_table"}],
+    }
+    call = (
+        "CALL `project.dataset`.template_proc("
+        "'input', 'fixed', 'output', FALSE, NULL)"
+    )
+    tokens = _significant(_lex_sql(call, "bigquery"))
+    _call_component_local(cursor, tokens, component, "bigquery")
+    assert cursor.execute("SELECT * FROM output").fetchall() == [(1, "a", "fixed")]
+
+
+def test_call_other_procedure(cursor):
+    component = {"name": "template", "procedureName": "template_proc"}
+    tokens = _significant(_lex_sql("CALL other_proc('a')", "bigquery"))
+    with pytest.raises(ValueError, match="can't call other_proc"):
+        _call_component_local(cursor, tokens, component, "bigquery")
@@ -0,0 +1,48 @@
+"""Round trip of test outputs through the on-disk ResultStore."""
+
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+from shapely import wkt
+
+from carto_extension import ResultStore, normalize_dataframe
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(str(tmp_path))
+
+
+def round_trip(store, df):
+    return ResultStore.read_output(store.write_output(df))
+
+
+def test_decimals_keep_their_scale(store):
+    df = pd.DataFrame({"value": [Decimal("2"), Decimal("1.25"), None]})
+    result = round_trip(store, df)
+    assert result["value"].tolist() == [Decimal("2"), Decimal("1.25"), None]
+    assert normalize_dataframe(result) == normalize_dataframe(df)
+
+
+def test_datetimes(store):
+    df = pd.DataFrame(
+        {
+            "timestamp": pd.to_datetime(["2024-01-01T10:00:00Z", None], utc=True),
+            "datetime": [datetime(2024, 1, 1, 10, 30), None],
+            "aware": [datetime(2024, 1, 1, tzinfo=timezone.utc), None],
+            "date": [date(2024, 1, 1), None],
+        }
+    )
+    assert normalize_dataframe(round_trip(store, df)) == normalize_dataframe(df)
+
+
+def test_geometries(store):
+    df = pd.DataFrame(
+        {
+            "wkt": ["POINT (1 1)", None],
+            "geometry": [wkt.loads("POINT (1 1)"), wkt.loads("LINESTRING (0 0, 1 1)")],
+        }
+    )
+    assert normalize_dataframe(round_trip(store, df)) == normalize_dataframe(df)